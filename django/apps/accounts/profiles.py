@@ -0,0 +1,77 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+PROFILE_KEY = 'profile:{}'
+# 资料缓存的过期时间（秒）；用户资料变化时会主动失效
+PROFILE_CACHE_TIMEOUT = 60 * 60
+
+
+def _load_profile(user_id):
+    from .models import User
+    from .serializers import UserSerializer
+    try:
+        user = User.objects.get(id=user_id)
+    except User.DoesNotExist:
+        return None
+    return {
+        **UserSerializer(user).data,
+        'is_active': user.is_active,
+    }
+
+
+def get_profile(user_id):
+    """
+    获取用户公开资料（与UserSerializer输出一致，另含is_active），优先读取缓存
+    用户不存在时返回None
+    """
+    key = PROFILE_KEY.format(user_id)
+    profile = cache.get(key)
+    if profile is None:
+        profile = _load_profile(user_id)
+        if profile is not None:
+            cache.set(key, profile, PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+async def aget_profile(user_id):
+    """
+    get_profile的异步版本：缓存命中时不访问数据库
+    """
+    profile = await cache.aget(PROFILE_KEY.format(user_id))
+    if profile is None:
+        profile = await sync_to_async(get_profile)(user_id)
+    return profile
+
+
+def get_profiles(user_ids):
+    """
+    批量获取用户资料，返回 {user_id: profile}；未命中缓存的用户一次查询补齐
+    """
+    from .models import User
+    from .serializers import UserSerializer
+
+    keys = {PROFILE_KEY.format(user_id): user_id for user_id in user_ids}
+    found = cache.get_many(keys.keys())
+    profiles = {keys[key]: profile for key, profile in found.items()}
+
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        loaded = {}
+        for user in User.objects.filter(id__in=missing):
+            loaded[user.id] = {
+                **UserSerializer(user).data,
+                'is_active': user.is_active,
+            }
+        cache.set_many(
+            {PROFILE_KEY.format(user_id): profile for user_id, profile in loaded.items()},
+            PROFILE_CACHE_TIMEOUT
+        )
+        profiles.update(loaded)
+    return profiles
+
+
+def invalidate_profiles(*user_ids):
+    """
+    用户资料变化时清除缓存
+    """
+    cache.delete_many([PROFILE_KEY.format(user_id) for user_id in user_ids])
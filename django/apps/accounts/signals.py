@@ -1,8 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from .models import User
 from apps.chat.models import GroupChatRoom
 from apps.friends.models import Friend
+from .profiles import invalidate_profiles
 
 
 
@@ -39,4 +40,13 @@ def add_user_to_groups(sender, instance, created, **kwargs):
                 Friend.objects.create(owner=instance, friend=user)
             except User.DoesNotExist:
                 # 用户不存在时静默忽略
-                pass
\ No newline at end of file
+                pass
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_profile(sender, instance, **kwargs):
+    """
+    用户资料（头像、状态、是否启用等）变化或用户被删除时，清除资料缓存
+    """
+    invalidate_profiles(instance.id)
\ No newline at end of file
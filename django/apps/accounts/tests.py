@@ -421,3 +421,32 @@ class test_User_set_ProfileView(APITestCase):
         # 3. 断言返回 400 且包含对应错误
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.data['data']['user_status'][0], 'user_status 不可修改。')
+
+
+class UserPresenceTests(APITestCase):
+    """测试批量在线状态查询接口"""
+    def setUp(self):
+        from django.core.cache import cache
+        from apps.realtime.presence import ONLINE_KEY
+        cache.clear()
+        self.user = User.objects.create_user(username='presence_viewer', password='password123')
+        self.online_user = User.objects.create_user(username='presence_online', password='password123')
+        cache.set(ONLINE_KEY.format(self.online_user.id), 1, 60)
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_presence(self):
+        from apps.friends.models import Friend
+        Friend.objects.create(owner=self.user, friend=self.online_user)
+        response = self.client.get(reverse('presence'), {'ids': f'{self.user.id},{self.online_user.id}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'][self.online_user.id], 'online')
+        self.assertEqual(response.data['data'][self.user.id], 'offline')
+
+    def test_non_friends_are_hidden(self):
+        response = self.client.get(reverse('presence'), {'ids': f'{self.online_user.id}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], {})
+
+    def test_invalid_ids(self):
+        response = self.client.get(reverse('presence'), {'ids': 'abc'})
+        self.assertEqual(response.status_code, 400)
@@ -1,7 +1,7 @@
 from __future__ import annotations
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from .views import RegisterView, LoginView, RefreshView, LogoutView, SearchUserView, UserProfileView, User_get_ProfileView, ChangePasswordView
+from .views import RegisterView, LoginView, RefreshView, LogoutView, SearchUserView, UserProfileView, User_get_ProfileView, ChangePasswordView, UserPresenceView
 
 router = DefaultRouter()
 router.register(r'register', RegisterView, basename='register')
@@ -17,4 +17,5 @@ urlpatterns = [
     path("profile/", UserProfileView.as_view(), name="profile"),
     path("getprofile/", User_get_ProfileView.as_view(), name="getprofile"),
     path("change-password/", ChangePasswordView.as_view(), name="change_password"),
+    path("presence/", UserPresenceView.as_view(), name="presence"),
 ]
\ No newline at end of file
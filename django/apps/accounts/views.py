@@ -8,6 +8,8 @@ from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from apps.accounts.models import User
 from apps.accounts.serializers import ChangePasswordSerializer, UserLoginSerializer, UserRegistrationSerializer, UserSearchSerializer, UserSerializer
+from apps.realtime.presence import presence_service
+from apps.friends.graph import friend_graph
 
 
 # Create your views here.
@@ -201,4 +203,41 @@ class ChangePasswordView(APIView):
             "code": 400,
             "message": "密码更改失败",
             "data": serializer.errors
-        }, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class UserPresenceView(APIView):
+    """
+    批量查询用户在线状态
+    数据来自在线状态服务（心跳维护的TTL键），而非数据库中的user_status字段
+    只返回调用者本人及其好友（即调用者属于其在线状态广播对象的用户），其他ID忽略
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = None
+    max_ids = 500
+
+    def get(self, request) -> Response:
+        raw_ids = request.GET.get('ids', '')
+        try:
+            user_ids = {int(value) for value in raw_ids.split(',') if value.strip()}
+        except ValueError:
+            return Response({
+                "code": 400,
+                "message": "ids 必须为逗号分隔的用户ID",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(user_ids) > self.max_ids:
+            return Response({
+                "code": 400,
+                "message": f"单次最多查询{self.max_ids}个用户",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "code": 200,
+            "message": "在线状态获取成功",
+            "data": presence_service.get_statuses(
+                user_ids & (friend_graph.get_friend_ids(request.user.id) | {request.user.id})
+            )
+        })
\ No newline at end of file
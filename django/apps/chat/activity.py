@@ -0,0 +1,84 @@
+import threading
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Q
+
+from apps.realtime.batching import PeriodicFlusher
+from apps.realtime.conf import realtime_setting
+from .inbox import inbox_service
+from .models import GroupChatRoom, PrivateChatRoom
+
+ROOM_MODELS = {
+    'private': PrivateChatRoom,
+    'group': GroupChatRoom,
+}
+
+
+class RoomActivityService:
+    """
+    房间最后活跃时间写后服务
+    新消息只在进程内记录每个房间最新的(消息ID, 时间)，按固定间隔合并写库：
+    热门房间在一个间隔内无论收到多少条消息都只更新一次房间行，且只前进不回退。
+    会话列表（最后一条消息、未读数）同样在此合并：每个房间每个间隔一条UPDATE，不在发送路径上逐条写入成员条目。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(room_type, room_id): (message_id, timestamp)}
+        self._dirty = {}
+        # {(room_type, room_id): (最新消息, Counter({sender_id: 消息数}))}
+        self._inbox = {}
+        self._flusher = None
+
+    def touch(self, message):
+        """
+        记录房间内的新消息
+        """
+        if message.room_type not in ROOM_MODELS:
+            return
+        key = (message.room_type, message.room_id)
+        with self._lock:
+            current = self._dirty.get(key)
+            if current is None or message.id > current[0]:
+                self._dirty[key] = (message.id, message.timestamp)
+            latest, senders = self._inbox.setdefault(key, (message, Counter()))
+            if message.id > latest.id:
+                self._inbox[key] = (message, senders)
+            senders[message.sender_id] += 1
+        if not realtime_setting('ROOM_ACTIVITY_FLUSH_INTERVAL'):
+            # 间隔为0时同步写库
+            self.flush()
+            return
+        self._start_flusher()
+
+    def flush(self):
+        """
+        将合并后的活跃时间写入房间表、新消息写入会话列表，返回更新的房间数
+        """
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+            inbox, self._inbox = self._inbox, {}
+        updated = 0
+        with transaction.atomic():
+            for (room_type, room_id), (message, senders) in inbox.items():
+                inbox_service.record_messages(room_type, room_id, message, senders)
+            for (room_type, room_id), (message_id, timestamp) in batch.items():
+                # 多进程并发写入时只允许前进
+                updated += ROOM_MODELS[room_type].objects.filter(
+                    Q(last_message_id__isnull=True) | Q(last_message_id__lt=message_id),
+                    id=room_id,
+                ).update(last_message_id=message_id, last_activity_at=timestamp)
+        return updated
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = PeriodicFlusher(
+                realtime_setting('ROOM_ACTIVITY_FLUSH_INTERVAL'),
+                self.flush,
+                name='room-activity-flusher'
+            )
+        self._flusher.start()
+
+
+room_activity_service = RoomActivityService()
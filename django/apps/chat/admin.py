@@ -1,26 +1,44 @@
 from django.contrib import admin
-from .models import GroupChatRoom
+from .models import GroupChatRoom, GroupMembership
+
+
+class GroupMembershipInline(admin.TabularInline):
+    model = GroupMembership
+    extra = 0
+    raw_id_fields = ('user',)
+    fields = ('user', 'role', 'muted', 'joined_at', 'last_read_message_id')
+    readonly_fields = ('joined_at', 'last_read_message_id')
+
 
 @admin.register(GroupChatRoom)
 class GroupChatRoomAdmin(admin.ModelAdmin):
     list_display = ('id', 'name','get_member_count', 'created_at')
-    search_fields = ('name', 'admin__username')
+    search_fields = ('name',)
     list_filter = ('created_at',)
     readonly_fields = ('id', 'created_at', 'updated_at')
-    filter_horizontal = ('members','admin')
+    inlines = [GroupMembershipInline]
     fieldsets = (
         ('基本信息', {
             'fields': ('name', 'description', 'avatar')
         }),
-        ('管理信息', {
-            'fields': ('admin', 'members')
-        }),
         ('系统信息', {
             'fields': ('id', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         })
     )
     
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is GroupMembership:
+            # 内联编辑逐条保存成员记录，不会触发m2m_changed，手动通知成员数和会话列表
+            room = form.instance
+            added = [membership.user_id for membership in formset.new_objects]
+            removed = [membership.user_id for membership in formset.deleted_objects]
+            if added:
+                room.members_changed('post_add', added)
+            if removed:
+                room.members_changed('post_remove', removed)
+
     def get_member_count(self, obj):
         return obj.get_member_count()
     
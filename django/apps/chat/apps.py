@@ -9,4 +9,5 @@ class ChatConfig(AppConfig):
         在应用启动时导入signals模块
         这是Django信号机制的要求，确保信号处理器被注册
         """
-        import apps.messages.signals
\ No newline at end of file
+        import apps.messages.signals
+        import apps.chat.signals
\ No newline at end of file
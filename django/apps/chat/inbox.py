@@ -0,0 +1,195 @@
+from django.apps import apps
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import InboxEntry
+
+# 最后一条消息摘要的最大长度
+PREVIEW_LENGTH = 100
+# 非文本消息的摘要
+PREVIEW_LABELS = {
+    'image': '[图片]',
+    'video': '[视频]',
+    'file': '[文件]',
+}
+
+
+def message_preview(message):
+    """
+    生成会话列表中的消息摘要
+    """
+    if message.messages_type == 'text':
+        return (message.content or '')[:PREVIEW_LENGTH]
+    label = PREVIEW_LABELS.get(message.messages_type, '')
+    if message.filename:
+        label = f'{label} {message.filename}'
+    return label[:PREVIEW_LENGTH]
+
+
+class InboxService:
+    """
+    会话列表维护服务
+    条目在房间创建、成员加入时建立，在成员退出、房间删除时移除；
+    新消息由房间活跃时间写后服务按房间合并，每个间隔一条UPDATE刷新房间内全部条目，
+    已读位置写库时按消息表重新计算未读数。
+    """
+
+    def add_private_room(self, room):
+        """
+        为私聊双方建立会话条目
+        """
+        self.add_private_rooms([room])
+
+    def add_private_rooms(self, rooms):
+        """
+        批量为私聊双方建立会话条目（房间需已关联user1、user2），备注一次查询取出
+        """
+        sides = [
+            (room, owner, peer)
+            for room in rooms
+            for owner, peer in ((room.user1, room.user2), (room.user2, room.user1))
+        ]
+        nicknames = self._nicknames([(owner.id, peer.id) for _, owner, peer in sides])
+        InboxEntry.objects.bulk_create([
+            InboxEntry(
+                user_id=owner.id,
+                room_type='private',
+                room_id=room.id,
+                peer_id=peer.id,
+                title=peer.username,
+                nickname=nicknames.get((owner.id, peer.id), ''),
+                avatar=peer.user_avatar.name or '',
+                last_activity_at=room.created_at,
+            )
+            for room, owner, peer in sides
+        ], batch_size=500, ignore_conflicts=True)
+
+    def add_group_members(self, room, user_ids):
+        """
+        为新加入的群成员建立会话条目（已有最后一条消息时一并写入）
+        """
+        last = self._last_message(room.id)
+        InboxEntry.objects.bulk_create([
+            InboxEntry(
+                user_id=user_id,
+                room_type='group',
+                room_id=room.id,
+                title=room.name,
+                avatar=room.avatar.name or '',
+                last_activity_at=last.timestamp if last else room.created_at,
+                **self._last_message_fields(last),
+            )
+            for user_id in user_ids
+        ], ignore_conflicts=True)
+
+    def remove_group_members(self, room_id, user_ids=None):
+        """
+        移除退出群聊的成员条目；不指定user_ids时移除已不在群内的全部条目
+        """
+        entries = InboxEntry.objects.filter(room_type='group', room_id=room_id)
+        if user_ids is None:
+            entries = entries.exclude(user__group_rooms__id=room_id)
+        else:
+            entries = entries.filter(user_id__in=user_ids)
+        entries.delete()
+
+    def remove_room(self, room_type, room_id):
+        InboxEntry.objects.filter(room_type=room_type, room_id=room_id).delete()
+
+    def update_group_info(self, room):
+        InboxEntry.objects.filter(room_type='group', room_id=room.id).update(
+            title=room.name,
+            avatar=room.avatar.name or '',
+        )
+
+    def update_user_info(self, user):
+        """
+        用户名或头像变化时刷新其所在私聊的对方条目
+        """
+        InboxEntry.objects.filter(room_type='private', peer_id=user.id).update(
+            title=user.username,
+            avatar=user.user_avatar.name or '',
+        )
+
+    def update_nickname(self, owner_id, friend_id, nickname):
+        InboxEntry.objects.filter(room_type='private', user_id=owner_id, peer_id=friend_id).update(
+            nickname=nickname or ''
+        )
+
+    def record_messages(self, room_type, room_id, message, senders):
+        """
+        一次刷新房间内全部条目：message为合并窗口内最新的消息，senders为 {sender_id: 消息数}
+        每个成员的未读数加上窗口内他人发送的消息数；最后一条消息只前进不回退（多进程合并时可能乱序）
+        """
+        total = sum(senders.values())
+        newer = Q(last_message_id__isnull=True) | Q(last_message_id__lt=message.id)
+        latest = {'last_activity_at': message.timestamp, **self._last_message_fields(message)}
+        return InboxEntry.objects.filter(room_type=room_type, room_id=room_id).update(
+            unread_count=Case(
+                *[
+                    When(user_id=sender_id, then=F('unread_count') + (total - count))
+                    for sender_id, count in senders.items()
+                ],
+                default=F('unread_count') + total,
+            ),
+            **{
+                name: Case(
+                    When(newer, then=Value(value)), default=F(name),
+                    output_field=InboxEntry._meta.get_field(name),
+                )
+                for name, value in latest.items()
+            },
+        )
+
+    def refresh_unread(self, markers):
+        """
+        按已读位置重新计算未读数（一条UPDATE），markers为 {(user_id, room_id): 最后已读消息ID}
+        """
+        if not markers:
+            return 0
+        Message = apps.get_model('custom_messages', 'Message')
+        condition = Q()
+        cases = []
+        for (user_id, room_id), message_id in markers.items():
+            unread = (
+                # 只统计已写入会话列表的消息，尚在合并窗口中的消息由下次写入累加
+                Message.objects.filter(room_id=room_id, id__gt=message_id, id__lte=OuterRef('last_message_id'))
+                .exclude(sender_id=user_id)
+                .values('room_id')
+                .annotate(count=Count('id'))
+                .values('count')
+            )
+            condition |= Q(user_id=user_id, room_id=room_id)
+            cases.append(When(user_id=user_id, room_id=room_id, then=Coalesce(Subquery(unread), 0)))
+        return InboxEntry.objects.filter(condition).update(unread_count=Case(*cases))
+
+    def _last_message(self, room_id):
+        Message = apps.get_model('custom_messages', 'Message')
+        return Message.objects.filter(room_id=room_id).order_by('-id').first()
+
+    @staticmethod
+    def _last_message_fields(message):
+        if message is None:
+            return {}
+        return {
+            'last_message_id': message.id,
+            'last_message_preview': message_preview(message),
+            'last_message_type': message.messages_type,
+            'last_sender_id': message.sender_id,
+        }
+
+    @staticmethod
+    def _nicknames(pairs):
+        FriendNickname = apps.get_model('friends', 'FriendNickname')
+        condition = Q()
+        for owner_id, friend_id in pairs:
+            condition |= Q(friend__owner_id=owner_id, friend__friend_id=friend_id)
+        return {
+            (owner_id, friend_id): nickname
+            for owner_id, friend_id, nickname in FriendNickname.objects.filter(condition).values_list(
+                'friend__owner_id', 'friend__friend_id', 'nickname'
+            )
+        }
+
+
+inbox_service = InboxService()
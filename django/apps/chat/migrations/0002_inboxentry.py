@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+PREVIEW_LABELS = {'image': '[图片]', 'video': '[视频]', 'file': '[文件]'}
+
+
+def backfill_inbox(apps, schema_editor):
+    """
+    为已有的私聊和群聊成员建立会话条目，并补齐最后一条消息和未读数
+    """
+    InboxEntry = apps.get_model('chat', 'InboxEntry')
+    PrivateChatRoom = apps.get_model('chat', 'PrivateChatRoom')
+    GroupChatRoom = apps.get_model('chat', 'GroupChatRoom')
+    FriendNickname = apps.get_model('friends', 'FriendNickname')
+    Message = apps.get_model('custom_messages', 'Message')
+    IsRead = apps.get_model('custom_messages', 'IsRead')
+
+    nicknames = {
+        (owner_id, friend_id): nickname
+        for owner_id, friend_id, nickname in FriendNickname.objects.values_list(
+            'friend__owner_id', 'friend__friend_id', 'nickname'
+        )
+    }
+    entries = []
+    for room in PrivateChatRoom.objects.select_related('user1', 'user2'):
+        for owner, peer in ((room.user1, room.user2), (room.user2, room.user1)):
+            entries.append(InboxEntry(
+                user_id=owner.id, room_type='private', room_id=room.id, peer_id=peer.id,
+                title=peer.username, nickname=nicknames.get((owner.id, peer.id), ''),
+                avatar=peer.user_avatar.name or '', last_activity_at=room.created_at,
+            ))
+    for room in GroupChatRoom.objects.prefetch_related('members'):
+        for member in room.members.all():
+            entries.append(InboxEntry(
+                user_id=member.id, room_type='group', room_id=room.id,
+                title=room.name, avatar=room.avatar.name or '', last_activity_at=room.created_at,
+            ))
+
+    last_read = {
+        (receiver_id, room_id): message_id
+        for receiver_id, room_id, message_id in IsRead.objects.values_list('receiver_id', 'room_id', 'message_id')
+    }
+    last_messages = {}
+    for entry in entries:
+        if entry.room_id not in last_messages:
+            last_messages[entry.room_id] = Message.objects.filter(room_id=entry.room_id).order_by('-id').first()
+        message = last_messages[entry.room_id]
+        if message is None:
+            continue
+        if message.messages_type == 'text':
+            preview = message.content or ''
+        else:
+            preview = f"{PREVIEW_LABELS.get(message.messages_type, '')} {message.filename or ''}".strip()
+        entry.last_message_id = message.id
+        entry.last_message_preview = preview[:100]
+        entry.last_message_type = message.messages_type
+        entry.last_sender_id = message.sender_id
+        entry.last_activity_at = message.timestamp
+        entry.unread_count = Message.objects.filter(
+            room_id=entry.room_id,
+            id__gt=last_read.get((entry.user_id, entry.room_id), 0)
+        ).exclude(sender_id=entry.user_id).count()
+    InboxEntry.objects.bulk_create(entries, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        ('custom_messages', '0006_message_seq'),
+        ('friends', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_type', models.CharField(choices=[('private', '私聊'), ('group', '群聊')], max_length=20, verbose_name='房间类型')),
+                ('room_id', models.BigIntegerField(verbose_name='房间ID')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='名称')),
+                ('nickname', models.CharField(blank=True, max_length=20, verbose_name='备注')),
+                ('avatar', models.CharField(blank=True, max_length=255, verbose_name='头像')),
+                ('last_message_id', models.BigIntegerField(blank=True, null=True, verbose_name='最后一条消息ID')),
+                ('last_message_preview', models.CharField(blank=True, max_length=200, verbose_name='最后一条消息摘要')),
+                ('last_message_type', models.CharField(blank=True, max_length=10, verbose_name='最后一条消息类型')),
+                ('last_sender_id', models.BigIntegerField(blank=True, null=True, verbose_name='最后一条消息发送者')),
+                ('last_activity_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='最后活跃时间')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='未读数')),
+                ('peer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='对方用户')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '会话列表',
+                'verbose_name_plural': '会话列表',
+                'indexes': [models.Index(fields=['user', '-last_activity_at', '-id'], name='inbox_user_activity_idx'), models.Index(fields=['room_id'], name='inbox_room_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'room_type', 'room_id'), name='unique_inbox_entry')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
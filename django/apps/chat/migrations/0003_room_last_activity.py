@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:50
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_activity(apps, schema_editor):
+    """
+    按已有消息补齐房间的最后一条消息和最后活跃时间，没有消息的房间取创建时间
+    """
+    Message = apps.get_model('custom_messages', 'Message')
+    latest = {
+        row['room_id']: row
+        for row in Message.objects.values('room_id').annotate(message_id=Max('id'), timestamp=Max('timestamp'))
+    }
+    for model_name in ('PrivateChatRoom', 'GroupChatRoom'):
+        model = apps.get_model('chat', model_name)
+        rooms = list(model.objects.all())
+        for room in rooms:
+            row = latest.get(room.id)
+            room.last_message_id = row['message_id'] if row else None
+            room.last_activity_at = row['timestamp'] if row else room.created_at
+        model.objects.bulk_update(rooms, ['last_message_id', 'last_activity_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_inboxentry'),
+        ('custom_messages', '0006_message_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='groupchatroom',
+            options={'ordering': ['-last_activity_at', '-id'], 'verbose_name': '群聊房间', 'verbose_name_plural': '群聊房间'},
+        ),
+        migrations.AlterModelOptions(
+            name='privatechatroom',
+            options={'ordering': ['-last_activity_at', '-id'], 'verbose_name': '私聊房间', 'verbose_name_plural': '私聊房间'},
+        ),
+        migrations.AddField(
+            model_name='groupchatroom',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='最后活跃时间'),
+        ),
+        migrations.AddField(
+            model_name='groupchatroom',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='最后一条消息ID'),
+        ),
+        migrations.AddField(
+            model_name='privatechatroom',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='最后活跃时间'),
+        ),
+        migrations.AddField(
+            model_name='privatechatroom',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='最后一条消息ID'),
+        ),
+        migrations.RunPython(backfill_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='groupchatroom',
+            index=models.Index(fields=['-last_activity_at', '-id'], name='group_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='privatechatroom',
+            index=models.Index(fields=['user1', '-last_activity_at'], name='private_user1_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='privatechatroom',
+            index=models.Index(fields=['user2', '-last_activity_at'], name='private_user2_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:53
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_member_count(apps, schema_editor):
+    GroupChatRoom = apps.get_model('chat', 'GroupChatRoom')
+    rooms = list(GroupChatRoom.objects.annotate(count=Count('members')))
+    for room in rooms:
+        room.member_count = room.count
+    GroupChatRoom.objects.bulk_update(rooms, ['member_count'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_room_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupchatroom',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='成员数'),
+        ),
+        migrations.RunPython(backfill_member_count, migrations.RunPython.noop),
+    ]
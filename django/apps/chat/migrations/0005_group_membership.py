@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_memberships(apps, schema_editor):
+    """
+    把原有的成员、管理员两张多对多表合并为成员表（管理员即角色为admin的成员）
+    """
+    GroupChatRoom = apps.get_model('chat', 'GroupChatRoom')
+    GroupMembership = apps.get_model('chat', 'GroupMembership')
+    members = GroupChatRoom.members.through.objects.values_list('groupchatroom_id', 'user_id')
+    admins = set(GroupChatRoom.admin.through.objects.values_list('groupchatroom_id', 'user_id'))
+    pairs = dict.fromkeys(list(members) + sorted(admins))
+    GroupMembership.objects.bulk_create([
+        GroupMembership(room_id=room_id, user_id=user_id, role='admin' if (room_id, user_id) in admins else 'member')
+        for room_id, user_id in pairs
+    ], batch_size=1000)
+
+
+def restore_m2m(apps, schema_editor):
+    GroupChatRoom = apps.get_model('chat', 'GroupChatRoom')
+    GroupMembership = apps.get_model('chat', 'GroupMembership')
+    memberships = list(GroupMembership.objects.values_list('room_id', 'user_id', 'role'))
+    GroupChatRoom.members.through.objects.bulk_create([
+        GroupChatRoom.members.through(groupchatroom_id=room_id, user_id=user_id)
+        for room_id, user_id, _ in memberships
+    ], batch_size=1000)
+    GroupChatRoom.admin.through.objects.bulk_create([
+        GroupChatRoom.admin.through(groupchatroom_id=room_id, user_id=user_id)
+        for room_id, user_id, role in memberships if role == 'admin'
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_groupchatroom_member_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('member', '成员'), ('admin', '管理员')], default='member', max_length=10, verbose_name='角色')),
+                ('joined_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='加入时间')),
+                ('muted', models.BooleanField(default=False, verbose_name='免打扰')),
+                ('last_read_message_id', models.BigIntegerField(blank=True, null=True, verbose_name='最后已读消息ID')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='chat.groupchatroom', verbose_name='群聊')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_memberships', to=settings.AUTH_USER_MODEL, verbose_name='用户')),
+            ],
+            options={
+                'verbose_name': '群成员',
+                'verbose_name_plural': '群成员',
+                'indexes': [
+                    models.Index(fields=['user', 'role', 'room'], name='membership_user_role_idx'),
+                    models.Index(fields=['room', 'role'], name='membership_room_role_idx'),
+                ],
+                'constraints': [
+                    models.UniqueConstraint(fields=('room', 'user'), name='unique_group_membership'),
+                ],
+            },
+        ),
+        migrations.RunPython(copy_memberships, restore_m2m),
+        # 多对多字段不能直接改为through模型：先删除原字段，再以成员表为through重新添加
+        migrations.RemoveField(
+            model_name='groupchatroom',
+            name='admin',
+        ),
+        migrations.RemoveField(
+            model_name='groupchatroom',
+            name='members',
+        ),
+        migrations.AddField(
+            model_name='groupchatroom',
+            name='members',
+            field=models.ManyToManyField(related_name='group_rooms', through='chat.GroupMembership', to=settings.AUTH_USER_MODEL, verbose_name='群聊成员'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def normalize_private_rooms(apps, schema_editor):
+    """
+    把私聊房间的双方按ID排序（user1_id < user2_id）
+    同一对用户存在正反两个房间时保留较早创建的房间，另一个房间的消息并入后删除：
+    消息的房间内序号接在保留房间之后，已读记录保留较大的位置。
+    """
+    PrivateChatRoom = apps.get_model('chat', 'PrivateChatRoom')
+    InboxEntry = apps.get_model('chat', 'InboxEntry')
+    Message = apps.get_model('custom_messages', 'Message')
+    IsRead = apps.get_model('custom_messages', 'IsRead')
+
+    rooms = {}
+    for room in PrivateChatRoom.objects.order_by('created_at', 'id'):
+        pair = tuple(sorted((room.user1_id, room.user2_id)))
+        kept = rooms.get(pair)
+        if kept is None:
+            rooms[pair] = room
+            continue
+        # 合并重复房间
+        next_seq = (Message.objects.filter(room_id=kept.id).aggregate(seq=Max('seq'))['seq'] or 0) + 1
+        for offset, message in enumerate(Message.objects.filter(room_id=room.id).order_by('timestamp', 'id')):
+            message.room_id = kept.id
+            message.seq = next_seq + offset
+            message.save(update_fields=['room_id', 'seq'])
+        for record in IsRead.objects.filter(room_id=room.id):
+            existing = IsRead.objects.filter(room_id=kept.id, receiver_id=record.receiver_id).first()
+            if existing is None:
+                record.room_id = kept.id
+                record.save(update_fields=['room_id'])
+            else:
+                if record.message_id > existing.message_id:
+                    existing.message_id = record.message_id
+                    existing.save(update_fields=['message'])
+                record.delete()
+        InboxEntry.objects.filter(room_type='private', room_id=room.id).delete()
+        room.delete()
+
+    for (low, high), room in rooms.items():
+        if room.user1_id != low:
+            PrivateChatRoom.objects.filter(id=room.id).update(user1_id=low, user2_id=high)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_group_membership'),
+        ('custom_messages', '0006_message_seq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_private_rooms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='privatechatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('user1__lt', models.F('user2'))), name='private_chat_ordered_users'),
+        ),
+    ]
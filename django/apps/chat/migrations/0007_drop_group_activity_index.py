@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_private_room_ordered_users'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='groupchatroom',
+            name='group_activity_idx',
+        ),
+    ]
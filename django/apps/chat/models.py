@@ -1,5 +1,10 @@
-from django.db import models
+from asgiref.sync import async_to_sync
+from django.db import models, transaction
+from django.db.models import Case, Count, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed
 from django.conf import settings
+from django.utils import timezone
 from apps.accounts.models import User
 from apps.friends.models import Friend
 import random
@@ -12,10 +17,16 @@ class ChatRoom(models.Model):
     id = models.BigIntegerField(primary_key=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 最后一条消息及其时间，由消息写入路径批量合并更新（updated_at只在房间本身保存时变化）
+    last_message_id = models.BigIntegerField(null=True, blank=True, verbose_name='最后一条消息ID')
+    last_activity_at = models.DateTimeField(default=timezone.now, verbose_name='最后活跃时间')
+
+    # 由其他写入路径维护的冗余字段，保存房间本身时不覆盖
+    DENORMALIZED_FIELDS = ('last_message_id', 'last_activity_at')
 
     class Meta:
         abstract = True
-        ordering = ['-updated_at']
+        ordering = ['-last_activity_at', '-id']
 
     def save(self, *args, **kwargs):
         """生成10位数的ID"""
@@ -25,6 +36,12 @@ class ChatRoom(models.Model):
                 if not self.__class__.objects.filter(id=new_id).exists():
                     self.id = new_id
                     break
+        elif not self._state.adding and kwargs.get('update_fields') is None:
+            # 内存中的冗余字段可能已过期，只写入房间本身的字段
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DENORMALIZED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
 class PrivateChatRoom(ChatRoom):
@@ -35,17 +52,82 @@ class PrivateChatRoom(ChatRoom):
     user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='private_rooms_as_user1')
     user2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='private_rooms_as_user2')
 
-    class Meta:
+    class Meta(ChatRoom.Meta):
         verbose_name = '私聊房间'
         verbose_name_plural = '私聊房间'
         unique_together = ('user1', 'user2')
         constraints = [
             models.CheckConstraint(check=~models.Q(user1=models.F('user2')),
-                                  name='no_self_private_chat')
+                                  name='no_self_private_chat'),
+            # 双方按ID排序保存（user1_id < user2_id），同一对用户只能对应一行
+            models.CheckConstraint(check=models.Q(user1__lt=models.F('user2')),
+                                  name='private_chat_ordered_users'),
+        ]
+        indexes = [
+            # 按最近活跃列出用户的私聊
+            models.Index(fields=['user1', '-last_activity_at'], name='private_user1_activity_idx'),
+            models.Index(fields=['user2', '-last_activity_at'], name='private_user2_activity_idx'),
         ]
 
     def __str__(self):
         return f'Private Chat: {self.user1.username} <-> {self.user2.username}'
+
+    def save(self, *args, **kwargs):
+        """保存前按ID排序双方用户"""
+        if self.user1_id is not None and self.user2_id is not None and self.user1_id > self.user2_id:
+            self.user1, self.user2 = self.user2, self.user1
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def ordered_pair(user_a_id, user_b_id):
+        """返回按规范顺序排列的查询条件 {'user1_id': 较小ID, 'user2_id': 较大ID}"""
+        low, high = sorted((user_a_id, user_b_id))
+        return {'user1_id': low, 'user2_id': high}
+
+    @classmethod
+    def get_for(cls, user_a_id, user_b_id):
+        """获取两个用户之间的私聊房间，不存在时返回None（一次唯一索引查询）"""
+        return cls.objects.filter(**cls.ordered_pair(user_a_id, user_b_id)).first()
+
+    @classmethod
+    def get_or_create_for(cls, user_a_id, user_b_id):
+        """
+        获取或创建两个用户之间的私聊房间，返回(房间, 是否新建)
+        并发创建时由(user1, user2)唯一约束兜底，get_or_create在冲突后重新读取已创建的房间
+        """
+        return cls.objects.get_or_create(**cls.ordered_pair(user_a_id, user_b_id))
+
+    @classmethod
+    def bulk_get_or_create_for(cls, user_id, other_ids):
+        """
+        批量获取或创建user_id与多个用户之间的私聊房间，返回(全部房间, 新建房间)
+        已有房间一次查询取出，缺少的房间按规范顺序一次bulk_create写入；
+        bulk_create不触发post_save，新建房间的会话条目由调用方建立
+        """
+        def lookup(ids):
+            return list(cls.objects.filter(
+                Q(user1_id=user_id, user2_id__in=ids) | Q(user2_id=user_id, user1_id__in=ids)
+            ).select_related('user1', 'user2'))
+
+        def peer_ids(rooms):
+            return {room.user1_id if room.user2_id == user_id else room.user2_id for room in rooms}
+
+        rooms = lookup(other_ids)
+        found = peer_ids(rooms)
+        missing = [other_id for other_id in dict.fromkeys(other_ids) if other_id not in found]
+        if not missing:
+            return rooms, []
+        new_ids = random.sample(range(1000000000, 10000000000), len(missing))
+        cls.objects.bulk_create(
+            [cls(id=new_id, **cls.ordered_pair(user_id, other_id)) for new_id, other_id in zip(new_ids, missing)],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+        created = lookup(missing)
+        # 随机ID与已有房间冲突而被忽略的极少数情况逐个补建
+        for other_id in set(missing) - peer_ids(created):
+            created.append(cls.get_or_create_for(user_id, other_id)[0])
+        return rooms + created, created
         
     def get_other_user(self, current_user):
         """
@@ -101,49 +183,236 @@ class GroupChatRoom(ChatRoom):
     name = models.CharField(max_length=255, verbose_name='群聊名称')
     avatar = models.ImageField(upload_to='group_avatars/', verbose_name='群聊头像', blank=True, null=True)
     description = models.TextField(verbose_name='群聊描述', blank=True, null=True)
-    admin = models.ManyToManyField(User, related_name='admin_groups', verbose_name='群聊管理员')
-    members = models.ManyToManyField(User, related_name='group_rooms', verbose_name='群聊成员')
+    # 成员及其角色保存在GroupMembership中
+    members = models.ManyToManyField(User, through='GroupMembership', related_name='group_rooms', verbose_name='群聊成员')
+    # 成员数，成员变化时按成员表重新统计
+    member_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='成员数')
 
+    DENORMALIZED_FIELDS = ChatRoom.DENORMALIZED_FIELDS + ('member_count',)
 
-
-    class Meta:
+    class Meta(ChatRoom.Meta):
         verbose_name = '群聊房间'
         verbose_name_plural = '群聊房间'
 
+    @property
+    def admin(self):
+        """群管理员（成员表中角色为管理员的用户）"""
+        return User.objects.filter(
+            group_memberships__room=self,
+            group_memberships__role=GroupMembership.ROLE_ADMIN
+        )
+
     def is_member(self, user):
         """检查用户是否是群成员"""
-        return self.members.filter(id=user.id).exists()
+        return GroupMembership.objects.filter(room_id=self.id, user_id=user.id).exists()
     
     def is_admin(self, user):
         """检查用户是否是群管理员"""
-        return self.admin.filter(id=user.id).exists()
+        return GroupMembership.objects.filter(
+            room_id=self.id, user_id=user.id, role=GroupMembership.ROLE_ADMIN
+        ).exists()
 
     def get_member_count(self):
         """获取群成员数量"""
-        return self.members.count()
+        return self.member_count
+
+    @classmethod
+    def refresh_member_count(cls, *room_ids):
+        """按成员表重新统计群成员数"""
+        counts = (
+            GroupMembership.objects.filter(room_id=OuterRef('pk'))
+            .values('room_id')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        cls.objects.filter(id__in=room_ids).update(member_count=Coalesce(Subquery(counts), 0))
     
     def add_member(self, user):
         """添加成员到群聊"""
-        if not self.is_member(user):
-            self.members.add(user)
-            return True
-        return False
+        return bool(self.add_members([user.id]))
     
     def remove_member(self, user):
         """从群聊移除成员"""
-        if self.is_member(user):
-            # 移除成员时同时移除其管理员权限
-            if self.is_admin(user):
-                self.admin.remove(user)
-            self.members.remove(user)
-            return True
-        return False
+        return bool(self.remove_members([user.id]))
+
     def add_admin(self, user):
         """添加管理员到群聊"""
-        if self.is_member(user):
-            self.admin.add(user)
-            self.save()
-            return True
-        return False
+        return bool(self.add_admins([user.id]))
 
-    
+    def add_members(self, user_ids):
+        """
+        批量添加成员，返回实际新加入的用户ID列表
+        在一个事务内用bulk_create写入成员表，并按m2m_changed通知成员数、会话列表等处理器
+        """
+        with transaction.atomic():
+            existing = set(GroupMembership.objects.filter(
+                room_id=self.id, user_id__in=user_ids
+            ).values_list('user_id', flat=True))
+            added = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in existing]
+            if not added:
+                return []
+            GroupMembership.objects.bulk_create(
+                [GroupMembership(room_id=self.id, user_id=user_id) for user_id in added],
+                ignore_conflicts=True
+            )
+            self.members_changed('post_add', added)
+        self._notify_members_changed('add', added)
+        return added
+
+    def remove_members(self, user_ids):
+        """
+        批量移除成员（管理员角色随成员记录一并删除），返回实际移除的用户ID列表
+        """
+        with transaction.atomic():
+            removed = list(GroupMembership.objects.filter(
+                room_id=self.id, user_id__in=user_ids
+            ).values_list('user_id', flat=True))
+            if not removed:
+                return []
+            GroupMembership.objects.filter(room_id=self.id, user_id__in=removed).delete()
+            self.members_changed('post_remove', removed)
+        self._notify_members_changed('remove', removed)
+        return removed
+
+    def add_admins(self, user_ids):
+        """
+        批量设为管理员（只处理群成员），返回新设为管理员的用户ID列表
+        """
+        with transaction.atomic():
+            members = GroupMembership.objects.select_for_update().filter(
+                room_id=self.id, user_id__in=user_ids, role=GroupMembership.ROLE_MEMBER
+            )
+            candidates = set(members.values_list('user_id', flat=True))
+            promoted = [user_id for user_id in dict.fromkeys(user_ids) if user_id in candidates]
+            if not promoted:
+                return []
+            GroupMembership.objects.filter(room_id=self.id, user_id__in=promoted).update(
+                role=GroupMembership.ROLE_ADMIN
+            )
+        self._notify_members_changed('promote', promoted)
+        return promoted
+
+    def members_changed(self, action, user_ids):
+        """
+        手动发送成员表的m2m_changed信号（post_add / post_remove）
+        bulk_create、查询集删除和逐条保存成员记录都不会触发该信号，成员数、会话列表等处理器依赖它
+        """
+        m2m_changed.send(
+            sender=self.members.through,
+            instance=self,
+            action=action,
+            reverse=False,
+            model=User,
+            pk_set=set(user_ids),
+            using=self._state.db,
+        )
+
+    def _notify_members_changed(self, action, user_ids):
+        # 事务提交后向房间推送一条合并的成员变化事件
+        from apps.realtime.services import RealtimeService
+
+        room_id = self.id
+        transaction.on_commit(lambda: async_to_sync(RealtimeService.send_group_members_changed)(
+            room_id, action, list(user_ids)
+        ))
+
+
+class GroupMembership(models.Model):
+    """
+    群成员关系：一条记录 = 一个用户在一个群中的成员身份
+    角色、加入时间、免打扰和已读位置都保存在同一行，成员判断只需查询(room, user)唯一索引。
+    """
+    ROLE_MEMBER = 'member'
+    ROLE_ADMIN = 'admin'
+    ROLE_CHOICES = (
+        (ROLE_MEMBER, '成员'),
+        (ROLE_ADMIN, '管理员'),
+    )
+    room = models.ForeignKey(GroupChatRoom, on_delete=models.CASCADE, related_name='memberships', verbose_name='群聊')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_memberships', verbose_name='用户')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=ROLE_MEMBER, verbose_name='角色')
+    joined_at = models.DateTimeField(default=timezone.now, verbose_name='加入时间')
+    muted = models.BooleanField(default=False, verbose_name='免打扰')
+    last_read_message_id = models.BigIntegerField(null=True, blank=True, verbose_name='最后已读消息ID')
+
+    class Meta:
+        verbose_name = '群成员'
+        verbose_name_plural = '群成员'
+        constraints = [
+            # 同时用于成员判断和按群列出成员
+            models.UniqueConstraint(fields=['room', 'user'], name='unique_group_membership'),
+        ]
+        indexes = [
+            # “我的群聊”（可按角色筛选）只需扫描索引
+            models.Index(fields=['user', 'role', 'room'], name='membership_user_role_idx'),
+            # 按群列出管理员
+            models.Index(fields=['room', 'role'], name='membership_room_role_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} in {self.room_id} [{self.role}]'
+
+    @classmethod
+    def update_last_read(cls, markers):
+        """
+        批量写入已读位置（一条UPDATE），markers为 {(user_id, room_id): 最后已读消息ID}
+        非群聊房间的标记不会匹配任何记录
+        """
+        if not markers:
+            return 0
+        condition = Q()
+        cases = []
+        for (user_id, room_id), message_id in markers.items():
+            condition |= Q(user_id=user_id, room_id=room_id)
+            cases.append(When(user_id=user_id, room_id=room_id, then=Value(message_id)))
+        return cls.objects.filter(condition).update(
+            last_read_message_id=Case(*cases, output_field=models.BigIntegerField())
+        )
+
+
+class InboxEntry(models.Model):
+    """
+    会话列表条目：每个用户在每个房间一条，随消息写入同步更新
+    冗余保存最后一条消息摘要、最后活跃时间、未读数以及展示名称和头像，
+    会话列表接口只需按用户和活跃时间读取本表，不再逐个房间查询好友备注、最后消息和未读数。
+    """
+    ROOM_TYPES = (
+        ('private', '私聊'),
+        ('group', '群聊'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries', verbose_name='用户')
+    room_type = models.CharField(max_length=20, choices=ROOM_TYPES, verbose_name='房间类型')
+    room_id = models.BigIntegerField(verbose_name='房间ID')
+    # 私聊的对方用户，群聊为空
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name='对方用户')
+    # 群聊名称或对方用户名；nickname为当前用户给对方设置的好友备注
+    title = models.CharField(max_length=255, blank=True, verbose_name='名称')
+    nickname = models.CharField(max_length=20, blank=True, verbose_name='备注')
+    # 头像在存储中的文件名
+    avatar = models.CharField(max_length=255, blank=True, verbose_name='头像')
+    last_message_id = models.BigIntegerField(null=True, blank=True, verbose_name='最后一条消息ID')
+    last_message_preview = models.CharField(max_length=200, blank=True, verbose_name='最后一条消息摘要')
+    last_message_type = models.CharField(max_length=10, blank=True, verbose_name='最后一条消息类型')
+    last_sender_id = models.BigIntegerField(null=True, blank=True, verbose_name='最后一条消息发送者')
+    last_activity_at = models.DateTimeField(default=timezone.now, verbose_name='最后活跃时间')
+    unread_count = models.PositiveIntegerField(default=0, verbose_name='未读数')
+
+    class Meta:
+        verbose_name = '会话列表'
+        verbose_name_plural = '会话列表'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room_type', 'room_id'], name='unique_inbox_entry'),
+        ]
+        indexes = [
+            # 会话列表按最后活跃时间倒序分页
+            models.Index(fields=['user', '-last_activity_at', '-id'], name='inbox_user_activity_idx'),
+            # 新消息按房间更新全部成员的条目
+            models.Index(fields=['room_id'], name='inbox_room_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} inbox: {self.room_type} {self.room_id}'
+
+    @property
+    def display_name(self):
+        return self.nickname or self.title
\ No newline at end of file
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import PrivateChatRoom,GroupChatRoom
+from django.core.files.storage import default_storage
+from .models import PrivateChatRoom,GroupChatRoom,InboxEntry
 from apps.accounts.serializers import UserSerializer
 
 class PrivateChatRoomSerializer(serializers.ModelSerializer):
@@ -12,8 +13,8 @@ class PrivateChatRoomSerializer(serializers.ModelSerializer):
     other_user_info = serializers.SerializerMethodField()
     class Meta:
         model = PrivateChatRoom
-        fields = ['id', 'created_at', 'updated_at', 'user1', 'user2', 'other_user_info']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'other_user_info']
+        fields = ['id', 'created_at', 'updated_at', 'last_message_id', 'last_activity_at', 'user1', 'user2', 'other_user_info']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'last_message_id', 'last_activity_at', 'other_user_info']
         
     def get_other_user_info(self, obj):
         """
@@ -30,10 +31,71 @@ class GroupChatRoomSerializer(serializers.ModelSerializer):
     群聊房间序列化器
     遵循单一职责原则，专门处理群聊房间的序列化
     """
-    admin = UserSerializer(many=True)
+    # 管理员由成员表的角色得出，只读；列表查询预取了admin_memberships时不再逐个房间查询
+    admin = serializers.SerializerMethodField()
     members = UserSerializer(many=True)
     class Meta:
         model = GroupChatRoom
-        fields = ['id','name','avatar','description', 'admin', 'members', 'created_at']
-        read_only_fields = ['id', 'created_at' ]
+        fields = ['id','name','avatar','description', 'admin', 'members', 'created_at', 'last_message_id', 'last_activity_at']
+        read_only_fields = ['id', 'created_at', 'last_message_id', 'last_activity_at']
 
+    def get_admin(self, obj):
+        memberships = getattr(obj, 'admin_memberships', None)
+        admins = obj.admin if memberships is None else [membership.user for membership in memberships]
+        return UserSerializer(admins, many=True, context=self.context).data
+
+
+class GroupChatRoomSummarySerializer(serializers.ModelSerializer):
+    """
+    群聊列表用的精简序列化器，不展开成员和管理员
+    当前用户的角色来自查询时的my_role注解
+    """
+    role = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GroupChatRoom
+        fields = ['id', 'name', 'avatar', 'member_count', 'role', 'last_activity_at']
+        read_only_fields = fields
+
+    def get_role(self, obj):
+        return getattr(obj, 'my_role', None) or 'member'
+
+
+class GroupMemberSerializer(UserSerializer):
+    """
+    群成员序列化器，角色来自查询时的room_role注解
+    """
+    role = serializers.SerializerMethodField()
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ['role']
+        read_only_fields = fields
+
+    def get_role(self, obj):
+        return getattr(obj, 'room_role', None) or 'member'
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """
+    会话列表条目序列化器，全部字段来自条目本身，不访问其他表
+    """
+    name = serializers.CharField(source='display_name', read_only=True)
+    avatar = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = InboxEntry
+        fields = ['room_id', 'room_type', 'peer_id', 'name', 'avatar', 'last_message', 'last_activity_at', 'unread_count']
+        read_only_fields = fields
+
+    def get_avatar(self, obj):
+        return default_storage.url(obj.avatar) if obj.avatar else None
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'sender_id': obj.last_sender_id,
+            'messages_type': obj.last_message_type,
+            'preview': obj.last_message_preview,
+        }
\ No newline at end of file
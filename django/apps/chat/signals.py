@@ -0,0 +1,100 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from apps.accounts.models import User
+from apps.friends.models import Friend, FriendNickname
+from apps.realtime.broadcast import invalidate_room_member_count
+from .inbox import inbox_service
+from .models import GroupChatRoom, PrivateChatRoom
+
+
+@receiver(m2m_changed, sender=GroupChatRoom.members.through)
+def invalidate_member_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    群成员变化时重新统计成员数并清除缓存（影响是否启用广播模式）
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # 从用户一侧修改（user.group_rooms.add(...)），pk_set为群聊ID
+        room_ids = pk_set or GroupChatRoom.objects.filter(members=instance).values_list('id', flat=True)
+    else:
+        room_ids = [instance.id]
+    GroupChatRoom.refresh_member_count(*room_ids)
+    invalidate_room_member_count(*room_ids)
+
+
+@receiver(m2m_changed, sender=GroupChatRoom.members.through)
+def sync_member_inbox(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    群成员变化时建立或移除会话条目
+    """
+    if action == 'post_add':
+        if reverse:
+            for room in GroupChatRoom.objects.filter(id__in=pk_set):
+                inbox_service.add_group_members(room, [instance.id])
+        else:
+            inbox_service.add_group_members(instance, pk_set)
+    elif action == 'post_remove':
+        if reverse:
+            for room_id in pk_set:
+                inbox_service.remove_group_members(room_id, [instance.id])
+        else:
+            inbox_service.remove_group_members(instance.id, pk_set)
+    elif action == 'post_clear':
+        if reverse:
+            instance.inbox_entries.filter(room_type='group').delete()
+        else:
+            inbox_service.remove_group_members(instance.id)
+
+
+@receiver(post_save, sender=GroupChatRoom)
+def update_group_inbox(sender, instance, created, **kwargs):
+    if not created:
+        inbox_service.update_group_info(instance)
+
+
+@receiver(post_delete, sender=GroupChatRoom)
+def invalidate_deleted_room(sender, instance, **kwargs):
+    invalidate_room_member_count(instance.id)
+    inbox_service.remove_room('group', instance.id)
+
+
+@receiver(post_save, sender=PrivateChatRoom)
+def create_private_inbox(sender, instance, created, **kwargs):
+    if created:
+        inbox_service.add_private_room(instance)
+
+
+@receiver(post_delete, sender=PrivateChatRoom)
+def remove_private_inbox(sender, instance, **kwargs):
+    inbox_service.remove_room('private', instance.id)
+
+
+@receiver(post_save, sender=User)
+def update_peer_inbox(sender, instance, created, update_fields=None, **kwargs):
+    """
+    用户名或头像变化时刷新私聊对方的会话条目（登录等只更新其他字段时跳过）
+    """
+    if created:
+        return
+    if update_fields is not None and not {'username', 'user_avatar'} & set(update_fields):
+        return
+    inbox_service.update_user_info(instance)
+
+
+@receiver(post_save, sender=FriendNickname)
+@receiver(post_delete, sender=FriendNickname)
+def update_nickname_inbox(sender, instance, **kwargs):
+    """
+    好友备注变化时刷新私聊会话条目的展示名称
+    """
+    nickname = '' if kwargs.get('signal') is post_delete else instance.nickname
+    friend = Friend.objects.filter(id=instance.friend_id).values_list('owner_id', 'friend_id').first()
+    if friend is not None:
+        inbox_service.update_nickname(*friend, nickname)
+
+
+@receiver(post_delete, sender=Friend)
+def clear_nickname_inbox(sender, instance, **kwargs):
+    inbox_service.update_nickname(instance.owner_id, instance.friend_id, '')
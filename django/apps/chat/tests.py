@@ -1,3 +1,378 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.chat.activity import room_activity_service
+from apps.chat.models import GroupChatRoom, GroupMembership, InboxEntry, PrivateChatRoom
+from apps.friends.models import Friend, FriendNickname
+from apps.messages.models import Message
+from apps.messages.read_markers import read_marker_service
 
 # Create your tests here.
+
+
+@override_settings(REALTIME={'READ_MARKER_FLUSH_INTERVAL': 0, 'ROOM_ACTIVITY_FLUSH_INTERVAL': 0})
+class InboxTests(TestCase):
+    """测试会话列表条目的维护与分页接口"""
+
+    def setUp(self):
+        cache.clear()
+        read_marker_service._dirty.clear()
+        self.alice = User.objects.create_user(username='inbox_alice', password='password123')
+        self.bob = User.objects.create_user(username='inbox_bob', password='password123')
+        self.carol = User.objects.create_user(username='inbox_carol', password='password123')
+        self.private = PrivateChatRoom.objects.create(user1=self.alice, user2=self.bob)
+        self.group = GroupChatRoom.objects.create(name='inbox group')
+        self.group.members.add(self.alice, self.bob, self.carol)
+
+    def send(self, sender, room, room_type, content='hello'):
+        # 会话列表在消息事务提交后更新
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(
+                sender=sender,
+                room_type=room_type,
+                room_id=room.id,
+                messages_type='text',
+                content=content,
+            )
+
+    def entry(self, user, room):
+        return InboxEntry.objects.get(user=user, room_id=room.id)
+
+    def test_entries_follow_rooms_and_members(self):
+        self.assertEqual(self.entry(self.alice, self.private).title, 'inbox_bob')
+        self.assertEqual(self.entry(self.bob, self.private).title, 'inbox_alice')
+        self.assertEqual(InboxEntry.objects.filter(room_id=self.group.id).count(), 3)
+
+        self.group.members.remove(self.carol)
+        self.assertFalse(InboxEntry.objects.filter(user=self.carol, room_id=self.group.id).exists())
+        self.group.name = 'renamed'
+        self.group.save()
+        self.assertEqual(self.entry(self.alice, self.group).title, 'renamed')
+
+        friend = Friend.objects.create(owner=self.alice, friend=self.bob)
+        nickname = FriendNickname.objects.create(friend=friend, nickname='bobby')
+        self.assertEqual(self.entry(self.alice, self.private).display_name, 'bobby')
+        nickname.delete()
+        self.assertEqual(self.entry(self.alice, self.private).display_name, 'inbox_bob')
+
+    def test_message_updates_last_message_and_unread(self):
+        self.send(self.alice, self.group, 'group', 'first')
+        last = self.send(self.bob, self.group, 'group', 'second')
+
+        entry = self.entry(self.alice, self.group)
+        self.assertEqual(entry.last_message_id, last.id)
+        self.assertEqual(entry.last_message_preview, 'second')
+        self.assertEqual(entry.unread_count, 1)
+        self.assertEqual(self.entry(self.carol, self.group).unread_count, 2)
+
+        # 已读位置写库后按消息表重新计算未读数
+        read_marker_service.mark(self.carol.id, self.group.id, last.id - 1)
+        read_marker_service.flush()
+        self.assertEqual(self.entry(self.carol, self.group).unread_count, 1)
+
+    def test_refresh_unread_is_one_update(self):
+        from .inbox import inbox_service
+        first = self.send(self.alice, self.group, 'group', 'first')
+        self.send(self.alice, self.group, 'group', 'second')
+        markers = {(self.bob.id, self.group.id): first.id, (self.carol.id, self.group.id): 0}
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(inbox_service.refresh_unread(markers), 2)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.entry(self.bob, self.group).unread_count, 1)
+        self.assertEqual(self.entry(self.carol, self.group).unread_count, 2)
+
+    def test_inbox_endpoint_orders_by_activity_in_constant_queries(self):
+        for index in range(5):
+            room = GroupChatRoom.objects.create(name=f'extra {index}')
+            room.members.add(self.alice)
+        self.send(self.bob, self.private, 'private', 'latest')
+
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        with self.assertNumQueries(1):
+            response = client.get(reverse('chat:inbox'), {'page_size': 3})
+        data = response.json()
+        self.assertEqual(data['data'][0]['room_id'], self.private.id)
+        self.assertEqual(data['data'][0]['name'], 'inbox_bob')
+        self.assertEqual(data['data'][0]['unread_count'], 1)
+        self.assertEqual(data['data'][0]['last_message']['preview'], 'latest')
+
+        seen = [item['room_id'] for item in data['data']]
+        while data['pagination-next']:
+            with self.assertNumQueries(1):
+                data = client.get(data['pagination-next']).json()
+            seen.extend(item['room_id'] for item in data['data'])
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+
+class RoomActivityTests(TestCase):
+    """测试房间最后活跃时间的合并写库"""
+
+    def setUp(self):
+        room_activity_service._dirty.clear()
+        self.alice = User.objects.create_user(username='activity_alice', password='password123')
+        self.bob = User.objects.create_user(username='activity_bob', password='password123')
+        self.quiet = GroupChatRoom.objects.create(name='quiet')
+        self.busy = GroupChatRoom.objects.create(name='busy')
+
+    def send(self, room, sender=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(
+                sender=sender or self.alice,
+                room_type='group',
+                room_id=room.id,
+                messages_type='text',
+                content='hi',
+            )
+
+    @mock.patch.object(room_activity_service, '_start_flusher')
+    def test_hot_room_is_written_once_per_flush(self, start_flusher):
+        messages = [self.send(self.busy) for _ in range(10)]
+        self.assertTrue(start_flusher.called)
+
+        with self.assertNumQueries(4):
+            # 事务开始/结束各一次，合并后的房间和会话列表各只更新一次
+            self.assertEqual(room_activity_service.flush(), 1)
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.last_message_id, messages[-1].id)
+        self.assertEqual(self.busy.last_activity_at, messages[-1].timestamp)
+        self.assertEqual(list(GroupChatRoom.objects.values_list('id', flat=True)), [self.busy.id, self.quiet.id])
+
+    @mock.patch.object(room_activity_service, '_start_flusher')
+    def test_inbox_is_updated_once_per_flush(self, start_flusher):
+        self.busy.members.add(self.alice, self.bob)
+        messages = [self.send(self.busy) for _ in range(3)] + [self.send(self.busy, sender=self.bob)]
+        # 发送路径上不写会话列表
+        self.assertEqual(InboxEntry.objects.get(user=self.bob, room_id=self.busy.id).unread_count, 0)
+
+        room_activity_service.flush()
+        alice = InboxEntry.objects.get(user=self.alice, room_id=self.busy.id)
+        bob = InboxEntry.objects.get(user=self.bob, room_id=self.busy.id)
+        self.assertEqual((alice.unread_count, bob.unread_count), (1, 3))
+        self.assertEqual(bob.last_message_id, messages[-1].id)
+        self.assertEqual(bob.last_sender_id, self.bob.id)
+
+    @override_settings(REALTIME={'ROOM_ACTIVITY_FLUSH_INTERVAL': 0})
+    def test_activity_never_moves_backwards(self):
+        first = self.send(self.quiet)
+        latest = self.send(self.quiet)
+        room_activity_service.touch(first)
+        self.quiet.refresh_from_db()
+        self.assertEqual(self.quiet.last_message_id, latest.id)
+
+
+@override_settings(REALTIME={'ROOM_ACTIVITY_FLUSH_INTERVAL': 0})
+class GroupListingTests(TestCase):
+    """测试群聊精简列表、成员数和成员分页接口"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='listing_owner', password='password123')
+        self.users = [
+            User.objects.create_user(username=f'listing_{prefix}{index}', password='password123')
+            for prefix in ('a', 'b') for index in range(3)
+        ]
+        self.group = GroupChatRoom.objects.create(name='listing')
+        self.group.members.add(self.owner, *self.users)
+        self.group.add_admin(self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_member_count_follows_membership(self):
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.member_count, 7)
+        self.group.members.remove(self.users[0])
+        self.users[1].group_rooms.remove(self.group)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.member_count, 5)
+        # 保存房间本身不覆盖成员数
+        stale = GroupChatRoom.objects.get(id=self.group.id)
+        self.group.members.add(self.users[0])
+        stale.name = 'renamed'
+        stale.save()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.member_count, 6)
+
+    def test_full_list_query_count_is_fixed(self):
+        # 顺序、群聊、成员和管理员各一次查询，与群数量无关
+        for index in range(3):
+            room = GroupChatRoom.objects.create(name=f'full {index}')
+            room.members.add(self.owner, self.users[index])
+            room.add_admin(self.users[index])
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('chat:group_chat_rooms'))
+        rooms = {room['name']: room for room in response.json()['data']}
+        self.assertEqual(len(rooms), 4)
+        self.assertEqual([admin['id'] for admin in rooms['listing']['admin']], [self.owner.id])
+        self.assertEqual([admin['id'] for admin in rooms['full 1']['admin']], [self.users[1].id])
+        self.assertEqual(len(rooms['full 1']['members']), 2)
+
+    def test_summary_list(self):
+        other = GroupChatRoom.objects.create(name='other')
+        other.members.add(self.owner, self.users[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(
+                sender=self.users[0], room_type='group', room_id=self.group.id, messages_type='text', content='hi'
+            )
+        # 一次读取当前用户会话条目中的顺序，一次读取群聊
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('chat:group_chat_rooms'), {'view': 'summary'})
+        self.assertEqual([room['name'] for room in response.json()['data']], ['listing', 'other'])
+        rooms = {room['name']: room for room in response.json()['data']}
+        self.assertEqual(rooms['listing']['member_count'], 7)
+        self.assertEqual(rooms['listing']['role'], 'admin')
+        self.assertEqual(rooms['other']['role'], 'member')
+        self.assertNotIn('members', rooms['other'])
+
+    def test_member_listing_with_prefix_search(self):
+        url = reverse('chat:group_members', kwargs={'room_id': self.group.id})
+        data = self.client.get(url, {'page_size': 4}).json()
+        names = [member['username'] for member in data['data']]
+        while data['pagination-next']:
+            data = self.client.get(data['pagination-next']).json()
+            names.extend(member['username'] for member in data['data'])
+        self.assertEqual(names, sorted(user.username for user in [self.owner, *self.users]))
+
+        data = self.client.get(url, {'search': 'listing_b'}).json()
+        self.assertEqual([member['username'] for member in data['data']], ['listing_b0', 'listing_b1', 'listing_b2'])
+        self.assertEqual(data['member_count'], 7)
+        data = self.client.get(url, {'search': 'listing_o'}).json()
+        self.assertEqual(data['data'][0]['role'], 'admin')
+
+        outsider = User.objects.create_user(username='listing_outsider', password='password123')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class BulkMembershipTests(TestCase):
+    """测试批量成员操作"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='bulk_owner', password='password123')
+        self.group = GroupChatRoom.objects.create(name='bulk')
+        self.group.add_member(self.owner)
+        self.group.add_admin(self.owner)
+        self.users = User.objects.bulk_create([
+            User(id=3000000000 + index, username=f'bulk_{index}') for index in range(300)
+        ])
+        self.user_ids = [user.id for user in self.users]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = reverse('chat:group_members', kwargs={'room_id': self.group.id})
+
+    @mock.patch('apps.realtime.services.RealtimeService.send_group_members_changed')
+    def test_bulk_add_in_one_request(self, send_changed):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'user_ids': self.user_ids + [self.owner.id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['data']['added']), self.user_ids)
+        self.assertLess(len(queries), 20)
+
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.member_count, 301)
+        self.assertEqual(InboxEntry.objects.filter(room_id=self.group.id).count(), 301)
+        send_changed.assert_called_once()
+        self.assertEqual(send_changed.call_args.args[:2], (self.group.id, 'add'))
+
+        # 重复添加不产生变化
+        self.assertEqual(self.group.add_members(self.user_ids[:10]), [])
+
+    def test_bulk_remove_and_promote(self):
+        self.group.add_members(self.user_ids)
+        admins_url = reverse('chat:group_admins', kwargs={'room_id': self.group.id})
+        outsider = User.objects.create_user(username='bulk_outsider', password='password123')
+        response = self.client.post(admins_url, {'user_ids': self.user_ids[:5] + [outsider.id]}, format='json')
+        self.assertEqual(sorted(response.json()['data']['promoted']), self.user_ids[:5])
+
+        response = self.client.delete(self.url, {'user_ids': self.user_ids[:100]}, format='json')
+        self.assertEqual(len(response.json()['data']['removed']), 100)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.member_count, 201)
+        self.assertFalse(self.group.admin.filter(id__in=self.user_ids[:5]).exists())
+        self.assertFalse(InboxEntry.objects.filter(room_id=self.group.id, user_id__in=self.user_ids[:100]).exists())
+
+    def test_requires_admin(self):
+        self.group.add_member(self.users[0])
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post(self.url, {'user_ids': self.user_ids[1:3]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(self.url, {'user_ids': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class GroupMembershipTests(TestCase):
+    """测试基于角色的群成员表"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='membership_owner', password='password123')
+        self.member = User.objects.create_user(username='membership_member', password='password123')
+        self.group = GroupChatRoom.objects.create(name='membership')
+        self.group.add_members([self.owner.id, self.member.id])
+        self.group.add_admin(self.owner)
+
+    def test_roles_and_membership_checks(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.group.is_admin(self.owner))
+        self.assertFalse(self.group.is_admin(self.member))
+        self.assertTrue(self.group.is_member(self.member))
+        self.assertEqual(list(self.group.admin), [self.owner])
+        self.assertEqual(list(self.member.group_rooms.all()), [self.group])
+
+        self.group.remove_member(self.owner)
+        self.assertFalse(GroupMembership.objects.filter(room=self.group, user=self.owner).exists())
+        self.assertFalse(self.group.admin.exists())
+
+    def test_update_last_read(self):
+        updated = GroupMembership.update_last_read({
+            (self.owner.id, self.group.id): 10,
+            (self.member.id, self.group.id): 12,
+            (self.member.id, 1): 99,
+        })
+        self.assertEqual(updated, 2)
+        self.assertEqual(
+            dict(GroupMembership.objects.values_list('user_id', 'last_read_message_id')),
+            {self.owner.id: 10, self.member.id: 12}
+        )
+
+
+class PrivateRoomPairTests(TestCase):
+    """测试私聊房间双方的规范顺序"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(username='pair_alice', password='password123')
+        self.bob = User.objects.create_user(username='pair_bob', password='password123')
+        self.low, self.high = sorted([self.alice, self.bob], key=lambda user: user.id)
+
+    def test_rooms_are_stored_in_id_order(self):
+        room = PrivateChatRoom.objects.create(user1=self.high, user2=self.low)
+        self.assertEqual((room.user1_id, room.user2_id), (self.low.id, self.high.id))
+        self.assertEqual(PrivateChatRoom.get_for(self.high.id, self.low.id), room)
+        self.assertEqual(PrivateChatRoom.get_or_create_for(self.high.id, self.low.id), (room, False))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PrivateChatRoom.objects.filter(id=room.id).update(user1=self.high, user2=self.low)
+
+    def test_create_view_resolves_existing_room_from_either_side(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        url = reverse('chat:private_chat_rooms')
+        first = client.post(url, {'user2_id': self.bob.id}, format='json').json()['data']['id']
+
+        client.force_authenticate(self.bob)
+        with CaptureQueriesContext(connection) as queries:
+            second = client.post(url, {'user2_id': self.alice.id}, format='json')
+        # 房间只按规范顺序查询一次
+        room_queries = [query for query in queries if 'chat_privatechatroom' in query['sql']]
+        self.assertEqual(len(room_queries), 1)
+        self.assertEqual(second.json()['data']['id'], first)
+        self.assertEqual(PrivateChatRoom.objects.count(), 1)
@@ -6,4 +6,7 @@ app_name = 'chat'
 urlpatterns = [
     path('private-rooms/', views.PrivateChatRoomView.as_view(), name='private_chat_rooms'),
     path('group-rooms/', views.GroupChatRoomView.as_view(), name='group_chat_rooms'),
+    path('group-rooms/<int:room_id>/members/', views.GroupMemberView.as_view(), name='group_members'),
+    path('group-rooms/<int:room_id>/admins/', views.GroupAdminView.as_view(), name='group_admins'),
+    path('inbox/', views.InboxView.as_view(), name='inbox'),
 ]
\ No newline at end of file
@@ -2,10 +2,18 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from .models import  PrivateChatRoom,GroupChatRoom
-from .serializers import  PrivateChatRoomSerializer,GroupChatRoomSerializer
+from rest_framework.pagination import CursorPagination
+from django.db.models import F, FilteredRelation, OuterRef, Prefetch, Q, Subquery
+from .models import  PrivateChatRoom,GroupChatRoom,GroupMembership,InboxEntry
+from .serializers import  (
+    PrivateChatRoomSerializer, GroupChatRoomSerializer, GroupChatRoomSummarySerializer,
+    GroupMemberSerializer, InboxEntrySerializer,
+)
 from apps.accounts.models import User
 
+# 批量成员操作单次最多处理的用户数
+MAX_BULK_MEMBERS = 5000
+
 class PrivateChatRoomView(APIView):
     """
     处理私聊房间的创建和访问
@@ -43,24 +51,8 @@ class PrivateChatRoomView(APIView):
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # 检查是否已经存在聊天房间
-        try:
-            chat_room = PrivateChatRoom.objects.get(
-                user1=request.user,
-                user2=user2
-            )
-        except PrivateChatRoom.DoesNotExist:
-            try:
-                chat_room = PrivateChatRoom.objects.get(
-                    user1=user2,
-                    user2=request.user
-                )
-            except PrivateChatRoom.DoesNotExist:
-                # 创建新的聊天房间
-                chat_room = PrivateChatRoom.objects.create(
-                    user1=request.user,
-                    user2=user2
-                )
+        # 双方按ID排序后一次查询，不存在时创建（并发创建由唯一约束兜底）
+        chat_room, _ = PrivateChatRoom.get_or_create_for(request.user.id, user2.id)
         
         serializer = PrivateChatRoomSerializer(chat_room)
         return Response({
@@ -117,16 +109,226 @@ class GroupChatRoomView(APIView):
 
     def get(self, request) -> Response:
         """
-        获取当前用户的所有群聊房间
+        获取当前用户的所有群聊房间，按最后活跃时间倒序
+        ?view=summary 时只返回精简信息（成员数和我的角色），成员列表通过成员接口分页获取
         """
+        # 顺序取自当前用户的会话条目，走(user, -last_activity_at)索引，不在全部群聊上排序
+        order = {
+            room_id: index for index, room_id in enumerate(
+                InboxEntry.objects.filter(user=request.user, room_type='group')
+                .order_by('-last_activity_at', '-id')
+                .values_list('room_id', flat=True)
+            )
+        }
         # 获取用户作为member的所有群聊房间
         group_rooms = GroupChatRoom.objects.filter(
             members=request.user
-        )
+        ).order_by()
 
-        serializer = GroupChatRoomSerializer(group_rooms, many=True, context={'request': request})
+        if request.query_params.get('view') == 'summary':
+            group_rooms = group_rooms.annotate(my_role=Subquery(
+                GroupMembership.objects.filter(
+                    room_id=OuterRef('pk'),
+                    user_id=request.user.id
+                ).values('role')[:1]
+            ))
+            group_rooms = sorted(group_rooms, key=lambda room: order.get(room.id, len(order)))
+            serializer = GroupChatRoomSummarySerializer(group_rooms, many=True, context={'request': request})
+        else:
+            group_rooms = group_rooms.prefetch_related('members', Prefetch(
+                'memberships',
+                queryset=GroupMembership.objects.filter(role=GroupMembership.ROLE_ADMIN).select_related('user'),
+                to_attr='admin_memberships',
+            ))
+            group_rooms = sorted(group_rooms, key=lambda room: order.get(room.id, len(order)))
+            serializer = GroupChatRoomSerializer(group_rooms, many=True, context={'request': request})
         return Response({
             "code": 200,
             "message": "获取群聊房间列表成功",
             "data": serializer.data
+        })
+
+
+class GroupMemberPagination(CursorPagination):
+    """
+    群成员游标分页，按用户名排序（用户名唯一，可直接作为游标）
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'username'
+
+
+class GroupRoomAccessMixin:
+    """
+    按room_id获取群聊并校验当前用户的成员/管理员身份
+    """
+
+    def get_room(self, request, room_id, require_admin=False):
+        """
+        返回(群聊, 错误响应)，校验通过时错误响应为None
+        """
+        room = GroupChatRoom.objects.filter(id=room_id).first()
+        if room is None:
+            return None, Response({
+                "code": 404,
+                "message": "群聊不存在",
+                "data": None
+            }, status=status.HTTP_404_NOT_FOUND)
+        if require_admin and not room.is_admin(request.user):
+            return None, Response({
+                "code": 403,
+                "message": "只有群管理员可以执行该操作",
+                "data": None
+            }, status=status.HTTP_403_FORBIDDEN)
+        if not require_admin and not room.is_member(request.user):
+            return None, Response({
+                "code": 403,
+                "message": "不是群聊成员",
+                "data": None
+            }, status=status.HTTP_403_FORBIDDEN)
+        return room, None
+
+    def get_user_ids(self, request):
+        """
+        解析请求体中的user_ids，返回(存在的用户ID列表, 错误响应)
+        """
+        user_ids = request.data.get('user_ids')
+        if not isinstance(user_ids, list) or not user_ids:
+            return None, Response({
+                "code": 400,
+                "message": "缺少用户ID列表参数",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > MAX_BULK_MEMBERS:
+            return None, Response({
+                "code": 400,
+                "message": f"单次最多处理{MAX_BULK_MEMBERS}个用户",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_ids = [int(user_id) for user_id in user_ids]
+        except (TypeError, ValueError):
+            return None, Response({
+                "code": 400,
+                "message": "用户ID必须为整数",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        existing = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        return [user_id for user_id in user_ids if user_id in existing], None
+
+
+class GroupMemberView(GroupRoomAccessMixin, APIView):
+    """
+    群成员列表与批量成员管理
+    GET：游标分页，?search= 按用户名前缀搜索（可使用用户名索引）
+    POST / DELETE：管理员批量添加 / 移除成员，请求体 {"user_ids": [...]}
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id) -> Response:
+        room, error = self.get_room(request, room_id)
+        if error:
+            return error
+
+        members = User.objects.annotate(
+            membership=FilteredRelation('group_memberships', condition=Q(group_memberships__room_id=room.id))
+        ).filter(membership__isnull=False).annotate(room_role=F('membership__role'))
+        search = request.query_params.get('search')
+        if search:
+            members = members.filter(username__startswith=search)
+
+        paginator = GroupMemberPagination()
+        page = paginator.paginate_queryset(members, request, view=self)
+        serializer = GroupMemberSerializer(page, many=True, context={'request': request})
+        return Response({
+            "code": 200,
+            "message": "获取群成员列表成功",
+            "data": serializer.data,
+            "member_count": room.member_count,
+            "pagination-next": paginator.get_next_link(),
+            "pagination-previous": paginator.get_previous_link(),
+        })
+
+    def post(self, request, room_id) -> Response:
+        room, error = self.get_room(request, room_id, require_admin=True)
+        if error:
+            return error
+        user_ids, error = self.get_user_ids(request)
+        if error:
+            return error
+
+        added = room.add_members(user_ids)
+        return Response({
+            "code": 200,
+            "message": "添加群成员成功",
+            "data": {"added": added}
+        })
+
+    def delete(self, request, room_id) -> Response:
+        room, error = self.get_room(request, room_id, require_admin=True)
+        if error:
+            return error
+        user_ids, error = self.get_user_ids(request)
+        if error:
+            return error
+
+        removed = room.remove_members(user_ids)
+        return Response({
+            "code": 200,
+            "message": "移除群成员成功",
+            "data": {"removed": removed}
+        })
+
+
+class GroupAdminView(GroupRoomAccessMixin, APIView):
+    """
+    管理员批量设置群管理员，请求体 {"user_ids": [...]}（只处理群成员）
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id) -> Response:
+        room, error = self.get_room(request, room_id, require_admin=True)
+        if error:
+            return error
+        user_ids, error = self.get_user_ids(request)
+        if error:
+            return error
+
+        promoted = room.add_admins(user_ids)
+        return Response({
+            "code": 200,
+            "message": "设置群管理员成功",
+            "data": {"promoted": promoted}
+        })
+
+
+class InboxPagination(CursorPagination):
+    """
+    会话列表游标分页：按最后活跃时间倒序，翻页时新消息不会造成条目重复或遗漏
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-last_activity_at', '-id')
+
+
+class InboxView(APIView):
+    """
+    会话列表：私聊和群聊按最后活跃时间倒序，包含展示名称、头像、最后一条消息摘要和未读数
+    每页只查询一次会话条目表
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request) -> Response:
+        entries = InboxEntry.objects.filter(user=request.user)
+        paginator = InboxPagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        serializer = InboxEntrySerializer(page, many=True)
+        return Response({
+            "code": 200,
+            "message": "获取会话列表成功",
+            "data": serializer.data,
+            "pagination-next": paginator.get_next_link(),
+            "pagination-previous": paginator.get_previous_link(),
         })
\ No newline at end of file
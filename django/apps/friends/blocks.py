@@ -0,0 +1,61 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+
+BLOCKED_KEY = 'blocked_users:{}'
+
+
+def block_group_name(user_id):
+    """
+    屏蔽列表变化事件的组名，用户的每个聊天连接都加入该组
+    """
+    return f'blocks_{user_id}'
+
+
+class BlockListService:
+    """
+    屏蔽列表：按用户缓存被其屏蔽的用户ID集合，发消息和投递消息时做O(1)判断
+    FriendBlock变化时由信号重新生成集合并推送给该用户在线的聊天连接，投递路径上不查询数据库
+    """
+
+    def _load(self, user_id):
+        from .models import FriendBlock
+        return frozenset(
+            FriendBlock.objects.filter(
+                friend__owner_id=user_id, is_blocked=True
+            ).values_list('friend__friend_id', flat=True)
+        )
+
+    def get_blocked_ids(self, user_id):
+        key = BLOCKED_KEY.format(user_id)
+        blocked = cache.get(key)
+        if blocked is None:
+            blocked = self._load(user_id)
+            cache.set(key, blocked, None)
+        return blocked
+
+    async def aget_blocked_ids(self, user_id):
+        blocked = await cache.aget(BLOCKED_KEY.format(user_id))
+        if blocked is None:
+            blocked = await sync_to_async(self.get_blocked_ids)(user_id)
+        return blocked
+
+    def is_blocked(self, user_id, sender_id):
+        """
+        user_id是否屏蔽了sender_id
+        """
+        return sender_id in self.get_blocked_ids(user_id)
+
+    def refresh(self, user_id):
+        """
+        重新生成用户的屏蔽集合，并通知其在线的聊天连接替换本地副本
+        """
+        blocked = self._load(user_id)
+        cache.set(BLOCKED_KEY.format(user_id), blocked, None)
+        async_to_sync(get_channel_layer().group_send)(block_group_name(user_id), {
+            'type': 'blocks.changed',
+            'blocked_ids': list(blocked),
+        })
+
+
+block_list_service = BlockListService()
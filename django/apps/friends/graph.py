@@ -0,0 +1,148 @@
+import random
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import Q
+
+ADJACENCY_KEY = 'friend_graph:{}'
+SUGGESTIONS_KEY = 'friend_suggestions:{}'
+# 预计算推荐的过期时间（秒），由compute_friend_suggestions命令定期刷新
+SUGGESTIONS_TIMEOUT = 24 * 60 * 60
+# 每个用户保留的推荐数量
+SUGGESTION_LIMIT = 20
+# 计算推荐时每个用户最多展开的好友数（好友很多的用户抽样，限制二度好友的规模）
+SUGGESTION_FANOUT = 50
+# 邻接表回源时每次查询的用户数
+LOAD_CHUNK_SIZE = 500
+
+
+class FriendGraphService:
+    """
+    好友关系图：按用户缓存好友ID集合（邻接表），共同好友和好友推荐都在集合上计算，不做ORM联表
+    Friend变化时由信号清除双方的邻接表，下次读取时用一次查询重建
+    """
+
+    def get_friend_ids(self, user_id):
+        return self.get_adjacency([user_id])[user_id]
+
+    def get_adjacency(self, user_ids):
+        """
+        批量获取邻接表，返回 {user_id: set(好友ID)}；未命中缓存的用户一次查询补齐
+        """
+        user_ids = set(user_ids)
+        keys = {ADJACENCY_KEY.format(user_id): user_id for user_id in user_ids}
+        adjacency = {keys[key]: value for key, value in cache.get_many(keys).items()}
+        missing = sorted(user_ids - adjacency.keys())
+        if missing:
+            from .models import Friend
+            # 分块回源，避免单条IN查询和单次set_many过大
+            for start in range(0, len(missing), LOAD_CHUNK_SIZE):
+                chunk = missing[start:start + LOAD_CHUNK_SIZE]
+                loaded = {user_id: set() for user_id in chunk}
+                for owner_id, friend_id in Friend.objects.filter(
+                    owner_id__in=chunk
+                ).values_list('owner_id', 'friend_id'):
+                    loaded[owner_id].add(friend_id)
+                cache.set_many({ADJACENCY_KEY.format(user_id): friends for user_id, friends in loaded.items()}, None)
+                adjacency.update(loaded)
+        return adjacency
+
+    def invalidate(self, *user_ids):
+        cache.delete_many([ADJACENCY_KEY.format(user_id) for user_id in user_ids])
+
+    # ---- 共同好友 ----
+
+    def mutual_friend_ids(self, user_id, other_id):
+        adjacency = self.get_adjacency([user_id, other_id])
+        return adjacency[user_id] & adjacency[other_id]
+
+    def mutual_counts(self, user_id, other_ids):
+        """
+        批量统计与多个用户的共同好友数，返回 {other_id: count}
+        """
+        adjacency = self.get_adjacency([user_id, *other_ids])
+        friends = adjacency[user_id]
+        return {other_id: len(friends & adjacency[other_id]) for other_id in other_ids}
+
+    # ---- 好友推荐 ----
+
+    def _fanout(self, user_id, friends, fanout):
+        """
+        用于展开二度好友的好友子集：超过fanout时按用户固定种子抽样，同一用户每次结果一致
+        """
+        if len(friends) <= fanout:
+            return friends
+        return set(random.Random(user_id).sample(sorted(friends), fanout))
+
+    def get_exclusions(self, user_ids):
+        """
+        不应推荐给用户的人：双方之间有待处理的好友请求，或任一方屏蔽了对方
+        返回 {user_id: set(用户ID)}，两次查询
+        """
+        from .models import FriendBlock, FriendRequest
+
+        user_ids = set(user_ids)
+        excluded = {user_id: set() for user_id in user_ids}
+
+        def exclude(pairs):
+            for a, b in pairs:
+                if a in excluded:
+                    excluded[a].add(b)
+                if b in excluded:
+                    excluded[b].add(a)
+
+        exclude(FriendRequest.objects.filter(
+            Q(sender_id__in=user_ids) | Q(receiver_id__in=user_ids), status='pending'
+        ).values_list('sender_id', 'receiver_id'))
+        exclude(FriendBlock.objects.filter(
+            Q(friend__owner_id__in=user_ids) | Q(friend__friend_id__in=user_ids), is_blocked=True
+        ).values_list('friend__owner_id', 'friend__friend_id'))
+        return excluded
+
+    def compute_suggestions(self, user_ids, limit=SUGGESTION_LIMIT, fanout=SUGGESTION_FANOUT):
+        """
+        批量计算好友推荐：二度好友按共同好友数降序排列，
+        排除本人、已添加的好友、有待处理请求的用户以及屏蔽关系中的用户
+        每个用户最多展开fanout个好友，二度好友的邻接表按块回源
+        返回 {user_id: [(推荐用户ID, 共同好友数), ...]}
+        """
+        adjacency = self.get_adjacency(user_ids)
+        expanded = {
+            user_id: self._fanout(user_id, adjacency[user_id], fanout) for user_id in user_ids
+        }
+        second_degree = set().union(*expanded.values()) - adjacency.keys()
+        adjacency.update(self.get_adjacency(second_degree))
+        exclusions = self.get_exclusions(user_ids)
+
+        suggestions = {}
+        for user_id in user_ids:
+            scores = Counter()
+            for friend_id in expanded[user_id]:
+                scores.update(adjacency[friend_id])
+            for excluded in adjacency[user_id] | exclusions[user_id] | {user_id}:
+                scores.pop(excluded, None)
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            suggestions[user_id] = ranked[:limit]
+        return suggestions
+
+    def store_suggestions(self, suggestions):
+        cache.set_many(
+            {SUGGESTIONS_KEY.format(user_id): ranked for user_id, ranked in suggestions.items()},
+            SUGGESTIONS_TIMEOUT
+        )
+
+    def get_suggestions(self, user_id):
+        """
+        读取预计算的推荐（未预计算时即时计算一次），并过滤掉此后已添加的好友、
+        新发出或收到好友请求的用户以及屏蔽关系中的用户
+        """
+        ranked = cache.get(SUGGESTIONS_KEY.format(user_id))
+        if ranked is None:
+            suggestions = self.compute_suggestions([user_id])
+            self.store_suggestions(suggestions)
+            ranked = suggestions[user_id]
+        excluded = self.get_friend_ids(user_id) | self.get_exclusions([user_id])[user_id]
+        return [(other_id, count) for other_id, count in ranked if other_id not in excluded]
+
+
+friend_graph = FriendGraphService()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts.models import User
+from apps.friends.graph import SUGGESTION_LIMIT, friend_graph
+
+
+class Command(BaseCommand):
+    help = '分批预计算好友推荐（按共同好友数排序）并写入缓存，建议定时执行'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的用户数')
+        parser.add_argument('--limit', type=int, default=SUGGESTION_LIMIT, help='每个用户保留的推荐数量')
+        parser.add_argument('--user', type=int, action='append', help='只计算指定用户，可重复指定')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True).order_by('id')
+        if options['user']:
+            users = users.filter(id__in=options['user'])
+        user_ids = list(users.values_list('id', flat=True))
+
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            friend_graph.store_suggestions(friend_graph.compute_suggestions(batch, options['limit']))
+            self.stdout.write(f'已处理 {start + len(batch)}/{len(user_ids)}')
+        self.stdout.write(self.style.SUCCESS(f'已为{len(user_ids)}个用户生成好友推荐'))
@@ -3,6 +3,7 @@
 from rest_framework import serializers
 from .models import Friend, FriendRequest, FriendNickname, FriendGroup, FriendBlock, FriendGroupMembership
 from django.conf import settings
+from apps.accounts.serializers import UserSerializer
 
 class FriendSerializer(serializers.ModelSerializer):
     """
@@ -26,6 +27,38 @@ class FriendSerializer(serializers.ModelSerializer):
             return None
 
 
+class FriendListSerializer(serializers.ModelSerializer):
+    """
+    好友列表序列化器（只读）
+    需配合select_related('friend', 'nickname_obj', 'block_obj')使用，分组关系通过context['group_ids']传入
+    """
+    # 所有行共用一个嵌套序列化器实例，不再逐行创建UserSerializer
+    friend_info = UserSerializer(source='friend', read_only=True)
+    nickname = serializers.SerializerMethodField()
+    is_blocked = serializers.SerializerMethodField()
+    group_ids = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Friend
+        fields = ['id', 'friend', 'created_at', 'friend_info', 'nickname', 'is_blocked', 'group_ids']
+        read_only_fields = fields
+
+    def get_nickname(self, obj):
+        try:
+            return obj.nickname_obj.nickname
+        except FriendNickname.DoesNotExist:
+            return None
+
+    def get_is_blocked(self, obj):
+        try:
+            return obj.block_obj.is_blocked
+        except FriendBlock.DoesNotExist:
+            return False
+
+    def get_group_ids(self, obj):
+        return self.context.get('group_ids', {}).get(obj.id, [])
+
+
 class FriendRequestSerializer(serializers.ModelSerializer):
     """
         好友请求序列化器
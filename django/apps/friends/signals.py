@@ -1,7 +1,13 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Friend
+from .models import Friend, FriendNickname, FriendBlock, FriendGroup, FriendGroupMembership
+from .blocks import block_list_service
+from .graph import friend_graph
+from .snapshots import bump_versions
+from apps.accounts.models import User
 from apps.chat.models import PrivateChatRoom
+from apps.realtime.presence import presence_service
 
 @receiver(post_save, sender=Friend)
 def create_private_chatroom(sender, instance, created, **kwargs):
@@ -11,29 +17,109 @@ def create_private_chatroom(sender, instance, created, **kwargs):
     if created:
         # 确保双向好友关系都存在时才创建聊天室
         if Friend.objects.filter(owner=instance.friend, friend=instance.owner).exists():
-            # 创建私聊房间，确保不会重复创建
-            try:
-                PrivateChatRoom.objects.get_or_create(
-                    user1=instance.owner,
-                    user2=instance.friend
-                )
-            except Exception:
-                # 如果创建失败，可能是唯一约束冲突，忽略错误
-                pass
+            # 创建私聊房间，双方按ID排序，不会重复创建
+            PrivateChatRoom.get_or_create_for(instance.owner_id, instance.friend_id)
 
 @receiver(post_delete, sender=Friend)
 def delete_private_chatroom(sender, instance, **kwargs):
     """
     当好友关系删除时，自动删除私聊房间
     """
-    try:
-        # 查找并删除对应的私聊房间
-        chat_room = PrivateChatRoom.objects.filter(
-            user1__in=[instance.owner, instance.friend],
-            user2__in=[instance.owner, instance.friend]
-        ).first()
-        
-        if chat_room:
-            chat_room.delete()
-    except PrivateChatRoom.DoesNotExist:
-        pass
\ No newline at end of file
+    # 查找并删除对应的私聊房间
+    PrivateChatRoom.objects.filter(
+        **PrivateChatRoom.ordered_pair(instance.owner_id, instance.friend_id)
+    ).delete()
+
+
+@receiver(post_save, sender=Friend)
+@receiver(post_delete, sender=Friend)
+def invalidate_presence_audience(sender, instance, **kwargs):
+    """
+    好友关系变化时，清除被添加方的在线状态广播对象缓存
+    """
+    presence_service.invalidate_audience(instance.friend_id)
+
+
+@receiver(post_save, sender=Friend)
+@receiver(post_delete, sender=Friend)
+def invalidate_friend_list(sender, instance, **kwargs):
+    """
+    好友关系变化时使好友列表快照失效
+    """
+    bump_versions(instance.owner_id)
+
+
+@receiver(post_save, sender=Friend)
+@receiver(post_delete, sender=Friend)
+def invalidate_friend_graph(sender, instance, **kwargs):
+    """
+    好友关系变化时清除所属用户的邻接表，下次读取时重建
+    """
+    friend_graph.invalidate(instance.owner_id)
+
+
+@receiver(post_save, sender=FriendNickname)
+@receiver(post_delete, sender=FriendNickname)
+@receiver(post_save, sender=FriendBlock)
+@receiver(post_delete, sender=FriendBlock)
+def invalidate_friend_list_by_friend(sender, instance, **kwargs):
+    """
+    备注或屏蔽状态变化时使所属用户的好友列表快照失效
+    """
+    owner_id = Friend.objects.filter(id=instance.friend_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        bump_versions(owner_id)
+
+
+@receiver(post_save, sender=FriendBlock)
+@receiver(post_delete, sender=FriendBlock)
+def sync_block_list(sender, instance, **kwargs):
+    """
+    屏蔽状态变化（含删除好友时级联删除）后，事务提交时刷新屏蔽集合并推送给在线连接
+    """
+    owner_id = Friend.objects.filter(id=instance.friend_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        transaction.on_commit(lambda: block_list_service.refresh(owner_id))
+
+
+@receiver(post_save, sender=FriendGroupMembership)
+@receiver(post_delete, sender=FriendGroupMembership)
+def invalidate_friend_list_by_group(sender, instance, **kwargs):
+    """
+    分组成员变化时使分组所有者的好友列表快照失效
+    """
+    owner_id = FriendGroup.objects.filter(id=instance.group_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        bump_versions(owner_id)
+
+
+@receiver(post_save, sender=FriendGroup)
+@receiver(post_delete, sender=FriendGroup)
+def invalidate_friend_list_by_group_change(sender, instance, **kwargs):
+    """
+    分组创建、改名或删除时使好友树快照失效
+    """
+    bump_versions(instance.owner_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_friend_list_by_user(sender, instance, created, update_fields=None, **kwargs):
+    """
+    用户资料变化时使把该用户加为好友的人的快照失效（登录等只更新其他字段时跳过）
+    """
+    if created:
+        return
+    if update_fields is not None and not {'username', 'user_avatar', 'user_status'} & set(update_fields):
+        return
+    bump_versions(*presence_service.get_audience_ids(instance.id))
+
+
+def friendships_created(pairs):
+    """
+    bulk_create不会触发post_save：批量建立好友关系后手动清除相关缓存
+    pairs为(owner_id, friend_id)列表；私聊房间由调用方创建
+    """
+    owner_ids = {owner_id for owner_id, _ in pairs}
+    presence_service.invalidate_audience(*{friend_id for _, friend_id in pairs})
+    bump_versions(*owner_ids)
+    friend_graph.invalidate(*owner_ids)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import uuid
+
+from django.core.cache import cache
+
+VERSION_KEY = 'friend_list_version:{}'
+SNAPSHOT_KEY = 'friend_list:{}:{}'
+TREE_KEY = 'friend_tree:{}:{}'
+# 好友列表快照的过期时间（秒）；版本号变化后旧快照不再被读取
+SNAPSHOT_TIMEOUT = 60 * 60
+
+
+def _new_version():
+    # 版本号不用自增计数：缓存被清空后重新生成也不会与旧快照的版本号重复
+    return uuid.uuid4().hex[:16]
+
+
+def get_version(user_id):
+    """
+    获取用户好友列表的当前版本号（同时作为ETag）
+    """
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(*user_ids):
+    """
+    好友、备注、屏蔽、分组或好友资料变化时更新版本号，使旧快照失效
+    """
+    if user_ids:
+        cache.set_many({VERSION_KEY.format(user_id): _new_version() for user_id in set(user_ids)}, None)
+
+
+def build_snapshot(user_id):
+    """
+    生成好友列表：好友及其资料、备注、屏蔽状态一次联表查询，分组关系一次查询
+    """
+    from .models import Friend, FriendGroupMembership
+    from .serializers import FriendListSerializer
+
+    friends = list(
+        Friend.objects.filter(owner_id=user_id)
+        .select_related('friend', 'nickname_obj', 'block_obj')
+        .order_by('id')
+    )
+    group_ids = {}
+    for friend_id, group_id in FriendGroupMembership.objects.filter(
+        group__owner_id=user_id
+    ).values_list('friend_id', 'group_id'):
+        group_ids.setdefault(friend_id, []).append(group_id)
+    return FriendListSerializer(friends, many=True, context={'group_ids': group_ids}).data
+
+
+def build_tree(user_id, friends=None):
+    """
+    生成分组好友树：分组按创建顺序排列并内嵌好友，未分组的好友单独列出
+    好友数据复用列表快照（含备注、屏蔽状态和在线状态），另需一次分组查询
+    """
+    from .models import FriendGroup
+
+    if friends is None:
+        friends = build_snapshot(user_id)
+    groups = [
+        {'id': group_id, 'name': name, 'friends': []}
+        for group_id, name in FriendGroup.objects.filter(owner_id=user_id).order_by('id').values_list('id', 'name')
+    ]
+    by_id = {group['id']: group for group in groups}
+    ungrouped = []
+    for friend in friends:
+        # 快照生成后被删除的分组不再出现在分组查询中，跳过；全部分组都已删除的好友归入未分组
+        group_ids = [group_id for group_id in friend['group_ids'] if group_id in by_id]
+        if not group_ids:
+            ungrouped.append(friend)
+        for group_id in group_ids:
+            by_id[group_id]['friends'].append(friend)
+    return {'groups': groups, 'ungrouped': ungrouped}
+
+
+def _get_cached(key, build):
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, SNAPSHOT_TIMEOUT)
+    return data
+
+
+def get_snapshot(user_id, version=None):
+    """
+    获取好友列表快照，返回(版本号, 数据)；同一版本只生成一次
+    """
+    version = version or get_version(user_id)
+    return version, _get_cached(SNAPSHOT_KEY.format(user_id, version), lambda: build_snapshot(user_id))
+
+
+def get_tree(user_id, version=None):
+    """
+    获取分组好友树，返回(版本号, 数据)；与好友列表共用版本号
+    """
+    version = version or get_version(user_id)
+    return version, _get_cached(
+        TREE_KEY.format(user_id, version),
+        lambda: build_tree(user_id, get_snapshot(user_id, version)[1])
+    )
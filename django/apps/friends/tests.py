@@ -1,11 +1,20 @@
+from io import StringIO
 import random
 import string
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.urls import reverse
 from apps.accounts.models import User
+from apps.chat.models import InboxEntry, PrivateChatRoom
+from apps.friends.graph import friend_graph
+from apps.friends.views import FriendRequestService
 from apps.friends.models import Friend, FriendBlock, FriendGroup, FriendGroupMembership, FriendNickname, FriendRequest
+from apps.friends.snapshots import build_snapshot, build_tree
 # Create your tests here.
 def generate_random_registration_data():
     # 生成随机用户名
@@ -434,3 +443,231 @@ class FriendBlockViewSetTests(TestCase):
                                    block_data, format='json')
         # 因为我们无法访问不属于自己的FriendBlock对象，所以应该返回404而不是403
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class FriendListSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='snapshot_owner', password='pass12345')
+        self.group = FriendGroup.objects.create(owner=self.user, name='同学')
+        for index in range(5):
+            other = User.objects.create_user(username=f'snapshot_friend_{index}', password='pass12345')
+            friend = Friend.objects.create(owner=self.user, friend=other)
+            FriendNickname.objects.create(friend=friend, nickname=f'备注{index}')
+            FriendBlock.objects.create(friend=friend, is_blocked=index == 0)
+            FriendGroupMembership.objects.create(group=self.group, friend=friend)
+        self.client.force_authenticate(user=self.user)
+
+    def test_query_count_is_fixed(self):
+        # 好友数量不影响查询次数：好友联表查询一次，分组关系查询一次
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('friend-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 2)
+        data = response.data['data']
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data[0]['nickname'], '备注0')
+        self.assertTrue(data[0]['is_blocked'])
+        self.assertEqual(data[0]['group_ids'], [self.group.id])
+        self.assertEqual(data[0]['friend_info']['username'], 'snapshot_friend_0')
+
+        # 版本未变化时直接读取快照
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('friend-list'))
+        self.assertEqual(len(queries), 0)
+
+    def test_if_none_match_returns_304(self):
+        response = self.client.get(reverse('friend-list'))
+        etag = response['ETag']
+        response = self.client.get(reverse('friend-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_writes_invalidate_snapshot(self):
+        etag = self.client.get(reverse('friend-list'))['ETag']
+        nickname = FriendNickname.objects.get(nickname='备注1')
+        nickname.nickname = '新备注'
+        nickname.save()
+
+        response = self.client.get(reverse('friend-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('新备注', [item['nickname'] for item in response.data['data']])
+
+        # 好友修改资料同样使快照失效
+        etag = response['ETag']
+        User.objects.filter(username='snapshot_friend_2').get().save(update_fields=['user_avatar'])
+        response = self.client.get(reverse('friend-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_friend_tree(self):
+        # 一个好友移出分组、一个好友加入第二个分组
+        FriendGroupMembership.objects.filter(friend__friend__username='snapshot_friend_4').delete()
+        other_group = FriendGroup.objects.create(owner=self.user, name='同事')
+        first = Friend.objects.get(owner=self.user, friend__username='snapshot_friend_0')
+        FriendGroupMembership.objects.create(group=other_group, friend=first)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('friendgroup-tree'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 3)
+        data = response.data['data']
+        self.assertEqual([group['name'] for group in data['groups']], ['同学', '同事'])
+        self.assertEqual(len(data['groups'][0]['friends']), 4)
+        self.assertEqual([friend['id'] for friend in data['groups'][1]['friends']], [first.id])
+        self.assertEqual([friend['nickname'] for friend in data['ungrouped']], ['备注4'])
+        self.assertIn('user_status', data['ungrouped'][0]['friend_info'])
+
+        etag = response['ETag']
+        response = self.client.get(reverse('friendgroup-tree'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # 分组改名使好友树失效
+        other_group.name = '老同事'
+        other_group.save()
+        response = self.client.get(reverse('friendgroup-tree'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['groups'][1]['name'], '老同事')
+
+    def test_friend_tree_skips_deleted_groups(self):
+        # 快照生成后分组被删除
+        friends = build_snapshot(self.user.id)
+        FriendGroup.objects.filter(id=self.group.id).delete()
+        tree = build_tree(self.user.id, friends)
+        self.assertEqual(tree['groups'], [])
+        self.assertEqual(len(tree['ungrouped']), 5)
+
+
+class FriendGraphTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.users = [
+            User.objects.create_user(username=f'graph_user_{index}', password='pass12345')
+            for index in range(6)
+        ]
+        a, b, c, d, e, f = self.users
+        # a的好友：b、c；b的好友：a、c、d、e；c的好友：a、b、d
+        for owner, friends in ((a, [b, c]), (b, [a, c, d, e]), (c, [a, b, d])):
+            for friend in friends:
+                Friend.objects.create(owner=owner, friend=friend)
+        self.client.force_authenticate(user=a)
+
+    def test_mutual_counts(self):
+        a, b, c, d, e, f = self.users
+        self.assertEqual(friend_graph.mutual_friend_ids(a.id, b.id), {c.id})
+        self.assertEqual(friend_graph.mutual_counts(a.id, [d.id, f.id]), {d.id: 0, f.id: 0})
+
+        response = self.client.get(reverse('friend-mutual'), {'user_ids': f'{b.id},{c.id}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {item['user_id']: item['mutual_count'] for item in response.data['data']},
+            {b.id: 1, c.id: 1}
+        )
+
+    def test_suggestions_ranked_by_mutual_count(self):
+        a, b, c, d, e, f = self.users
+        call_command('compute_friend_suggestions', batch_size=2, stdout=StringIO())
+        response = self.client.get(reverse('friend-suggestions'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data['data']
+        # d是b、c的共同好友，排在只与b相识的e之前
+        self.assertEqual([item['user']['id'] for item in data], [d.id, e.id])
+        self.assertEqual([item['mutual_count'] for item in data], [2, 1])
+
+    def test_friend_changes_update_graph(self):
+        a, b, c, d, e, f = self.users
+        friend_graph.get_suggestions(a.id)
+        Friend.objects.create(owner=a, friend=d)
+        self.assertIn(d.id, friend_graph.get_friend_ids(a.id))
+        # 已添加的好友从预计算推荐中过滤
+        self.assertEqual([user_id for user_id, _ in friend_graph.get_suggestions(a.id)], [e.id])
+
+    def test_suggestions_exclude_pending_requests_and_blocks(self):
+        a, b, c, d, e, f = self.users
+        FriendRequest.objects.create(sender=d, receiver=a)
+        # e单方面添加a后屏蔽了a
+        FriendBlock.objects.create(friend=Friend.objects.create(owner=e, friend=a), is_blocked=True)
+        self.assertEqual(friend_graph.compute_suggestions([a.id])[a.id], [])
+
+    def test_suggestions_fanout_is_capped(self):
+        a, b, c, d, e, f = self.users
+        # 只展开a的一个好友，二度好友只来自该好友
+        suggestions = friend_graph.compute_suggestions([a.id], fanout=1)[a.id]
+        self.assertTrue({user_id for user_id, _ in suggestions} <= {d.id, e.id})
+        self.assertTrue(all(count == 1 for _, count in suggestions))
+
+
+class FriendRequestAcceptTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.receiver = User.objects.create_user(username='accept_receiver', password='pass12345')
+        self.senders = [
+            User.objects.create_user(username=f'accept_sender_{index}', password='pass12345')
+            for index in range(3)
+        ]
+        self.requests = [
+            FriendRequest.objects.create(sender=sender, receiver=self.receiver) for sender in self.senders
+        ]
+        self.client.force_authenticate(user=self.receiver)
+
+    def assertFriends(self, sender):
+        self.assertTrue(Friend.objects.filter(owner=self.receiver, friend=sender).exists())
+        self.assertTrue(Friend.objects.filter(owner=sender, friend=self.receiver).exists())
+        self.assertIsNotNone(PrivateChatRoom.get_for(self.receiver.id, sender.id))
+
+    def test_accept_tolerates_existing_friendship(self):
+        # 一方已添加对方时只补齐缺少的方向
+        sender = self.senders[0]
+        Friend.objects.create(owner=sender, friend=self.receiver)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('friendrequest-accept', kwargs={'pk': self.requests[0].id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # 缓存失效与通知各一个提交后回调
+        self.assertEqual(len(callbacks), 2)
+        self.assertFriends(sender)
+        self.assertEqual(Friend.objects.count(), 2)
+
+        response = self.client.post(reverse('friendrequest-accept', kwargs={'pk': self.requests[0].id}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_accept_all(self):
+        friend_graph.get_friend_ids(self.receiver.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                reverse('friendrequest-accept-all'), {'ids': [self.requests[0].id, self.requests[1].id]}, format='json'
+            )
+            # 提交前不清除缓存，避免并发读取用提交前的数据重建
+            self.assertEqual(friend_graph.get_friend_ids(self.receiver.id), set())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['accepted_ids'], [self.requests[0].id, self.requests[1].id])
+        self.assertFalse(response.data['data']['has_more'])
+        self.assertFriends(self.senders[0])
+        self.assertFriends(self.senders[1])
+        self.assertFalse(Friend.objects.filter(owner=self.senders[2]).exists())
+        # bulk_create不触发信号，缓存由friendships_created在提交后清除
+        for callback in callbacks:
+            callback()
+        self.assertEqual(friend_graph.get_friend_ids(self.receiver.id), {self.senders[0].id, self.senders[1].id})
+        # 批量建立的私聊房间同时建立双方的会话条目
+        self.assertEqual(InboxEntry.objects.filter(room_type='private').count(), 4)
+
+        response = self.client.post(reverse('friendrequest-accept-all'), {}, format='json')
+        self.assertEqual(response.data['data']['accepted_ids'], [self.requests[2].id])
+        self.assertEqual(FriendRequest.objects.filter(status='pending').count(), 0)
+
+        response = self.client.post(reverse('friendrequest-accept-all'), {'ids': 'all'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_accept_is_capped_and_rooms_inserted_at_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            accepted = FriendRequestService.accept_requests(self.receiver, limit=2)
+        self.assertEqual([item.id for item in accepted], [self.requests[0].id, self.requests[1].id])
+        room_inserts = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('INSERT') and 'INTO "chat_privatechatroom"' in query['sql']
+        ]
+        self.assertEqual(len(room_inserts), 1)
+        self.assertEqual(FriendRequest.objects.filter(status='pending').count(), 1)
\ No newline at end of file
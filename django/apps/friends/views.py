@@ -2,6 +2,7 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db import transaction
 from django.db.models import Q
 from .models import Friend, FriendRequest, FriendGroup, FriendGroupMembership, FriendNickname, FriendBlock
 from .serializers import (
@@ -14,6 +15,15 @@ from .serializers import (
 )
 from asgiref.sync import async_to_sync
 from apps.realtime.services import RealtimeService
+from apps.accounts.profiles import get_profiles
+from .graph import friend_graph
+from apps.chat.inbox import inbox_service
+from apps.chat.models import PrivateChatRoom
+from .signals import friendships_created
+from .snapshots import get_snapshot, get_tree, get_version
+
+# 批量接受好友请求单次最多处理的请求数
+MAX_BULK_ACCEPT = 1000
 
 class FriendCleanupService:
     """
@@ -45,6 +55,58 @@ class FriendCleanupService:
         ).delete()
 
 
+class FriendRequestService:
+    """
+    好友请求处理服务：单个和批量接受共用同一流程
+    """
+    @staticmethod
+    def accept_requests(receiver, request_ids=None, limit=MAX_BULK_ACCEPT):
+        """
+        在一个事务内接受发给receiver的待处理请求（request_ids为空时按时间顺序接受最多limit个），返回已接受的请求列表
+        双向好友关系和私聊房间都用bulk_create写入，已存在的由唯一约束忽略；缓存失效和通知在事务提交后进行
+        """
+        with transaction.atomic():
+            # 只锁请求行，不锁select_related联表的发送者用户行
+            pending = FriendRequest.objects.select_for_update(of=('self',)).filter(receiver=receiver, status='pending')
+            if request_ids is not None:
+                pending = pending.filter(id__in=request_ids)
+            accepted = list(pending.select_related('sender').order_by('id')[:limit])
+            if not accepted:
+                return []
+            FriendRequest.objects.filter(id__in=[item.id for item in accepted]).update(status='accepted')
+
+            sender_ids = [item.sender_id for item in accepted]
+            pairs = [(receiver.id, sender_id) for sender_id in sender_ids] + \
+                [(sender_id, receiver.id) for sender_id in sender_ids]
+            Friend.objects.bulk_create(
+                [Friend(owner_id=owner_id, friend_id=friend_id) for owner_id, friend_id in pairs],
+                batch_size=500,
+                ignore_conflicts=True
+            )
+            _, created_rooms = PrivateChatRoom.bulk_get_or_create_for(receiver.id, sender_ids)
+            # bulk_create不触发post_save，新建私聊的会话条目在此批量建立
+            inbox_service.add_private_rooms(created_rooms)
+            # 提交前清除缓存可能被并发读取以提交前的数据重建，因此在提交后进行
+            transaction.on_commit(lambda: friendships_created(pairs))
+
+        FriendRequestService._notify_accepted(receiver, [item.sender for item in accepted])
+        return accepted
+
+    @staticmethod
+    def _notify_accepted(receiver, senders):
+        # 事务提交后在同一个事件循环中发送全部通知：通知请求发送方请求被接受，通知接收方已成功添加好友
+        async def send():
+            for sender in senders:
+                await RealtimeService.send_friend_accepted_notification(
+                    friend_id=receiver.id, user_id=sender.id, friend_username=receiver.username
+                )
+                await RealtimeService.send_friend_accepted_notification(
+                    friend_id=sender.id, user_id=receiver.id, friend_username=sender.username
+                )
+
+        transaction.on_commit(lambda: async_to_sync(send)())
+
+
 class FriendViewSet(viewsets.ModelViewSet):
     """
     好友关系视图集
@@ -64,13 +126,62 @@ class FriendViewSet(viewsets.ModelViewSet):
         instance.delete()
     
     def list(self, request, *args, **kwargs):
-        """获取好友列表"""
-        queryset = self.filter_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
+        """
+        获取好友列表
+        返回按版本号缓存的快照，ETag为版本号；客户端携带If-None-Match且未变化时返回304
+        """
+        version = get_version(request.user.id)
+        etag = f'"{version}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        _, data = get_snapshot(request.user.id, version)
         return Response({
             "code": 200,
             "message": "好友列表获取成功",
-            "data": serializer.data
+            "data": data
+        }, headers={'ETag': etag})
+
+    @action(detail=False, methods=['get'])
+    def mutual(self, request):
+        """
+        查询与指定用户的共同好友数，?user_ids=1,2,3
+        """
+        try:
+            user_ids = [int(value) for value in request.query_params.get('user_ids', '').split(',') if value]
+        except ValueError:
+            return Response({
+                "code": 400,
+                "message": "user_ids格式错误",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        counts = friend_graph.mutual_counts(request.user.id, user_ids[:100])
+        return Response({
+            "code": 200,
+            "message": "共同好友获取成功",
+            "data": [{"user_id": user_id, "mutual_count": count} for user_id, count in counts.items()]
+        })
+
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        """
+        可能认识的人：按共同好友数排序的预计算推荐
+        """
+        ranked = friend_graph.get_suggestions(request.user.id)
+        profiles = get_profiles([user_id for user_id, _ in ranked])
+        data = []
+        for user_id, count in ranked:
+            profile = profiles.get(user_id)
+            if profile is None or not profile['is_active']:
+                continue
+            data.append({
+                "user": {key: value for key, value in profile.items() if key != 'is_active'},
+                "mutual_count": count,
+            })
+        return Response({
+            "code": 200,
+            "message": "好友推荐获取成功",
+            "data": data
         })
     
     def create(self, request, *args, **kwargs):
@@ -238,50 +349,50 @@ class FriendRequestViewSet(viewsets.ModelViewSet):
                 "data": None
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # 更新请求状态
-        friend_request.status = 'accepted'
-        friend_request.save()
-        
-        # 检查是否已经存在反向好友关系
-        if not Friend.objects.filter(
-            owner=friend_request.receiver, 
-            friend=friend_request.sender
-        ).exists():
-            # 创建反向好友关系
-            Friend.objects.create(
-                owner=friend_request.receiver, 
-                friend=friend_request.sender
-            )
-            
-        # 检查是否已经存在正向好友关系
-        if not Friend.objects.filter(
-            owner=friend_request.sender, 
-            friend=friend_request.receiver
-        ).exists():
-            # 创建正向好友关系
-            Friend.objects.create(
-                owner=friend_request.sender, 
-                friend=friend_request.receiver
-            )
-        
-        # 发送好友成功请求通知
-        # 通知请求发送方，他的好友请求被接受了
-        async_to_sync(RealtimeService.send_friend_accepted_notification)(
-            friend_id=friend_request.receiver.id, 
-            user_id=friend_request.sender.id
-        )
-        
-        # 通知请求接收方，他已成功添加好友
-        async_to_sync(RealtimeService.send_friend_accepted_notification)(
-            friend_id=friend_request.sender.id, 
-            user_id=friend_request.receiver.id
-        )
+        # 并发处理同一请求时以行锁内的状态为准
+        if not FriendRequestService.accept_requests(request.user, [friend_request.id]):
+            return Response({
+                "code": 400,
+                "message": "该请求已处理",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
         return Response({
             "code": 200,
             "message": "好友请求已接受",
             "data": None
         })
 
+    @action(detail=False, methods=['post'], url_path='accept-all')
+    def accept_all(self, request):
+        """
+        批量接受好友请求：传入ids时只接受指定请求，否则按时间顺序接受最多MAX_BULK_ACCEPT个待处理请求
+        has_more为True时客户端可再次调用继续处理
+        """
+        request_ids = request.data.get('ids')
+        if request_ids is not None and not (
+            isinstance(request_ids, list) and all(isinstance(value, int) for value in request_ids)
+        ):
+            return Response({
+                "code": 400,
+                "message": "ids必须是请求ID列表",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if request_ids is not None and len(request_ids) > MAX_BULK_ACCEPT:
+            return Response({
+                "code": 400,
+                "message": f"单次最多处理{MAX_BULK_ACCEPT}个请求",
+                "data": None
+            }, status=status.HTTP_400_BAD_REQUEST)
+        accepted = FriendRequestService.accept_requests(request.user, request_ids)
+        has_more = request_ids is None and FriendRequest.objects.filter(
+            receiver=request.user, status='pending'
+        ).exists()
+        return Response({
+            "code": 200,
+            "message": f"已接受{len(accepted)}个好友请求",
+            "data": {"accepted_ids": [item.id for item in accepted], "has_more": has_more}
+        })
+
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         """拒绝好友请求"""
@@ -321,6 +432,24 @@ class FriendGroupViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """
+        获取分组好友树：分组内嵌好友（含备注、屏蔽和在线状态），未分组好友单独列出
+        与好友列表共用版本号作为ETag，未变化时返回304
+        """
+        version = get_version(request.user.id)
+        etag = f'"{version}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        _, data = get_tree(request.user.id, version)
+        return Response({
+            "code": 200,
+            "message": "好友分组树获取成功",
+            "data": data
+        }, headers={'ETag': etag})
     
     def list(self, request, *args, **kwargs):
         """获取好友分组列表"""
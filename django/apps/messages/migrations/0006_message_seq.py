@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    """
+    为已有消息按房间内的发送顺序补齐序号
+    """
+    Message = apps.get_model('custom_messages', 'Message')
+    room_ids = Message.objects.values_list('room_id', flat=True).distinct()
+    for room_id in room_ids:
+        messages = list(Message.objects.filter(room_id=room_id).order_by('timestamp', 'id'))
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        Message.objects.bulk_update(messages, ['seq'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('custom_messages', '0005_remove_message_is_read_isread'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='房间内序号'),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('room_id', 'seq'), name='unique_message_room_seq'),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from apps.accounts.models import User
+from .sequences import next_seq, reset_seq
 # Create your models here.
 class Message(models.Model):
     """
@@ -20,12 +21,37 @@ class Message(models.Model):
     content = models.TextField(null=True, blank=True, verbose_name='内容')
     file = models.FileField(upload_to='chat/files/', null=True, blank=True, verbose_name='文件')
     filename = models.CharField(max_length=255, null=True, blank=True, verbose_name='文件名')
+    # 房间内单调递增的序号，用于断线重连时按区间补发
+    seq = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name='房间内序号')
+
+    # 序号冲突时的最大重试次数
+    SEQ_RETRIES = 3
 
     class Meta:
         ordering = ['timestamp']
+        constraints = [
+            models.UniqueConstraint(fields=['room_id', 'seq'], name='unique_message_room_seq'),
+        ]
 
     def __str__(self):
         return f'{self.messages_type} message from {self.sender.username}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding or self.seq is not None:
+            return super().save(*args, **kwargs)
+
+        for attempt in range(self.SEQ_RETRIES):
+            self.seq = next_seq(self.room_id)
+            try:
+                # 保存点只包住INSERT，冲突时回滚后重试；广播等副作用由post_save延迟到事务提交后
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # 计数器落后于数据库（如缓存被清空），按数据库重置后重试
+                if attempt == self.SEQ_RETRIES - 1:
+                    self.seq = None
+                    raise
+                reset_seq(self.room_id)
     
 class IsRead(models.Model):
     """
@@ -0,0 +1,158 @@
+import threading
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+
+from apps.chat.inbox import inbox_service
+from apps.chat.models import GroupMembership
+from apps.realtime.batching import PeriodicFlusher
+from apps.realtime.conf import realtime_setting
+from .models import IsRead, Message
+
+MARKER_KEY = 'read_marker:{}:{}'
+
+# 原子地把已读位置推进到较大值，返回推进后的值（键不存在时视为0）
+ADVANCE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local candidate = tonumber(ARGV[1])
+if candidate > current then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return candidate
+end
+return current
+"""
+
+
+class ReadMarkerService:
+    """
+    已读标记写后服务
+    每个(用户, 房间)只保留单调递增的最大已读消息ID：
+    - 标记时只更新缓存和进程内的脏标记，回退（更小的ID）直接忽略；
+    - 脏标记按固定间隔、或在连接断开时批量upsert到IsRead表。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(user_id, room_id): message_id}
+        self._dirty = {}
+        self._flusher = None
+        self._advance_script = None
+
+    def get(self, user_id, room_id):
+        """
+        获取用户在房间内最后已读的消息ID，没有记录时返回0
+        """
+        key = MARKER_KEY.format(user_id, room_id)
+        message_id = cache.get(key)
+        if message_id is None:
+            message_id = IsRead.objects.filter(
+                room_id=room_id,
+                receiver_id=user_id
+            ).values_list('message_id', flat=True).first() or 0
+            cache.set(key, message_id, None)
+        return message_id
+
+    def mark(self, user_id, room_id, message_id):
+        """
+        标记已读，返回标记后的已读位置（ID回退时保持原值）
+        消息不存在或不属于该房间时抛出Message.DoesNotExist
+        """
+        current = self.get(user_id, room_id)
+        if message_id <= current:
+            return current
+        # 只有推进已读位置时才校验，回退和重复标记不访问数据库
+        if not Message.objects.filter(id=message_id, room_id=room_id).exists():
+            raise Message.DoesNotExist(f'Message {message_id} is not in room {room_id}')
+
+        advanced = self._advance(MARKER_KEY.format(user_id, room_id), message_id)
+        if advanced != message_id:
+            # 其他进程已写入更大的已读位置
+            return advanced
+        with self._lock:
+            key = (user_id, room_id)
+            self._dirty[key] = max(self._dirty.get(key, 0), message_id)
+        self._start_flusher()
+        return message_id
+
+    def _advance(self, key, message_id):
+        """
+        原子地把缓存中的已读位置推进到message_id（只增不减），返回推进后的值
+        Redis下由Lua脚本完成比较和写入，避免多进程并发读-改-写导致已读位置回退；
+        其他缓存后端（进程内缓存）用进程锁保护。
+        """
+        backend = caches['default']
+        if isinstance(backend, RedisCache):
+            client = backend._cache.get_client(write=True)
+            if self._advance_script is None:
+                self._advance_script = client.register_script(ADVANCE_SCRIPT)
+            return int(self._advance_script(keys=[cache.make_and_validate_key(key)], args=[message_id], client=client))
+        with self._lock:
+            current = cache.get(key) or 0
+            if message_id <= current:
+                return current
+            cache.set(key, message_id, None)
+            return message_id
+
+    def flush(self, user_id=None):
+        """
+        将脏标记批量写入数据库；指定user_id时只写该用户的标记
+        """
+        with self._lock:
+            if user_id is None:
+                batch, self._dirty = self._dirty, {}
+            else:
+                batch = {key: value for key, value in self._dirty.items() if key[0] == user_id}
+                for key in batch:
+                    del self._dirty[key]
+        if not batch:
+            return 0
+
+        user_ids = {key[0] for key in batch}
+        room_ids = {key[1] for key in batch}
+        existing = {
+            (receiver_id, room_id): message_id
+            for receiver_id, room_id, message_id in IsRead.objects.filter(
+                receiver_id__in=user_ids,
+                room_id__in=room_ids
+            ).values_list('receiver_id', 'room_id', 'message_id')
+        }
+        valid_ids = set(
+            Message.objects.filter(id__in=set(batch.values())).values_list('id', flat=True)
+        )
+
+        records = []
+        for (receiver_id, room_id), message_id in batch.items():
+            if message_id not in valid_ids:
+                # 消息不存在（例如已被删除），丢弃该标记并让缓存回源
+                cache.delete(MARKER_KEY.format(receiver_id, room_id))
+                continue
+            if message_id <= existing.get((receiver_id, room_id), 0):
+                continue
+            records.append(IsRead(room_id=room_id, receiver_id=receiver_id, message_id=message_id))
+
+        IsRead.objects.bulk_create(
+            records,
+            update_conflicts=True,
+            unique_fields=['room_id', 'receiver'],
+            update_fields=['message'],
+        )
+        markers = {
+            (record.receiver_id, record.room_id): record.message_id
+            for record in records
+        }
+        # 同步群成员记录中的已读位置，并重新计算会话列表中的未读数
+        GroupMembership.update_last_read(markers)
+        inbox_service.refresh_unread(markers)
+        return len(records)
+
+    def _start_flusher(self):
+        interval = realtime_setting('READ_MARKER_FLUSH_INTERVAL')
+        if not interval:
+            # 间隔为0时不启动后台线程，仅在断开连接或手动调用时写库
+            return
+        if self._flusher is None:
+            self._flusher = PeriodicFlusher(interval, self.flush, name='read-marker-flusher')
+        self._flusher.start()
+
+
+read_marker_service = ReadMarkerService()
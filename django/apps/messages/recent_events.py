@@ -0,0 +1,159 @@
+import json
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.realtime.conf import realtime_setting
+from .sequences import SEQ_KEY
+
+RECENT_KEY = 'room_recent:{}'
+
+
+class RecentEventsBuffer:
+    """
+    房间最近消息事件缓冲
+    每个房间保留最近若干条已序列化的chat_message事件，用于首页历史消息和断线重连补发：
+    - 缓存后端为Redis时使用有序集合（score为seq），追加、裁剪和续期在一个事务中完成；
+    - 其他缓存后端（如开发环境的进程内缓存）退化为缓存中的列表。
+    一段时间没有新消息的房间会整体过期，读取时缓冲不完整则返回None，由调用方回源数据库。
+    """
+
+    def _redis(self):
+        backend = caches['default']
+        if isinstance(backend, RedisCache):
+            return backend._cache.get_client(write=True)
+        return None
+
+    def _key(self, room_id):
+        return cache.make_and_validate_key(RECENT_KEY.format(room_id))
+
+    def append(self, room_id, event):
+        size = realtime_setting('RECENT_EVENTS_SIZE')
+        ttl = realtime_setting('RECENT_EVENTS_TTL')
+        client = self._redis()
+        if client is None:
+            key = RECENT_KEY.format(room_id)
+            events = cache.get(key) or []
+            events.append(event)
+            cache.set(key, events[-size:], ttl)
+            return
+
+        key = self._key(room_id)
+        pipe = client.pipeline(transaction=True)
+        pipe.zadd(key, {json.dumps(event, cls=DjangoJSONEncoder): event['seq']})
+        # 只保留seq最大的size条
+        pipe.zremrangebyrank(key, 0, -size - 1)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def _load(self, room_id, after_seq=None, count=None):
+        """
+        读取缓冲中的事件（按seq升序）：指定after_seq时返回其后的全部事件，指定count时返回最新的count条
+        同时返回缓冲中最早的seq，缓冲为空时返回([], None)
+        """
+        client = self._redis()
+        if client is None:
+            events = cache.get(RECENT_KEY.format(room_id)) or []
+            if not events:
+                return [], None
+            oldest = events[0]['seq']
+            if after_seq is not None:
+                events = [event for event in events if event['seq'] > after_seq]
+            if count is not None:
+                events = events[-count:]
+            return events, oldest
+
+        key = self._key(room_id)
+        pipe = client.pipeline(transaction=False)
+        pipe.zrange(key, 0, 0, withscores=True)
+        if after_seq is not None:
+            pipe.zrangebyscore(key, f'({after_seq}', '+inf')
+        else:
+            pipe.zrange(key, -count, -1)
+        head, members = pipe.execute()
+        if not head:
+            return [], None
+        return [json.loads(member) for member in members], int(head[0][1])
+
+    def _is_current(self, room_id, events):
+        # 缓冲末尾落后于已分配的序号时，可能有消息未写入缓冲
+        latest = cache.get(SEQ_KEY.format(room_id)) or 0
+        return not latest or (events and events[-1]['seq'] >= latest)
+
+    @staticmethod
+    def _is_contiguous(events, first_seq):
+        return [event['seq'] for event in events] == list(range(first_seq, first_seq + len(events)))
+
+    def get_range(self, room_id, after_seq):
+        """
+        获取seq大于after_seq的事件；缓冲无法完整覆盖该区间时返回None
+        """
+        events, oldest = self._load(room_id, after_seq=after_seq)
+        if oldest is None or oldest > after_seq + 1:
+            return None
+        # 序号不连续（条目丢失）时视为缓冲不可用
+        if not self._is_contiguous(events, after_seq + 1):
+            return None
+        if events and not self._is_current(room_id, events):
+            return None
+        if not events and (cache.get(SEQ_KEY.format(room_id)) or 0) > after_seq:
+            return None
+        return events
+
+    def get_event(self, room_id, seq):
+        """
+        获取指定seq的事件，不在缓冲中时返回None
+        """
+        client = self._redis()
+        if client is None:
+            events = cache.get(RECENT_KEY.format(room_id)) or []
+            return next((event for event in events if event['seq'] == seq), None)
+        members = client.zrangebyscore(self._key(room_id), seq, seq)
+        return json.loads(members[0]) if members else None
+
+    def get_latest(self, room_id, count):
+        """
+        获取房间最新的count条事件（按seq升序）；缓冲不完整时返回None
+        房间消息总数少于count时，缓冲需从seq=1开始才算完整。
+        """
+        events, oldest = self._load(room_id, count=count)
+        if not events:
+            return None
+        if len(events) < count and oldest != 1:
+            return None
+        if not self._is_contiguous(events, events[0]['seq']) or not self._is_current(room_id, events):
+            return None
+        return events
+
+
+recent_events = RecentEventsBuffer()
+
+
+def get_events_since(room_id, last_seq):
+    """
+    获取房间内seq大于last_seq的全部消息事件：优先读取最近事件缓冲，否则查询数据库
+    缺失的消息超过RESUME_MAX_REPLAY条时返回None，客户端应改为通过历史消息接口重新同步。
+    """
+    from .models import Message
+    from .serializers import MessageSerializer
+
+    events = recent_events.get_range(room_id, last_seq)
+    if events is not None:
+        return events
+
+    limit = realtime_setting('RESUME_MAX_REPLAY')
+    messages = list(
+        Message.objects.filter(room_id=room_id, seq__gt=last_seq)
+        .select_related('sender')
+        .order_by('seq')[:limit + 1]
+    )
+    if len(messages) > limit:
+        return None
+    return [
+        {
+            'type': 'chat_message',
+            **data
+        }
+        for data in MessageSerializer(messages, many=True).data
+    ]
@@ -0,0 +1,30 @@
+from django.core.cache import cache
+from django.db.models import Max
+
+SEQ_KEY = 'room_seq:{}'
+
+
+def _db_max_seq(room_id):
+    from .models import Message
+    return Message.objects.filter(room_id=room_id).aggregate(max_seq=Max('seq'))['max_seq'] or 0
+
+
+def next_seq(room_id):
+    """
+    分配房间内下一个消息序号
+    序号由缓存中的原子计数器分配，不需要对计数行加锁；计数器不存在时从数据库中的最大序号初始化。
+    """
+    key = SEQ_KEY.format(room_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # add只在键不存在时写入，多个进程并发初始化时只有一个生效
+        cache.add(key, _db_max_seq(room_id), None)
+        return cache.incr(key)
+
+
+def reset_seq(room_id):
+    """
+    按数据库中的最大序号重置计数器（缓存被清空或淘汰后出现序号冲突时调用）
+    """
+    cache.set(SEQ_KEY.format(room_id), _db_max_seq(room_id), None)
@@ -13,9 +13,9 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = [
                 'id', 'sender', 'timestamp', 
                 'room_type', 'room_id','messages_type',
-                'content', 'file', 'filename'
+                'content', 'file', 'filename', 'seq'
                 ]
-        read_only_fields = ['id', 'sender', 'timestamp']
+        read_only_fields = ['id', 'sender', 'timestamp', 'seq']
 
     def validate(self, data):
         """验证消息类型与内容的匹配"""
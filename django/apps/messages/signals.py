@@ -1,14 +1,17 @@
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from apps.realtime.broadcast import get_room_layer
 from apps.realtime.services import RealtimeService
 from asgiref.sync import async_to_sync
 from ..chat.models import PrivateChatRoom
 from .models import Message
 from django.core.exceptions import ObjectDoesNotExist
-from channels.layers import get_channel_layer
+from .recent_events import recent_events
 from .serializers import MessageSerializer
-# 获取channel layer用于发送实时消息
-channel_layer = get_channel_layer()
+from .thin_events import build_thin_event
+from apps.chat.activity import room_activity_service
+from apps.realtime.conf import realtime_setting
 
 @receiver(post_save, sender=Message)
 
@@ -16,22 +19,39 @@ def handle_message_saved(instance, created,**kwargs):
     """
     处理消息保存后的逻辑
     当新消息被创建时，通过WebSocket发送实时通知
+    广播、写入最近事件缓冲和更新会话列表都在事务提交后执行：
+    其他连接收到事件时消息已可见，回滚（如序号冲突重试）的消息不会留下事件，
+    缓存或通道层出错也不会回滚已写入的消息。
     """
     if created:  # 仅在创建新消息时触发
-        # 根据room_type和room_id获取房间信息
-        try:            
-            serializer = MessageSerializer(instance)
-            event = {
-                'type': 'chat_message',
-                **serializer.data
-            }
-            # 发送到聊天室组
-            async_to_sync(channel_layer.group_send)(
-                            f'chat_{instance.room_id}',
-                            event
-                        )
-        except ObjectDoesNotExist:
-            # 用户不存在，忽略消息
-            pass
+        transaction.on_commit(lambda: publish_message(instance), robust=True)
+
+
+def publish_message(instance):
+    """
+    向房间广播新消息，并更新最近事件缓冲、会话列表和房间活跃时间
+    """
+    # 根据room_type和room_id获取房间信息
+    try:
+        serializer = MessageSerializer(instance)
+        event = {
+            'type': 'chat_message',
+            **serializer.data
+        }
+        # 先写入最近事件缓冲，保证重连补发时能取到已广播的消息
+        recent_events.append(instance.room_id, event)
+        # 房间最后活跃时间和成员会话列表（最后一条消息、未读数）合并后批量写库
+        room_activity_service.touch(instance)
+        # 开启精简事件时只广播ID和精简正文，由各进程补全后再分发
+        if realtime_setting('THIN_EVENTS'):
+            event = build_thin_event(event)
+        # 发送到聊天室组（大群走发布订阅广播）
+        async_to_sync(get_room_layer(instance.room_id).group_send)(
+            f'chat_{instance.room_id}',
+            event
+        )
+    except ObjectDoesNotExist:
+        # 用户不存在，忽略消息
+        pass
 
 
@@ -1,3 +1,325 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.accounts.models import User
+from apps.chat.models import PrivateChatRoom
+from apps.friends.blocks import block_list_service
+from apps.friends.models import Friend, FriendBlock
+from apps.messages.models import IsRead, Message
+from apps.messages.read_markers import MARKER_KEY, read_marker_service
+from apps.messages.recent_events import get_events_since, recent_events
+from apps.messages.sequences import SEQ_KEY
+from apps.messages.serializers import MessageSerializer
+from apps.messages.thin_events import EventHydrator, build_thin_event
+from apps.realtime.consumers import ChatConsumer
 
 # Create your tests here.
+
+
+@override_settings(REALTIME={'READ_MARKER_FLUSH_INTERVAL': 0})
+class ReadMarkerTests(TestCase):
+    """测试已读标记的单调性与批量写库"""
+
+    room_id = 1234567890
+
+    def setUp(self):
+        cache.clear()
+        read_marker_service._dirty.clear()
+        self.sender = User.objects.create_user(username='marker_sender', password='password123')
+        self.reader = User.objects.create_user(username='marker_reader', password='password123')
+        self.messages = [
+            Message.objects.create(
+                sender=self.sender,
+                room_type='group',
+                room_id=self.room_id,
+                content=f'message {index}'
+            )
+            for index in range(5)
+        ]
+
+    def test_regressions_are_ignored(self):
+        """已读位置只前进不回退"""
+        read_marker_service.mark(self.reader.id, self.room_id, self.messages[3].id)
+        last_read_id = read_marker_service.mark(self.reader.id, self.room_id, self.messages[1].id)
+        self.assertEqual(last_read_id, self.messages[3].id)
+
+    def test_invalid_message_is_rejected(self):
+        """不存在或不属于该房间的消息不能推进已读位置"""
+        other = Message.objects.create(
+            sender=self.sender, room_type='group', room_id=self.room_id + 1, content='elsewhere'
+        )
+        for message_id in (self.messages[-1].id + 10 ** 9, other.id):
+            with self.assertRaises(Message.DoesNotExist):
+                read_marker_service.mark(self.reader.id, self.room_id, message_id)
+        self.assertEqual(read_marker_service.get(self.reader.id, self.room_id), 0)
+
+        client = APIClient()
+        client.force_authenticate(user=self.reader)
+        response = client.post(reverse('messages:read_message', kwargs={
+            'room_id': self.room_id,
+            'message_id': other.id,
+        }))
+        self.assertEqual(response.status_code, 404)
+
+    def test_concurrent_mark_never_moves_backwards(self):
+        """读到旧值后，其他进程已写入更大的位置时不覆盖"""
+        read_marker_service.mark(self.reader.id, self.room_id, self.messages[1].id)
+        original_get = read_marker_service.get
+
+        def stale_get(user_id, room_id):
+            # 模拟本进程读取后，另一个进程推进到了更大的位置
+            value = original_get(user_id, room_id)
+            cache.set(MARKER_KEY.format(user_id, room_id), self.messages[4].id, None)
+            return value
+
+        with mock.patch.object(read_marker_service, 'get', stale_get):
+            last_read_id = read_marker_service.mark(self.reader.id, self.room_id, self.messages[2].id)
+        self.assertEqual(last_read_id, self.messages[4].id)
+        self.assertEqual(read_marker_service.get(self.reader.id, self.room_id), self.messages[4].id)
+
+    def test_marks_are_flushed_in_bulk(self):
+        """多次标记只在flush时写入一条记录"""
+        for message in self.messages:
+            read_marker_service.mark(self.reader.id, self.room_id, message.id)
+        self.assertFalse(IsRead.objects.exists())
+
+        # 查询已有标记、校验消息、批量写入，同步群成员已读位置，以及按房间刷新会话列表未读数
+        with self.assertNumQueries(5):
+            read_marker_service.flush()
+        record = IsRead.objects.get(room_id=self.room_id, receiver=self.reader)
+        self.assertEqual(record.message_id, self.messages[-1].id)
+
+    def test_read_view_uses_marker_service(self):
+        """已读接口不直接写库，未读计数读取最新的已读位置"""
+        client = APIClient()
+        client.force_authenticate(user=self.reader)
+
+        response = client.post(reverse('messages:read_message', kwargs={
+            'room_id': self.room_id,
+            'message_id': self.messages[2].id,
+        }))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['message'], self.messages[2].id)
+        self.assertFalse(IsRead.objects.exists())
+
+        response = client.get(reverse('messages:unread_count', kwargs={'room_id': self.room_id}))
+        self.assertEqual(response.data['data']['unread_count'], 2)
+
+
+@override_settings(REALTIME={'RESUME_MAX_REPLAY': 5, 'ROOM_ACTIVITY_FLUSH_INTERVAL': 0})
+class MessageSequenceTests(TestCase):
+    """测试房间内消息序号分配与重连补发"""
+
+    room_id = 1234567891
+
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(username='seq_sender', password='password123')
+
+    def send(self, room_id=None, count=1):
+        # 广播和写入最近事件缓冲在事务提交后执行
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Message.objects.create(
+                    sender=self.sender,
+                    room_type='group',
+                    room_id=room_id or self.room_id,
+                    content=f'message {index}'
+                )
+                for index in range(count)
+            ]
+
+    def test_seq_is_per_room_and_contiguous(self):
+        messages = self.send(count=3)
+        other = self.send(room_id=self.room_id + 1)
+        self.assertEqual([message.seq for message in messages], [1, 2, 3])
+        self.assertEqual(other[0].seq, 1)
+
+    def test_stale_counter_is_repaired(self):
+        """计数器落后于数据库时，冲突后按数据库重置并重试"""
+        self.send(count=2)
+        cache.set(SEQ_KEY.format(self.room_id), 1, None)
+        self.assertEqual(self.send()[0].seq, 3)
+
+    @mock.patch('apps.messages.signals.get_room_layer')
+    def test_nothing_is_published_before_commit(self, get_room_layer):
+        """事务提交前不广播、不写入最近事件缓冲；回滚的消息不留下事件"""
+        get_room_layer.return_value.group_send = mock.AsyncMock()
+        with self.captureOnCommitCallbacks() as callbacks:
+            message = Message.objects.create(sender=self.sender, room_type='group', room_id=self.room_id)
+            self.assertIsNone(recent_events.get_event(self.room_id, message.seq))
+            get_room_layer.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+
+        callbacks[0]()
+        self.assertEqual(recent_events.get_event(self.room_id, message.seq)['id'], message.id)
+        get_room_layer.assert_called_once_with(self.room_id)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Message.objects.create(sender=self.sender, room_type='group', room_id=self.room_id)
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+
+    def test_resume_replays_from_buffer(self):
+        self.send(count=4)
+        with self.assertNumQueries(0):
+            events = get_events_since(self.room_id, 2)
+        self.assertEqual([event['seq'] for event in events], [3, 4])
+        self.assertEqual(events[0]['type'], 'chat_message')
+
+    def test_resume_falls_back_to_database(self):
+        self.send(count=4)
+        cache.clear()
+        events = get_events_since(self.room_id, 1)
+        self.assertEqual([event['seq'] for event in events], [2, 3, 4])
+
+        # 缺失过多时返回None，由客户端重新同步
+        self.send(count=3)
+        self.assertIsNone(get_events_since(self.room_id, 0))
+
+    def test_first_history_page_is_served_from_buffer(self):
+        client = APIClient()
+        client.force_authenticate(user=self.sender)
+        url = reverse('messages:room_messages', kwargs={'room_id': self.room_id})
+        self.send(count=25)
+
+        with self.assertNumQueries(0):
+            response = client.get(url)
+        data = response.json()
+        self.assertEqual([message['seq'] for message in data['data']], list(range(6, 26)))
+        self.assertNotIn('type', data['data'][0])
+        self.assertIn('page=2', data['pagination-next'])
+
+        # 缓冲失效后回源数据库，结果一致
+        cache.clear()
+        self.assertEqual(client.get(url).json()['data'], data['data'])
+
+    def test_first_page_next_link_depends_on_older_messages(self):
+        client = APIClient()
+        client.force_authenticate(user=self.sender)
+        url = reverse('messages:room_messages', kwargs={'room_id': self.room_id})
+        self.send(count=20)
+        # 恰好一页时没有更早的消息
+        self.assertIsNone(client.get(url).json()['pagination-next'])
+
+        self.send(count=1)
+        data = client.get(url).json()
+        self.assertEqual([message['seq'] for message in data['data']], list(range(2, 22)))
+        self.assertIn('page=2', data['pagination-next'])
+
+
+@override_settings(REALTIME={'THIN_EVENT_MAX_CONTENT': 10})
+class ThinEventTests(TestCase):
+    """测试精简消息事件的生成与进程内补全"""
+
+    room_id = 1234567893
+
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(username='thin_sender', password='password123')
+
+    def full_event(self, content):
+        message = Message.objects.create(
+            sender=self.sender,
+            room_type='group',
+            room_id=self.room_id,
+            messages_type='text',
+            content=content,
+        )
+        return {'type': 'chat_message', **MessageSerializer(message).data}
+
+    def test_thin_event_drops_sender_and_long_content(self):
+        event = self.full_event('x' * 20)
+        thin = build_thin_event(event)
+        self.assertEqual(thin['type'], 'chat.message.thin')
+        self.assertEqual(thin['sender_id'], self.sender.id)
+        self.assertNotIn('sender', thin)
+        self.assertNotIn('content', thin)
+        self.assertEqual(build_thin_event(self.full_event('short'))['content'], 'short')
+
+    def test_hydrate_matches_full_event(self):
+        hydrator = EventHydrator()
+        for content in ('short', 'y' * 20):
+            event = self.full_event(content)
+            self.assertEqual(async_to_sync(hydrator.hydrate)(build_thin_event(event)), event)
+
+    def test_hydrate_once_per_process(self):
+        hydrator = EventHydrator()
+        thin = build_thin_event(self.full_event('hello'))
+
+        async def hydrate_many():
+            return await asyncio.gather(*(hydrator.hydrate(thin) for _ in range(5)))
+
+        results = async_to_sync(hydrate_many)()
+        self.assertTrue(all(result is results[0] for result in results))
+        # 已补全的消息直接命中进程内缓存
+        with self.assertNumQueries(0):
+            self.assertIs(async_to_sync(hydrator.hydrate)(thin), results[0])
+
+
+@override_settings(REALTIME={'ROOM_ACTIVITY_FLUSH_INTERVAL': 0})
+class BlockListTests(TestCase):
+    """测试屏蔽列表在发送和投递时的过滤"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(username='block_sender', password='password123')
+        self.receiver = User.objects.create_user(username='block_receiver', password='password123')
+        self.friend = Friend.objects.create(owner=self.receiver, friend=self.sender)
+        Friend.objects.create(owner=self.sender, friend=self.receiver)
+        self.room = PrivateChatRoom.get_for(self.sender.id, self.receiver.id)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.sender)
+
+    def block(self, is_blocked=True):
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendBlock.objects.update_or_create(friend=self.friend, defaults={'is_blocked': is_blocked})
+
+    def send(self):
+        url = reverse('messages:room_messages', kwargs={'room_id': self.room.id})
+        return self.client.post(url, {'content': 'hello', 'messages_type': 'text'})
+
+    def test_private_message_rejected_when_blocked(self):
+        self.assertEqual(self.send().status_code, 201)
+        self.block()
+        self.assertEqual(block_list_service.get_blocked_ids(self.receiver.id), {self.sender.id})
+        response = self.send()
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Message.objects.filter(room_id=self.room.id).count(), 1)
+
+        self.block(False)
+        self.assertEqual(self.send().status_code, 201)
+
+    def test_blocked_check_reads_cache_only(self):
+        self.block()
+        block_list_service.get_blocked_ids(self.sender.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(block_list_service.is_blocked(self.receiver.id, self.sender.id))
+            self.assertFalse(block_list_service.is_blocked(self.sender.id, self.receiver.id))
+
+    def test_consumer_skips_blocked_senders(self):
+        consumer = ChatConsumer()
+        consumer.user = self.receiver
+        sent = []
+
+        async def send_event(event):
+            sent.append(event)
+
+        consumer.send_event = send_event
+        full = {'type': 'chat_message', 'id': 1, 'sender': {'id': self.sender.id}}
+        async_to_sync(consumer.blocks_changed)({'type': 'blocks.changed', 'blocked_ids': [self.sender.id]})
+        async_to_sync(consumer.chat_message)(full)
+        async_to_sync(consumer.chat_message_thin)({'type': 'chat.message.thin', 'id': 1, 'sender_id': self.sender.id})
+        self.assertEqual(sent, [])
+
+        async_to_sync(consumer.blocks_changed)({'type': 'blocks.changed', 'blocked_ids': []})
+        async_to_sync(consumer.chat_message)(full)
+        self.assertEqual(sent, [full])
\ No newline at end of file
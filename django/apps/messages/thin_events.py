@@ -0,0 +1,86 @@
+"""
+精简消息事件
+
+消息广播默认携带完整的MessageSerializer输出（含发送者资料），大群中每条消息都要经过通道层
+复制到各个ASGI进程。开启REALTIME['THIN_EVENTS']后改为发布精简事件：
+- 发送者只保留sender_id，由接收进程从资料缓存补全；
+- 正文超过THIN_EVENT_MAX_CONTENT时省略，由接收进程从最近事件缓冲（或数据库）补全；
+每个进程对同一条消息只补全一次，结果在进程内缓存，再分发给本进程的全部连接。
+"""
+import asyncio
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+
+from apps.accounts.profiles import aget_profile
+from apps.realtime.conf import realtime_setting
+from .recent_events import recent_events
+
+THIN_EVENT_TYPE = 'chat.message.thin'
+# 进程内缓存的已补全消息数
+HYDRATED_CACHE_SIZE = 1000
+
+
+def build_thin_event(event):
+    """
+    由完整的chat_message事件生成精简事件
+    """
+    thin = {key: value for key, value in event.items() if key != 'sender'}
+    thin['type'] = THIN_EVENT_TYPE
+    thin['sender_id'] = event['sender']['id'] if event.get('sender') else None
+    content = thin.get('content') or ''
+    if len(content) > realtime_setting('THIN_EVENT_MAX_CONTENT'):
+        del thin['content']
+    return thin
+
+
+def _load_content(room_id, seq, message_id):
+    event = recent_events.get_event(room_id, seq)
+    if event is not None:
+        return event.get('content')
+    from .models import Message
+    return Message.objects.filter(id=message_id).values_list('content', flat=True).first()
+
+
+class EventHydrator:
+    """
+    进程内的精简事件补全器：按消息ID缓存补全结果，并合并同一消息的并发补全
+    """
+
+    def __init__(self, size=HYDRATED_CACHE_SIZE):
+        self.size = size
+        self._hydrated = OrderedDict()
+        self._pending = {}
+
+    async def hydrate(self, event):
+        """
+        把精简事件补全为与MessageSerializer输出一致的chat_message事件
+        """
+        message_id = event['id']
+        if message_id in self._hydrated:
+            self._hydrated.move_to_end(message_id)
+            return self._hydrated[message_id]
+        task = self._pending.get(message_id)
+        if task is None:
+            task = self._pending[message_id] = asyncio.ensure_future(self._hydrate(event))
+            task.add_done_callback(lambda _: self._pending.pop(message_id, None))
+        return await asyncio.shield(task)
+
+    async def _hydrate(self, event):
+        data = {key: value for key, value in event.items() if key not in ('type', 'sender_id')}
+        profile = await aget_profile(event['sender_id']) if event.get('sender_id') else None
+        if profile is not None:
+            profile = {key: value for key, value in profile.items() if key != 'is_active'}
+        if 'content' not in data:
+            data['content'] = await sync_to_async(_load_content)(event['room_id'], event['seq'], event['id'])
+        hydrated = {'type': 'chat_message', 'id': data.pop('id'), 'sender': profile, **data}
+        self._hydrated[hydrated['id']] = hydrated
+        while len(self._hydrated) > self.size:
+            self._hydrated.popitem(last=False)
+        return hydrated
+
+    def clear(self):
+        self._hydrated.clear()
+
+
+hydrator = EventHydrator()
@@ -3,16 +3,45 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
-from .models import Message, IsRead
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from apps.realtime.renderers import MessagePackRenderer
+from .models import Message
+from .read_markers import read_marker_service
+from .recent_events import recent_events
 from .serializers import MessageSerializer
 from apps.chat.models import PrivateChatRoom, GroupChatRoom
+from apps.friends.blocks import block_list_service
 import os
+import shutil
 from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files import File as DjangoFile
 
 class MessageView(APIView):
     permission_classes = [IsAuthenticated]
+    # 历史消息支持 Accept: application/msgpack 返回二进制响应
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, MessagePackRenderer]
+
+    def resolve_room_type(self, room_id):
+        """
+        确定房间类型，返回(room_type, 是否被私聊对方屏蔽)
+        私聊房间的双方在同一次查询中取出，屏蔽判断读取缓存的屏蔽集合
+        """
+        users = PrivateChatRoom.objects.filter(id=room_id).values_list('user1_id', 'user2_id').first()
+        if users is not None:
+            peer_id = users[1] if users[0] == self.request.user.id else users[0]
+            return 'private', block_list_service.is_blocked(peer_id, self.request.user.id)
+        if GroupChatRoom.objects.filter(id=room_id).exists():
+            return 'group', False
+        return None, False
+
+    def blocked_response(self):
+        return Response({
+            "code": 403,
+            "message": "消息已被对方拒收",
+            "data": None
+        }, status=status.HTTP_403_FORBIDDEN)
     
     def post(self, request, room_id) -> Response:
         data = dict(request.data.items())
@@ -59,6 +88,11 @@ class MessageView(APIView):
 
             # 如果这是最后一个块，则合并并创建 Message
             if chunk_index == total_chunks - 1:
+                room_type, blocked = self.resolve_room_type(room_id)
+                if blocked:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+                    return self.blocked_response()
+
                 # 合并所有块
                 filename = request.data.get('filename') or chunk_file.name
                 # 我们在 upload_dir 中合并分片为临时文件，随后交由 FileField.save 上传到 storage
@@ -77,13 +111,6 @@ class MessageView(APIView):
                 with open(merged_temp_path, 'rb') as merged_f:
                     django_file = DjangoFile(merged_f, name=final_name)
 
-                    # 自动确定room_type（复用上面逻辑）
-                    room_type = None
-                    if PrivateChatRoom.objects.filter(id=room_id).exists():
-                        room_type = 'private'
-                    elif GroupChatRoom.objects.filter(id=room_id).exists():
-                        room_type = 'group'
-
                     messages_type = data.get('messages_type', 'file')
 
                     message = Message(
@@ -127,14 +154,10 @@ class MessageView(APIView):
             # 非最后块，仅返回已上传
             return Response({"code": 200, "message": "chunk uploaded"}, status=status.HTTP_200_OK)
 
-        # 自动确定room_type
-        room_type = None
-        # 首先检查是否是私聊房间
-        if PrivateChatRoom.objects.filter(id=room_id).exists():
-            room_type = 'private'
-        # 然后检查是否是群聊房间
-        elif GroupChatRoom.objects.filter(id=room_id).exists():
-            room_type = 'group'
+        # 自动确定room_type；私聊对方屏蔽了发送者时拒绝发送（群聊在投递时按接收者过滤）
+        room_type, blocked = self.resolve_room_type(room_id)
+        if blocked:
+            return self.blocked_response()
         
         # 如果找到了房间类型，设置room_type
         if room_type:
@@ -156,13 +179,34 @@ class MessageView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
     
     def get(self, request, room_id) -> Response:
+        page_size = 20  # 可以调整每页大小
+
+        # 首页（最新的一页）优先读取最近消息缓冲，缓冲不完整时回源数据库
+        if request.query_params.get('page', '1') == '1':
+            # 多取一条，用于判断是否还有更早的消息（消息被删除后seq不再等于消息条数）
+            events = recent_events.get_latest(room_id, page_size + 1)
+            if events is not None:
+                next_link = None
+                if len(events) > page_size:
+                    events = events[-page_size:]
+                    next_link = replace_query_param(request.build_absolute_uri(), 'page', 2)
+                return Response({
+                    "code": 200,
+                    "message": "获取消息列表成功",
+                    "data": [
+                        {key: value for key, value in event.items() if key != 'type'}
+                        for event in events
+                    ],
+                    "pagination-next": next_link,
+                })
+
         messages = Message.objects.filter(
             room_id=room_id
-        ).order_by('-timestamp')
+        ).select_related('sender').order_by('-timestamp')
         
         # 使用DRF分页器
         paginator = PageNumberPagination()
-        paginator.page_size = 20  # 可以调整每页大小
+        paginator.page_size = page_size
         page = paginator.paginate_queryset(messages, request, view=self)
 
         page = list(page)
@@ -189,20 +233,21 @@ class MessageReadView(APIView):
         """
         
         receiver = request.user
-        message = Message.objects.get(id=message_id)
-        
-        # 使用update_or_create确保每个用户在每个房间只有一条已读记录，且始终指向最后标记为已读的消息
-        # update_or_create返回元组(object, created)，我们只需要第一个元素
-        is_read_record, created = IsRead.objects.update_or_create(
-            room_id=room_id,
-            receiver=receiver,
-            defaults={'message': message}
-        )
+
+        # 已读位置只前进不回退；标记先写入缓存，由已读标记服务批量写入数据库
+        try:
+            last_read_id = read_marker_service.mark(receiver.id, room_id, message_id)
+        except Message.DoesNotExist:
+            return Response({
+                "code": 404,
+                "message": "消息不存在",
+                "data": None
+            }, status=status.HTTP_404_NOT_FOUND)
         
         # 直接构造返回数据
         data = {
-            "message": is_read_record.message.id,
-            "receiver": is_read_record.receiver.id,
+            "message": last_read_id,
+            "receiver": receiver.id,
         }
                 
         return Response({
@@ -224,16 +269,8 @@ class UnreadMessageCountView(APIView):
         """
         user = request.user
         
-        # 1. 获取该用户在该聊天室中已读的最后一次消息
-        try:
-            last_read_message = IsRead.objects.get(
-                room_id=room_id,
-                receiver=user
-            )
-            last_read_id = last_read_message.message.id
-        except IsRead.DoesNotExist:
-            # 如果用户在该聊天室还没有任何已读记录，设置last_read_id为0
-            last_read_id = 0
+        # 1. 获取该用户在该聊天室中已读的最后一次消息（没有记录时为0）
+        last_read_id = read_marker_service.get(user.id, room_id)
         
         # 2. 统计比该ID大的消息数量，且发送者不是当前用户
         unread_count = Message.objects.filter(
@@ -0,0 +1,106 @@
+import asyncio
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCoalescer:
+    """
+    进程内异步合并器
+    在固定时间窗口内按key合并待处理项，窗口结束时一次性交给flush回调处理。
+    后台任务在空闲时自动退出，下次add时再按需启动。
+    """
+
+    def __init__(self, interval, flush, merge=None):
+        """
+        Args:
+            interval: 合并窗口（秒）
+            flush: 异步回调，接收 {key: value} 字典
+            merge: 可选，同一key重复提交时的合并函数 merge(old, new)，默认保留新值
+        """
+        self.interval = interval
+        self._flush = flush
+        self._merge = merge
+        self._pending = {}
+        self._task = None
+
+    def add(self, key, value):
+        """
+        提交待处理项（必须在事件循环中调用）
+        """
+        if self._merge is not None and key in self._pending:
+            value = self._merge(self._pending[key], value)
+        self._pending[key] = value
+        self._ensure_task()
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._pending:
+                return
+            await self.flush_now()
+
+    async def flush_now(self):
+        """
+        立即处理当前窗口内的全部待处理项
+        """
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            await self._flush(batch)
+        except Exception:
+            logger.exception('Coalesced flush failed')
+
+
+class PeriodicFlusher:
+    """
+    后台线程定期调用同步的flush回调（用于需要批量写数据库的写后缓冲）
+    进程退出时会再执行一次flush，尽量不丢失缓冲中的数据。
+    """
+
+    def __init__(self, interval, flush, name='periodic-flusher', flush_on_exit=True):
+        self.interval = interval
+        self._flush = flush
+        self._name = name
+        self._flush_on_exit = flush_on_exit
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._exit_hook_registered = False
+
+    def start(self):
+        """
+        按需启动后台线程（重复调用无副作用）
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+            if self._flush_on_exit and not self._exit_hook_registered:
+                atexit.register(self._run_once)
+                self._exit_hook_registered = True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._run_once()
+
+    def _run_once(self):
+        try:
+            self._flush()
+        except Exception:
+            logger.exception('Periodic flush failed')
+        finally:
+            close_old_connections()
@@ -0,0 +1,60 @@
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.apps import apps
+from django.core.cache import cache
+
+from .conf import realtime_setting
+from .layers import get_ephemeral_layer, has_ephemeral_layer
+
+MEMBER_COUNT_KEY = 'room_member_count:{}'
+
+
+def get_room_member_count(room_id):
+    """
+    获取房间成员数（缓存），私聊房间固定为2，房间不存在时为0
+    """
+    key = MEMBER_COUNT_KEY.format(room_id)
+    count = cache.get(key)
+    if count is None:
+        GroupChatRoom = apps.get_model('chat', 'GroupChatRoom')
+        PrivateChatRoom = apps.get_model('chat', 'PrivateChatRoom')
+        count = GroupChatRoom.objects.filter(id=room_id).values_list('member_count', flat=True).first()
+        if count is None:
+            count = 2 if PrivateChatRoom.objects.filter(id=room_id).exists() else 0
+        cache.set(key, count, realtime_setting('MEMBER_COUNT_CACHE_TTL'))
+    return count
+
+
+def invalidate_room_member_count(*room_ids):
+    cache.delete_many([MEMBER_COUNT_KEY.format(room_id) for room_id in room_ids])
+
+
+def is_broadcast_room(room_id):
+    """
+    是否按广播模式发送：成员数达到BROADCAST_ROOM_THRESHOLD的大群自动启用
+    """
+    return get_room_member_count(room_id) >= realtime_setting('BROADCAST_ROOM_THRESHOLD')
+
+
+def get_room_layer(room_id):
+    """
+    获取向聊天室组发送事件使用的通道层
+    普通通道层的group_send对每个成员通道各写一次Redis；大群改走发布订阅通道层，
+    每个ASGI进程对每个活跃房间只订阅一次，收到后在进程内分发给本地连接，
+    单条消息的跨节点开销从O(成员数)降为O(进程数)。
+    发布订阅不保证送达，断线期间错过的消息由客户端按seq重连补发。
+    """
+    if has_ephemeral_layer() and is_broadcast_room(room_id):
+        return get_ephemeral_layer()
+    return get_channel_layer()
+
+
+async def aget_room_layer(room_id):
+    if not has_ephemeral_layer():
+        return get_channel_layer()
+    count = await cache.aget(MEMBER_COUNT_KEY.format(room_id))
+    if count is None:
+        count = await sync_to_async(get_room_member_count)(room_id)
+    if count >= realtime_setting('BROADCAST_ROOM_THRESHOLD'):
+        return get_ephemeral_layer()
+    return get_channel_layer()
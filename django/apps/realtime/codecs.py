@@ -0,0 +1,154 @@
+import json
+import zlib
+
+import msgpack
+
+from .conf import realtime_setting
+
+try:
+    import zstandard
+except ImportError:  # zstd压缩为可选依赖
+    zstandard = None
+
+# WebSocket子协议：客户端在握手时通过Sec-WebSocket-Protocol声明，未声明时使用JSON
+JSON_SUBPROTOCOL = 'chattrix.json'
+MSGPACK_SUBPROTOCOL = 'chattrix.msgpack'
+MSGPACK_ZSTD_SUBPROTOCOL = 'chattrix.msgpack.zstd'
+
+# 二进制帧首字节标记负载的压缩方式
+FRAME_RAW = 0
+FRAME_DEFLATE = 1
+FRAME_ZSTD = 2
+
+# 解码客户端帧时可能抛出的异常，统一转换为ValueError
+DECODE_ERRORS = (zlib.error, msgpack.UnpackException)
+if zstandard is not None:
+    DECODE_ERRORS += (zstandard.ZstdError,)
+
+
+class JsonCodec:
+    """
+    JSON文本帧编解码器（默认）
+    """
+    binary = False
+
+    def __init__(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    def encode(self, data):
+        """
+        返回可直接传给send()的关键字参数
+        """
+        return {'text_data': json.dumps(data)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            return None
+        return json.loads(text_data)
+
+
+class MsgPackCodec:
+    """
+    MessagePack二进制帧编解码器
+    帧格式：1字节压缩标记 + 负载；超过阈值的负载（如未读消息批量下发）会被压缩。
+    """
+    binary = True
+
+    def __init__(self, subprotocol=MSGPACK_SUBPROTOCOL, use_zstd=False):
+        self.subprotocol = subprotocol
+        self.use_zstd = use_zstd
+
+    def encode(self, data):
+        body = msgpack.packb(data, use_bin_type=True)
+        if len(body) < realtime_setting('COMPRESS_THRESHOLD'):
+            return {'bytes_data': bytes([FRAME_RAW]) + body}
+        if self.use_zstd:
+            return {'bytes_data': bytes([FRAME_ZSTD]) + _zstd_compressor().compress(body)}
+        return {'bytes_data': bytes([FRAME_DEFLATE]) + zlib.compress(body)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        if text_data is not None:
+            # 兼容客户端在二进制协议下发送的JSON文本帧
+            return json.loads(text_data)
+        if not bytes_data:
+            return None
+        flag, body = bytes_data[0], bytes_data[1:]
+        limit = realtime_setting('MAX_FRAME_SIZE')
+        try:
+            if flag == FRAME_DEFLATE:
+                body = _inflate(body, limit)
+            elif flag == FRAME_ZSTD and zstandard is not None:
+                body = _zstd_decompress(body, limit)
+            elif flag != FRAME_RAW:
+                raise ValueError(f'Unknown frame flag: {flag}')
+            if len(body) > limit:
+                raise ValueError('Frame too large')
+            return msgpack.unpackb(body, raw=False)
+        except DECODE_ERRORS as exc:
+            # 统一转换为ValueError，便于调用方忽略损坏的帧
+            raise ValueError(str(exc)) from exc
+
+
+def _inflate(body, limit):
+    """
+    解压deflate负载，输出超过limit字节时拒绝（不会先完整解压到内存）
+    """
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(body, limit)
+    if decompressor.unconsumed_tail:
+        raise ValueError('Frame too large')
+    if not decompressor.eof:
+        raise ValueError('Truncated deflate frame')
+    return data
+
+
+def _zstd_decompress(body, limit):
+    """
+    解压zstd负载：帧头声明的原始大小超过limit时直接拒绝，未声明时按limit限制输出
+    """
+    size = zstandard.frame_content_size(body)
+    if size > limit:
+        raise ValueError('Frame too large')
+    return _zstd_decompressor().decompress(body, max_output_size=limit)
+
+
+_zstd = {}
+
+
+def _load_zstd_dictionary():
+    """
+    加载预训练的zstd字典（settings.REALTIME['ZSTD_DICTIONARY']），未配置时返回None
+    字典需与客户端使用的字典一致，可用 zstd --train 基于真实消息样本训练。
+    """
+    path = realtime_setting('ZSTD_DICTIONARY')
+    if not path:
+        return None
+    with open(path, 'rb') as dictionary_file:
+        return zstandard.ZstdCompressionDict(dictionary_file.read())
+
+
+def _zstd_compressor():
+    # 压缩器在事件循环线程内复用，避免每帧重新加载字典
+    if 'compressor' not in _zstd:
+        _zstd['compressor'] = zstandard.ZstdCompressor(dict_data=_load_zstd_dictionary())
+    return _zstd['compressor']
+
+
+def _zstd_decompressor():
+    if 'decompressor' not in _zstd:
+        _zstd['decompressor'] = zstandard.ZstdDecompressor(dict_data=_load_zstd_dictionary())
+    return _zstd['decompressor']
+
+
+def negotiate_codec(subprotocols):
+    """
+    根据客户端声明的子协议选择编解码器
+    优先级：msgpack+zstd（需安装zstandard）> msgpack > JSON
+    """
+    if MSGPACK_ZSTD_SUBPROTOCOL in subprotocols and zstandard is not None:
+        return MsgPackCodec(MSGPACK_ZSTD_SUBPROTOCOL, use_zstd=True)
+    if MSGPACK_SUBPROTOCOL in subprotocols:
+        return MsgPackCodec(MSGPACK_SUBPROTOCOL)
+    if JSON_SUBPROTOCOL in subprotocols:
+        return JsonCodec(JSON_SUBPROTOCOL)
+    return JsonCodec()
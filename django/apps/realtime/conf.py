@@ -0,0 +1,62 @@
+from django.conf import settings
+
+# 实时子系统的默认配置，可在settings.REALTIME中按键覆盖
+DEFAULTS = {
+    # 在线状态键的存活时间（秒），客户端心跳间隔应小于该值
+    'PRESENCE_TTL': 60,
+    # 清理心跳中断用户在线状态的扫描间隔（秒），为0时不扫描
+    'PRESENCE_SWEEP_INTERVAL': 30,
+    # 在线状态变更合并广播的时间窗口（秒）
+    'PRESENCE_FLUSH_INTERVAL': 0.3,
+    # 输入状态快照的合并窗口（秒）
+    'TYPING_FLUSH_INTERVAL': 0.5,
+    # 同一用户在同一房间内重复“开始输入”的最小广播间隔（秒）
+    'TYPING_RATE_LIMIT': 2,
+    # 未收到续期时输入状态的自动过期时间（秒）
+    'TYPING_TTL': 6,
+    # 已读标记批量写库的间隔（秒），为0时只在断开连接时写库
+    'READ_MARKER_FLUSH_INTERVAL': 5,
+    # 二进制帧负载超过该字节数时压缩
+    'COMPRESS_THRESHOLD': 1024,
+    # 客户端二进制帧解压后的最大字节数，超过时丢弃该帧（防止解压炸弹）
+    'MAX_FRAME_SIZE': 1024 * 1024,
+    # 可选：zstd预训练字典文件路径（需安装zstandard）
+    'ZSTD_DICTIONARY': None,
+    # 单个连接发送队列的最大长度
+    'OUTBOUND_QUEUE_SIZE': 256,
+    # 发送队列满时的处理策略：drop / resync / disconnect
+    'OUTBOUND_OVERFLOW': 'resync',
+    # 队首事件最长等待时间（秒），超过后断开连接
+    'OUTBOUND_MAX_LAG': 30,
+    # 每个房间在缓存中保留的最近消息事件数
+    'RECENT_EVENTS_SIZE': 200,
+    # 最近消息事件缓冲的过期时间（秒）
+    'RECENT_EVENTS_TTL': 60 * 60,
+    # 断线重连时最多补发的消息数，超过时提示客户端重新同步
+    'RESUME_MAX_REPLAY': 500,
+    # 成员数达到该值的群聊改用发布订阅通道层广播消息
+    'BROADCAST_ROOM_THRESHOLD': 200,
+    # 房间成员数缓存的过期时间（秒）
+    'MEMBER_COUNT_CACHE_TTL': 300,
+    # 聊天室连接启用微批（?batch=1）时的合并窗口（秒）
+    'BATCH_WINDOW': 0.01,
+    # 单个批量帧最多包含的事件数
+    'BATCH_MAX_EVENTS': 100,
+    # 令牌过期前多少秒提示客户端发送reauth帧
+    'REAUTH_WARNING': 60,
+    # 令牌过期后允许续期的宽限时间（秒），逾期关闭连接
+    'REAUTH_GRACE': 30,
+    # 房间最后活跃时间合并写库的间隔（秒），为0时随消息同步写库
+    'ROOM_ACTIVITY_FLUSH_INTERVAL': 2,
+    # 消息广播只携带ID和精简正文，由接收进程从资料缓存补全发送者信息
+    'THIN_EVENTS': False,
+    # 精简事件中正文超过该长度时省略，由接收进程从最近事件缓冲补全
+    'THIN_EVENT_MAX_CONTENT': 1024,
+}
+
+
+def realtime_setting(name):
+    """
+    读取实时子系统配置，未配置时使用默认值
+    """
+    return getattr(settings, 'REALTIME', {}).get(name, DEFAULTS[name])
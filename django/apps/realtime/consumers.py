@@ -1,6 +1,19 @@
-import json
+import asyncio
+import logging
+import time
+from urllib.parse import parse_qs
 from abc import ABC, abstractmethod
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from .codecs import JsonCodec, negotiate_codec
+from .conf import realtime_setting
+from .layers import get_ephemeral_layer, has_ephemeral_layer
+from .middleware import REAUTH_CLOSE_CODE, authenticate_token
+from .outbound import OutboundQueue
+from .presence import presence_service
+from .typing_indicators import TypingSnapshotMerger, typing_service
+
+logger = logging.getLogger(__name__)
 
 
 class BaseConsumer(AsyncWebsocketConsumer, ABC):
@@ -8,11 +21,27 @@ class BaseConsumer(AsyncWebsocketConsumer, ABC):
     WebSocket消费者基类
     遵循SOLID原则中的单一职责原则和里氏替换原则
     """
+
+    # 需要接收非持久化通道层事件（如输入状态）的子类设为True
+    listen_ephemeral = False
+    # 允许客户端通过?batch=1开启发送微批的子类设为True
+    supports_batching = False
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = None
         self.group_name = None
+        # 在线状态连接计数的周期，未登记时为None
+        self.presence_epoch = None
+        self.ephemeral_layer = None
+        self.ephemeral_channel = None
+        self.ephemeral_task = None
+        # 帧编解码器，握手时根据子协议协商，默认JSON文本帧
+        self.codec = JsonCodec()
+        # 有界发送队列，连接建立后创建
+        self.outbound = None
+        # 令牌过期监视任务
+        self.expiry_task = None
     
     async def connect(self):
         """
@@ -33,44 +62,205 @@ class BaseConsumer(AsyncWebsocketConsumer, ABC):
             self.group_name,
             self.channel_name
         )
-        
-        await self.accept()
+
+        if self.listen_ephemeral:
+            await self.join_ephemeral_group()
+
+        # 协商帧格式（JSON / MessagePack），并回应客户端选择的子协议
+        self.codec = negotiate_codec(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.codec.subprotocol)
+        batch_window = 0
+        if self.supports_batching and self.get_query_param('batch') in ('1', 'true'):
+            batch_window = realtime_setting('BATCH_WINDOW')
+        self.outbound = OutboundQueue(
+            self.send_now, self.close, name=self.channel_name, batch_window=batch_window,
+            batch_frames=self.codec.binary
+        )
+
+        # 登记在线状态（多端连接按引用计数）
+        self.presence_epoch = await presence_service.connect(self.user.id)
+
+        # 令牌过期前提示客户端通过reauth帧续期，逾期未续期时关闭连接
+        if self.scope.get('token_exp'):
+            self.expiry_task = asyncio.create_task(self._watch_token_expiry())
     
     async def disconnect(self,close_code):
         """
         处理WebSocket断开连接
         """
+        if self.outbound is not None:
+            self.outbound.stop()
+        if self.expiry_task is not None:
+            self.expiry_task.cancel()
+            self.expiry_task = None
+
         # 离开组
         if self.group_name:
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
-    async def receive(self, text_data):
+        await self.leave_ephemeral_group()
+
+        # 释放在线状态引用
+        if self.presence_epoch is not None:
+            epoch, self.presence_epoch = self.presence_epoch, None
+            await presence_service.disconnect(self.user.id, epoch)
+    async def receive(self, text_data=None, bytes_data=None):
         """
         接收客户端发送的消息，默认处理心跳机制
         """
         try:
-            data = json.loads(text_data)
-            message_type = data.get('type')
-            
-            # 处理心跳 ping 消息
-            if message_type == 'ping':
-                await self.send(text_data=json.dumps({
-                    'type': 'pong'
-                }))
-                return
-        except json.JSONDecodeError:
-            pass
+            data = self.codec.decode(text_data, bytes_data)
+        except ValueError:
+            # JSON/MessagePack解析失败，忽略该帧
+            return
+        if not isinstance(data, dict):
+            return
+
+        # 处理心跳 ping 消息，同时续期在线状态
+        if data.get('type') == 'ping':
+            self.presence_epoch = await presence_service.heartbeat(self.user.id, self.presence_epoch)
+            await self.send_event({
+                'type': 'pong'
+            })
+            return
+
+        # 连接内续期令牌：{"type": "reauth", "token": "<新的access token>"}
+        if data.get('type') == 'reauth':
+            await self.reauthenticate(data.get('token'))
+            return
        
         # 如果不是心跳消息，则调用子类的处理方法
-        await self.handle_receive(text_data)
+        await self.handle_receive(data)
     
-    async def handle_receive(self, text_data):
+    async def handle_receive(self, data):
         """
-        子类重写此方法处理非心跳消息
+        子类重写此方法处理非心跳消息（data为已解码的字典）
         """
         pass
+
+    async def reauthenticate(self, token):
+        """
+        校验客户端发来的新令牌并更新连接上的用户；令牌无效或属于其他用户时关闭连接
+        """
+        user, claims = (None, None)
+        if isinstance(token, str):
+            user, claims = await authenticate_token(token)
+        if user is None or user.id != self.user.id:
+            await self.send_now({
+                'type': 'reauth_failed',
+            })
+            await self.close(code=REAUTH_CLOSE_CODE)
+            return
+
+        self.user = self.scope['user'] = user
+        self.scope['token_exp'] = claims.get('exp')
+        await self.send_event({
+            'type': 'reauth_ok',
+            'expires_at': self.scope['token_exp'],
+        })
+
+    async def _watch_token_expiry(self):
+        """
+        在令牌过期前REAUTH_WARNING秒发送reauth_required提示，
+        过期超过REAUTH_GRACE秒仍未续期时关闭连接（reauth成功后按新的过期时间继续监视）
+        """
+        warned_exp = None
+        while True:
+            expires_at = self.scope.get('token_exp')
+            if not expires_at:
+                return
+            remaining = expires_at - time.time()
+            warning = realtime_setting('REAUTH_WARNING')
+            if remaining > warning:
+                await asyncio.sleep(remaining - warning)
+                continue
+            if warned_exp != expires_at:
+                warned_exp = expires_at
+                await self.send_event({
+                    'type': 'reauth_required',
+                    'expires_at': expires_at,
+                })
+            overdue_in = remaining + realtime_setting('REAUTH_GRACE')
+            if overdue_in > 0:
+                await asyncio.sleep(min(overdue_in, 1))
+                continue
+            await self.close(code=REAUTH_CLOSE_CODE)
+            return
+
+    def get_query_param(self, name):
+        """
+        读取握手URL中的查询参数，不存在时返回None
+        """
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get(name)
+        return values[0] if values else None
+
+    async def send_event(self, data):
+        """
+        发送一个事件：连接建立后先进入有界发送队列，由后台任务按序发送
+        """
+        if self.outbound is None:
+            await self.send_now(data)
+            return
+        self.outbound.put(data)
+
+    async def send_now(self, data):
+        """
+        按协商的帧格式立即发送一个事件
+        """
+        await self.send(**self.codec.encode(data))
+
+    async def send_events(self, events):
+        """
+        发送一组事件：二进制协议下合并为一个（可压缩的）批量帧，JSON协议下逐条发送
+        整组作为发送队列中的一个条目，积压的补发/未读消息不会触发溢出
+        """
+        if not events:
+            return
+        if self.outbound is not None:
+            self.outbound.put_many(events)
+        elif self.codec.binary:
+            await self.send_now({
+                'type': 'batch',
+                'events': events,
+            })
+        else:
+            for event in events:
+                await self.send_now(event)
+
+    async def join_ephemeral_group(self):
+        """
+        加入非持久化通道层中的同名组，并在后台接收该层的事件
+        """
+        if not has_ephemeral_layer():
+            # 未单独配置时瞬时事件直接走默认通道层，无需额外监听
+            return
+        self.ephemeral_layer = get_ephemeral_layer()
+        self.ephemeral_channel = await self.ephemeral_layer.new_channel()
+        await self.ephemeral_layer.group_add(self.group_name, self.ephemeral_channel)
+        self.ephemeral_task = asyncio.create_task(self._listen_ephemeral())
+
+    async def leave_ephemeral_group(self):
+        """
+        停止接收非持久化通道层的事件并离开组
+        """
+        if self.ephemeral_task is None:
+            return
+        self.ephemeral_task.cancel()
+        self.ephemeral_task = None
+        await self.ephemeral_layer.group_discard(self.group_name, self.ephemeral_channel)
+
+    async def _listen_ephemeral(self):
+        while True:
+            message = await self.ephemeral_layer.receive(self.ephemeral_channel)
+            try:
+                await self.dispatch(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 单个事件处理失败不能结束监听，否则该连接此后收不到任何瞬时事件
+                logger.exception('Ephemeral event dispatch failed')
     
     @abstractmethod
     async def get_group_name(self):
@@ -100,22 +290,31 @@ class FriendNotificationConsumer(BaseConsumer):
         """
         处理好友请求通知事件
         """
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'friend_request',
             'sender_id': event['sender_id'],
             'sender_username': event['sender_username'],
             'message': event['message'],
-        }))
+        })
 
     async def friend_accepted(self, event):
         """
         处理好友请求接受通知事件
         """
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'friend_accepted',
             'friend_id': event['friend_id'],
             'friend_username': event['friend_username'],
-        }))
+        })
+
+    async def presence_batch(self, event):
+        """
+        处理好友在线状态批量变更事件
+        """
+        await self.send_event({
+            'type': 'presence',
+            'changes': event['changes'],
+        })
 
 
 class SystemNotificationConsumer(BaseConsumer):
@@ -135,13 +334,13 @@ class SystemNotificationConsumer(BaseConsumer):
         """
         处理系统通知事件
         """
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'system_notification',
             'user_id': event['user_id'],
             'title': event['title'],
             'message': event['message'],
             'level': event['level'],
-        }))
+        })
 
 
 class ChatConsumer(BaseConsumer):
@@ -150,28 +349,181 @@ class ChatConsumer(BaseConsumer):
     处理聊天室中的实时消息
     遵循单一职责原则
     """
+
+    # 同时加入发布订阅通道层的房间组：接收输入状态，以及大群以广播模式发送的消息
+    listen_ephemeral = True
+    # 热门群聊中客户端可开启微批，把窗口内的多条消息合并为一帧
+    supports_batching = True
+    # 当前用户屏蔽的用户ID，连接建立时加载，屏蔽列表变化时由blocks.changed事件替换
+    blocked_ids = frozenset()
+    # 输入状态快照合并器，收到第一条快照时创建
+    typing_merger = None
+
+    @property
+    def room_id(self):
+        return int(self.scope['url_route']['kwargs']['room_id'])
     
     async def get_group_name(self):
         """
         获取聊天室组名
         """
-        room_id = self.scope['url_route']['kwargs']['room_id']
-        return f'chat_{room_id}'
+        return f'chat_{self.room_id}'
+
+    async def handle_receive(self, data):
+        """
+        处理客户端发来的输入状态、重连补发和已读事件
+        输入状态：{"type": "typing", "is_typing": true/false}
+        """
+        if data.get('type') == 'typing':
+            if data.get('is_typing', True):
+                typing_service.start(self.room_id, self.user.id)
+            else:
+                typing_service.stop(self.room_id, self.user.id)
+        elif data.get('type') == 'resume':
+            # 重连补发：{"type": "resume", "last_seq": 123}
+            try:
+                last_seq = int(data['last_seq'])
+            except (KeyError, TypeError, ValueError):
+                return
+            await self.resume(last_seq)
+        elif data.get('type') == 'read':
+            # 已读标记：{"type": "read", "message_id": 123}
+            try:
+                message_id = int(data['message_id'])
+            except (KeyError, TypeError, ValueError):
+                return
+            await database_sync_to_async(self.mark_read)(message_id)
+
+    async def typing_snapshot(self, event):
+        """
+        处理房间输入状态快照事件（不包含自己）
+        各进程分别发送本进程连接的输入状态，按来源合并后再发给客户端
+        """
+        if self.typing_merger is None:
+            self.typing_merger = TypingSnapshotMerger()
+        typing, stopped = self.typing_merger.update(event)
+        typing = [user_id for user_id in typing if user_id != self.user.id]
+        stopped = [user_id for user_id in stopped if user_id != self.user.id]
+        if not typing and not stopped:
+            return
+        await self.send_event({
+            'type': 'typing',
+            'room_id': event['room_id'],
+            'typing': typing,
+            'stopped': stopped,
+            'ttl': event['ttl'],
+        })
         
+    def is_blocked_event(self, event):
+        """
+        消息发送者是否已被当前用户屏蔽（内存集合判断，不访问数据库和缓存）
+        """
+        sender_id = event.get('sender_id')
+        if sender_id is None:
+            sender_id = (event.get('sender') or {}).get('id')
+        return sender_id in self.blocked_ids
+
+    async def blocks_changed(self, event):
+        """
+        处理屏蔽列表变化事件
+        """
+        self.blocked_ids = frozenset(event['blocked_ids'])
+
     async def chat_message(self, event):
         """
         处理聊天消息事件
         """
-        # 准备基础响应数据
+        # 跳过已屏蔽用户发送的消息
+        if self.is_blocked_event(event):
+            return
 
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
         print(f"Sending message to user {self.user.id}")
 
+    async def group_members(self, event):
+        """
+        处理群成员变化事件（批量添加、移除、设为管理员）
+        """
+        await self.send_event({
+            'type': 'members_changed',
+            'room_id': event['room_id'],
+            'action': event['action'],
+            'user_ids': event['user_ids'],
+        })
+
+    async def chat_message_thin(self, event):
+        """
+        处理精简消息事件：进程内只补全一次，再发给本连接
+        """
+        from apps.messages.thin_events import hydrator
+
+        if self.is_blocked_event(event):
+            return
+        await self.send_event(await hydrator.hydrate(event))
+
     async def connect(self):
         await super().connect()
-        
-        # 连接成功后立即同步未读消息
-        await self.sync_unread_messages()
+        if self.outbound is None:
+            # 未通过认证，连接已关闭
+            return
+
+        # 加载屏蔽列表，并订阅其变化（补发和同步未读消息同样按屏蔽列表过滤）
+        from apps.friends.blocks import block_list_service, block_group_name
+        self.blocked_ids = await block_list_service.aget_blocked_ids(self.user.id)
+        await self.channel_layer.group_add(block_group_name(self.user.id), self.channel_name)
+
+        # 客户端携带最后收到的序号（?last_seq=）时只补发缺失区间，否则按已读位置同步未读消息
+        last_seq = self.get_query_param('last_seq')
+        if last_seq and last_seq.isdigit():
+            await self.resume(int(last_seq))
+        else:
+            await self.sync_unread_messages()
+
+    async def resume(self, last_seq):
+        """
+        补发seq大于last_seq的消息，结束后发送resumed事件
+        已加入房间组后才开始补发，补发期间实时到达的消息可能重复，客户端按seq去重。
+        """
+        from apps.messages.recent_events import get_events_since
+
+        events = await database_sync_to_async(get_events_since)(self.room_id, last_seq)
+        if events is None:
+            # 缺失过多，提示客户端通过历史消息接口重新同步
+            await self.send_event({
+                'type': 'resync',
+                'reason': 'gap',
+                'room_id': self.room_id,
+            })
+            return
+        await self.send_events([event for event in events if not self.is_blocked_event(event)])
+        await self.send_event({
+            'type': 'resumed',
+            'room_id': self.room_id,
+            'last_seq': events[-1]['seq'] if events else last_seq,
+        })
+
+    async def disconnect(self, close_code):
+        if self.user and self.user.is_authenticated:
+            from apps.friends.blocks import block_group_name
+            await self.channel_layer.group_discard(block_group_name(self.user.id), self.channel_name)
+            typing_service.stop(self.room_id, self.user.id)
+            # 断开连接时立即写入该用户缓冲中的已读标记
+            await database_sync_to_async(self.flush_read_markers)()
+        await super().disconnect(close_code)
+
+    def mark_read(self, message_id):
+        """记录已读位置（同步方法），消息不属于本房间时忽略"""
+        from apps.messages.models import Message
+        from apps.messages.read_markers import read_marker_service
+        try:
+            read_marker_service.mark(self.user.id, self.room_id, message_id)
+        except Message.DoesNotExist:
+            pass
+
+    def flush_read_markers(self):
+        """写入当前用户的已读标记（同步方法）"""
+        from apps.messages.read_markers import read_marker_service
+        read_marker_service.flush(user_id=self.user.id)
     
     async def sync_unread_messages(self):
             """同步未读消息"""
@@ -185,31 +537,29 @@ class ChatConsumer(BaseConsumer):
             
             if unread_messages:
                 # 发送未读消息给客户端，使用与信号文件相同的格式
-                for message_data in unread_messages:
-                    # 构造与信号文件完全相同的消息格式
-                    event = {
+                # 二进制协议下整批合并为一个压缩帧
+                await self.send_events([
+                    {
                         'type': 'chat_message',
                         **message_data
                     }
-                    await self.send(text_data=json.dumps(event))
+                    for message_data in unread_messages
+                    if not self.is_blocked_event(message_data)
+                ])
     
     def get_unread_messages(self, room_id, user):
         """获取未读消息（同步方法）"""
-        from apps.messages.models import Message, IsRead
+        from apps.messages.models import Message
+        from apps.messages.read_markers import read_marker_service
         try:
-            # 获取最后已读消息ID
-            last_read = IsRead.objects.filter(
-                room_id=room_id, 
-                receiver=user
-            ).first()
-            
-            last_read_id = last_read.message.id if last_read else 0
+            # 获取最后已读消息ID（优先读取尚未写库的已读标记）
+            last_read_id = read_marker_service.get(user.id, room_id)
             
             # 获取未读消息（排除自己发送的）
             unread_messages = Message.objects.filter(
                 room_id=room_id,
                 id__gt=last_read_id
-            ).exclude(sender=user).order_by('timestamp')
+            ).exclude(sender_id=user.id).order_by('timestamp')
             
             # 使用序列化器
             from apps.messages.serializers import MessageSerializer
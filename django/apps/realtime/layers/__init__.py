@@ -0,0 +1,20 @@
+from channels.layers import channel_layers, get_channel_layer
+
+# 非持久化通道层的别名：用于输入状态等丢失无害的瞬时事件
+EPHEMERAL_LAYER_ALIAS = 'ephemeral'
+
+
+def has_ephemeral_layer():
+    """
+    是否单独配置了非持久化通道层
+    """
+    return EPHEMERAL_LAYER_ALIAS in channel_layers
+
+
+def get_ephemeral_layer():
+    """
+    获取非持久化通道层，未配置时退回默认通道层
+    """
+    if has_ephemeral_layer():
+        return get_channel_layer(EPHEMERAL_LAYER_ALIAS)
+    return get_channel_layer()
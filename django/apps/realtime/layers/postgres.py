@@ -0,0 +1,348 @@
+"""
+基于PostgreSQL LISTEN/NOTIFY的通道层
+
+适用于不部署Redis的小型环境，以及本地多进程压测。语义与channels_redis的发布订阅层一致：
+- 组成员只保存在各进程内存中，group_send对每个组只NOTIFY一次，由订阅了该组的进程在本地分发；
+- 进程专属通道（specific.xxx!yyy）按进程订阅，普通通道在首次receive时订阅；
+- 消息不持久化，没有订阅者时直接丢弃。
+NOTIFY负载上限为8000字节，超过上限的消息写入realtime_channelpayload表，通知中只携带记录ID；
+超过expiry的记录由发送过溢出负载的进程定期清理，不在每次发送时清理。
+
+需要安装psycopg（3.x）：pip install "psycopg[binary]"
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import types
+import uuid
+
+import msgpack
+from channels.layers import BaseChannelLayer
+from django.apps import apps
+from django.conf import settings
+
+try:
+    import psycopg
+    from psycopg import sql
+except ImportError:  # psycopg 3为可选依赖，仅使用本通道层时需要
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY负载上限为8000字节，留出余量
+NOTIFY_PAYLOAD_LIMIT = 7900
+# 溢出负载在通知中的前缀
+SPILL_PREFIX = '@'
+
+
+def database_conninfo(alias='default'):
+    """
+    由Django数据库配置生成libpq连接串
+    """
+    database = settings.DATABASES[alias]
+    if 'postgresql' not in database['ENGINE']:
+        raise ValueError(f"Database '{alias}' is not PostgreSQL; set the channel layer 'dsn' explicitly")
+    params = {
+        'dbname': database.get('NAME'),
+        'user': database.get('USER'),
+        'password': database.get('PASSWORD'),
+        'host': database.get('HOST'),
+        'port': database.get('PORT'),
+    }
+    return psycopg.conninfo.make_conninfo(**{key: value for key, value in params.items() if value})
+
+
+class PostgresLoopLayer(BaseChannelLayer):
+    """
+    绑定单个事件循环的通道层实现（数据库连接不能跨事件循环使用）
+    """
+    extensions = ['groups', 'flush']
+
+    def __init__(self, dsn=None, database='default', prefix='asgi', expiry=60, capacity=100,
+                 channel_capacity=None, payload_limit=NOTIFY_PAYLOAD_LIMIT):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        if psycopg is None:
+            raise ImportError('PostgresChannelLayer requires psycopg 3: pip install "psycopg[binary]"')
+        self.dsn = dsn or database_conninfo(database)
+        self.prefix = prefix
+        self.payload_limit = payload_limit
+        self.client_prefix = uuid.uuid4().hex
+        # {通道名: 本地消息队列}
+        self.channels = {}
+        # {组名: 本进程内的成员通道集合}
+        self.groups = {}
+        # {PostgreSQL通道名: 已订阅的组名或通道名}
+        self._listening = {}
+        self._conn = None
+        self._listen_conn = None
+        self._listen_lock = asyncio.Lock()
+        self._reader = None
+        self._dispatcher = None
+        self._cleaner = None
+        # 读取任务收到的原始通知，由分发任务按顺序处理（溢出负载需要查询数据库）
+        self._incoming = asyncio.Queue()
+
+    def _pg_channel(self, name):
+        # PostgreSQL标识符最长63字节，统一取名称的哈希
+        return f'{self.prefix}_{hashlib.sha1(name.encode("utf8")).hexdigest()[:40]}'
+
+    def _spill_table(self):
+        return apps.get_model('realtime', 'ChannelPayload')._meta.db_table
+
+    async def _connect(self):
+        return await psycopg.AsyncConnection.connect(self.dsn, autocommit=True)
+
+    async def _get_conn(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = await self._connect()
+        return self._conn
+
+    # 发送
+
+    async def new_channel(self, prefix='specific'):
+        # 进程专属通道共用一个订阅，收到后按消息中的完整通道名分发
+        await self._listen(f'{prefix}.{self.client_prefix}!')
+        return f'{prefix}.{self.client_prefix}!{uuid.uuid4().hex}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._notify(self.non_local_name(channel), channel, message)
+
+    async def group_send(self, group, message):
+        assert self.valid_group_name(group), 'Group name not valid'
+        await self._notify(group, group, message)
+
+    async def _notify(self, topic, name, message):
+        body = msgpack.packb({'name': name, 'message': message}, use_bin_type=True)
+        payload = base64.b64encode(body).decode('ascii')
+        conn = await self._get_conn()
+        if len(payload) > self.payload_limit:
+            table = sql.Identifier(self._spill_table())
+            cursor = await conn.execute(
+                sql.SQL('INSERT INTO {} (payload, created_at) VALUES (%s, now()) RETURNING id').format(table),
+                (body,)
+            )
+            payload = f'{SPILL_PREFIX}{(await cursor.fetchone())[0]}'
+            self._start_cleaner()
+        await conn.execute('SELECT pg_notify(%s, %s)', (self._pg_channel(topic), payload))
+
+    def _start_cleaner(self):
+        if self._cleaner is None or self._cleaner.done():
+            self._cleaner = asyncio.create_task(self._clean_spilled())
+
+    async def _clean_spilled(self):
+        # 每个expiry周期删除一次已过期的溢出负载（按created_at索引范围删除）
+        table = sql.Identifier(self._spill_table())
+        while True:
+            await asyncio.sleep(self.expiry)
+            try:
+                conn = await self._get_conn()
+                await conn.execute(
+                    sql.SQL('DELETE FROM {} WHERE created_at < now() - make_interval(secs => %s)').format(table),
+                    (self.expiry,)
+                )
+            except psycopg.Error:
+                logger.exception('Postgres channel layer failed to clean up spilled payloads')
+
+    # 接收
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._listen(self.non_local_name(channel))
+        queue = self._queue(channel)
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            # 接收方退出（连接断开）且没有未读消息时释放队列
+            if queue.empty() and self.channels.get(channel) is queue:
+                del self.channels[channel]
+            raise
+
+    def _queue(self, channel):
+        if channel not in self.channels:
+            self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return self.channels[channel]
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        self.groups.setdefault(group, set()).add(channel)
+        await self._listen(group)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.discard(channel)
+        if not members:
+            del self.groups[group]
+            await self._unlisten(group)
+
+    async def _listen(self, name):
+        pg_channel = self._pg_channel(name)
+        if pg_channel in self._listening:
+            return
+        self._listening[pg_channel] = name
+        await self._execute_listen(sql.SQL('LISTEN {}').format(sql.Identifier(pg_channel)))
+
+    async def _unlisten(self, name):
+        pg_channel = self._pg_channel(name)
+        if self._listening.pop(pg_channel, None) is None:
+            return
+        await self._execute_listen(sql.SQL('UNLISTEN {}').format(sql.Identifier(pg_channel)))
+
+    async def _execute_listen(self, statement):
+        # notifies()会一直持有连接锁：先停止读取任务再执行LISTEN/UNLISTEN，
+        # 期间到达的通知由psycopg暂存，读取任务重启后按顺序取出
+        async with self._listen_lock:
+            if self._listen_conn is None or self._listen_conn.closed:
+                self._listen_conn = await self._connect()
+            await self._stop_reader()
+            try:
+                await self._listen_conn.execute(statement)
+            finally:
+                self._reader = asyncio.create_task(self._read())
+            if self._dispatcher is None:
+                self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _stop_reader(self):
+        if self._reader is None:
+            return
+        self._reader.cancel()
+        try:
+            await self._reader
+        except asyncio.CancelledError:
+            pass
+        self._reader = None
+
+    async def _read(self):
+        while True:
+            try:
+                async for notify in self._listen_conn.notifies():
+                    self._incoming.put_nowait(notify.payload)
+            except psycopg.OperationalError:
+                logger.exception('Postgres channel layer lost its LISTEN connection, reconnecting')
+                await asyncio.sleep(1)
+                await self._reconnect_listener()
+
+    async def _reconnect_listener(self):
+        try:
+            self._listen_conn = await self._connect()
+            for pg_channel in list(self._listening):
+                await self._listen_conn.execute(sql.SQL('LISTEN {}').format(sql.Identifier(pg_channel)))
+        except psycopg.OperationalError:
+            logger.exception('Postgres channel layer reconnect failed')
+
+    async def _dispatch(self):
+        while True:
+            payload = await self._incoming.get()
+            try:
+                if payload.startswith(SPILL_PREFIX):
+                    conn = await self._get_conn()
+                    cursor = await conn.execute(
+                        sql.SQL('SELECT payload FROM {} WHERE id = %s').format(
+                            sql.Identifier(self._spill_table())
+                        ),
+                        (int(payload[len(SPILL_PREFIX):]),)
+                    )
+                    row = await cursor.fetchone()
+                    if row is None:
+                        # 已过期被清理
+                        continue
+                    body = bytes(row[0])
+                else:
+                    body = base64.b64decode(payload)
+                envelope = msgpack.unpackb(body, raw=False)
+            except Exception:
+                logger.exception('Postgres channel layer dropped an undecodable notification')
+                continue
+            self._deliver(envelope['name'], envelope['message'])
+
+    def _deliver(self, name, message):
+        if name in self.groups:
+            channels = list(self.groups[name])
+        elif '!' not in name and name not in self.channels:
+            # 普通通道没有接收方
+            return
+        else:
+            channels = [name]
+        for channel in channels:
+            try:
+                self._queue(channel).put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning('Postgres channel layer dropped a message for full channel %s', channel)
+
+    async def flush(self):
+        """
+        停止后台任务、关闭连接并清空本地状态
+        """
+        await self._stop_reader()
+        for task in (self._dispatcher, self._cleaner):
+            if task is not None:
+                task.cancel()
+        self._dispatcher = self._cleaner = None
+        for conn in (self._listen_conn, self._conn):
+            if conn is not None and not conn.closed:
+                await conn.close()
+        self._listen_conn = self._conn = None
+        self._listening.clear()
+        self.channels.clear()
+        self.groups.clear()
+
+
+class PostgresChannelLayer:
+    """
+    Postgres通道层入口：按事件循环创建独立的PostgresLoopLayer
+    （例如async_to_sync在同步代码中发送时使用临时事件循环），事件循环关闭时自动释放连接。
+    CONFIG可选项：dsn（默认由DATABASES[database]生成）、database、prefix、expiry、capacity、
+    channel_capacity、payload_limit。
+    """
+    extensions = ['groups', 'flush']
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._layers = {}
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        layer = self._layers.get(loop)
+        if layer is None:
+            layer = self._layers[loop] = PostgresLoopLayer(**self._kwargs)
+            self._wrap_close(loop)
+        return layer
+
+    def _wrap_close(self, loop):
+        original_close = loop.close
+
+        def close(this, *args, **kwargs):
+            layer = self._layers.pop(loop, None)
+            if layer is not None:
+                loop.run_until_complete(layer.flush())
+            this.close = original_close
+            return original_close(*args, **kwargs)
+
+        loop.close = types.MethodType(close, loop)
+
+    async def new_channel(self, prefix='specific'):
+        return await self._get_layer().new_channel(prefix)
+
+    async def send(self, channel, message):
+        await self._get_layer().send(channel, message)
+
+    async def receive(self, channel):
+        return await self._get_layer().receive(channel)
+
+    async def group_add(self, group, channel):
+        await self._get_layer().group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        await self._get_layer().group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        await self._get_layer().group_send(group, message)
+
+    async def flush(self):
+        await self._get_layer().flush()
@@ -0,0 +1,105 @@
+"""
+基于一致性哈希环的多Redis实例通道层
+
+channels_redis自带的多主机分片按crc32取值区间映射到主机，增删一台主机会让大部分组和通道
+换到别的实例上。这里用带虚拟节点的哈希环替换分片函数，并按主机地址（而不是在列表中的位置）
+确定节点位置：
+- 增加一台实例只会迁移约1/N的组和通道，调整主机顺序不会迁移任何数据；
+- 组成员、通道消息和进程的接收循环仍由channels_redis按同一个分片函数定位，行为与单实例一致。
+
+扩缩容（rebalancing）建议：
+1. 所有ASGI进程必须使用相同的REDIS_HOSTS，修改后整体重启，而不是与旧配置的进程长期混跑；
+   混跑期间新旧进程对部分组的定位不同，这些组的消息可能只送达一部分连接。
+2. WebSocket连接会随进程重启断开，客户端重连时重新group_add，组成员在新实例上自然重建；
+   旧实例上残留的组键会在group_expiry后过期，无需手动迁移。
+3. 一次只增删少量实例；移除实例时其上的组只会迁移到环上的相邻节点。
+4. 各实例只承担通道层流量，关闭持久化（--save "" --appendonly no）。
+"""
+import asyncio
+import bisect
+import hashlib
+
+from channels_redis.core import RedisChannelLayer
+from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer
+from channels_redis.utils import _wrap_close, decode_hosts
+
+
+def _hash(value):
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+
+def host_identity(host):
+    """
+    主机在环上的标识：优先使用地址，否则由host/port/db拼接
+    """
+    if 'address' in host:
+        return host['address']
+    return f"{host.get('host', 'localhost')}:{host.get('port', 6379)}/{host.get('db', 0)}"
+
+
+class HashRing:
+    """
+    带虚拟节点的一致性哈希环，get_index返回节点在原始列表中的下标
+    """
+
+    def __init__(self, nodes, replicas=128):
+        self.size = len(nodes)
+        points = []
+        for index, node in enumerate(nodes):
+            for replica in range(replicas):
+                points.append((_hash(f'{node}#{replica}'), index))
+        points.sort()
+        self._keys = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def get_index(self, value):
+        if self.size == 1:
+            return 0
+        position = bisect.bisect(self._keys, _hash(value)) % len(self._keys)
+        return self._indexes[position]
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    使用一致性哈希环分片的RedisChannelLayer，配置与RedisChannelLayer相同，另可指定replicas
+    """
+
+    def __init__(self, hosts=None, replicas=128, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self.ring = HashRing([host_identity(host) for host in self.hosts], replicas)
+
+    def consistent_hash(self, value):
+        return self.ring.get_index(value)
+
+
+class ShardedRedisPubSubLoopLayer(RedisPubSubLoopLayer):
+
+    def __init__(self, *args, replicas=128, **kwargs):
+        super().__init__(*args, **kwargs)
+        hosts = decode_hosts(kwargs.get('hosts', args[0] if args else None))
+        self.ring = HashRing([host_identity(host) for host in hosts], replicas)
+
+    def _get_shard(self, channel_or_group_name):
+        return self._shards[self.ring.get_index(channel_or_group_name)]
+
+
+class ShardedRedisPubSubChannelLayer(RedisPubSubChannelLayer):
+    """
+    使用一致性哈希环分片的发布订阅通道层（用于非持久化事件）
+    """
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = ShardedRedisPubSubLoopLayer(
+                *self._args,
+                **self._kwargs,
+                channel_layer=self,
+            )
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
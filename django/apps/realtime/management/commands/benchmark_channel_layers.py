@@ -0,0 +1,80 @@
+import asyncio
+import statistics
+import time
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = '对比各通道层的组消息吞吐与延迟，例如 --alias default --alias postgres'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', action='append', help='通道层别名，可重复指定（默认default）')
+        parser.add_argument('--messages', type=int, default=2000, help='发送的组消息数')
+        parser.add_argument('--groups', type=int, default=10, help='组数量')
+        parser.add_argument('--members', type=int, default=5, help='每个组的成员通道数')
+        parser.add_argument('--payload', type=int, default=200, help='消息体字节数（超过8KB可测试溢出表）')
+        parser.add_argument('--timeout', type=float, default=60, help='单个通道层的最长等待时间（秒）')
+
+    def handle(self, *args, **options):
+        for alias in options['alias'] or ['default']:
+            layer = get_channel_layer(alias)
+            if layer is None:
+                raise CommandError(f'未配置通道层：{alias}')
+            result = asyncio.run(self._run(layer, options))
+            self.stdout.write(
+                f"{alias:<12} {type(layer).__name__:<32} "
+                f"{result['deliveries']}次投递 {result['rate']:.0f}次/秒 "
+                f"延迟p50={result['p50']:.2f}ms p99={result['p99']:.2f}ms"
+            )
+
+    async def _run(self, layer, options):
+        groups = [f"bench_{index}" for index in range(options['groups'])]
+        members = {}
+        for group in groups:
+            for _ in range(options['members']):
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                members[channel] = group
+
+        expected = options['messages'] * options['members']
+        latencies = []
+        done = asyncio.Event()
+
+        async def consume(channel):
+            while True:
+                message = await layer.receive(channel)
+                latencies.append(time.perf_counter() - message['sent'])
+                if len(latencies) >= expected:
+                    done.set()
+
+        consumers = [asyncio.create_task(consume(channel)) for channel in members]
+        body = 'x' * options['payload']
+        started = time.perf_counter()
+        for index in range(options['messages']):
+            await layer.group_send(groups[index % len(groups)], {
+                'type': 'bench',
+                'sent': time.perf_counter(),
+                'body': body,
+            })
+        try:
+            await asyncio.wait_for(done.wait(), options['timeout'])
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+
+        for task in consumers:
+            task.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        for channel, group in members.items():
+            await layer.group_discard(group, channel)
+        await layer.flush()
+
+        latencies.sort()
+        return {
+            'deliveries': len(latencies),
+            'rate': len(latencies) / elapsed,
+            'p50': statistics.median(latencies) * 1000 if latencies else 0,
+            'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        }
@@ -0,0 +1,94 @@
+import asyncio
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import Counter
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.realtime.layers.sharded import ShardedRedisChannelLayer
+
+
+class Command(BaseCommand):
+    help = '在本地启动多个redis-server实例用于测试分片通道层，可选执行一次收发自检'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=3, help='实例数量')
+        parser.add_argument('--base-port', type=int, default=7001, help='第一个实例的端口')
+        parser.add_argument('--check', action='store_true', help='执行组收发自检后退出')
+        parser.add_argument('--groups', type=int, default=1000, help='自检使用的组数量')
+
+    def handle(self, *args, **options):
+        server = shutil.which('redis-server')
+        if server is None:
+            raise CommandError('未找到redis-server，请先安装Redis')
+
+        ports = [options['base_port'] + index for index in range(options['count'])]
+        workdir = tempfile.mkdtemp(prefix='chattrix-redis-')
+        processes = [
+            subprocess.Popen(
+                [server, '--port', str(port), '--save', '', '--appendonly', 'no', '--dir', workdir],
+                stdout=subprocess.DEVNULL,
+            )
+            for port in ports
+        ]
+        try:
+            for port in ports:
+                self._wait_ready(port)
+            hosts = ','.join(f'127.0.0.1:{port}' for port in ports)
+            self.stdout.write(self.style.SUCCESS(f'已启动{len(ports)}个实例：REDIS_HOSTS={hosts}'))
+
+            if options['check']:
+                asyncio.run(self._check(ports, options['groups']))
+                return
+
+            self.stdout.write('按Ctrl+C停止')
+            while all(process.poll() is None for process in processes):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _wait_ready(self, port, timeout=10):
+        client = redis.Redis(port=port)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                client.ping()
+                return
+            except redis.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise CommandError(f'redis-server（端口{port}）启动超时')
+                time.sleep(0.1)
+
+    async def _check(self, ports, group_count):
+        layer = ShardedRedisChannelLayer(hosts=[('127.0.0.1', port) for port in ports])
+        channel = await layer.new_channel()
+        groups = [f'chat_{index}' for index in range(group_count)]
+
+        started = time.monotonic()
+        for group in groups:
+            await layer.group_add(group, channel)
+        for group in groups:
+            await layer.group_send(group, {'type': 'check', 'group': group})
+        received = set()
+        for _ in groups:
+            message = await layer.receive(channel)
+            received.add(message['group'])
+        elapsed = time.monotonic() - started
+
+        distribution = Counter(layer.consistent_hash(group) for group in groups)
+        for index, port in enumerate(ports):
+            self.stdout.write(f'127.0.0.1:{port}  {distribution[index]}个组')
+        await layer.flush()
+
+        if received != set(groups):
+            raise CommandError(f'自检失败：仅收到{len(received)}/{len(groups)}条消息')
+        self.stdout.write(self.style.SUCCESS(f'自检通过：{len(groups)}个组收发耗时{elapsed:.2f}秒'))
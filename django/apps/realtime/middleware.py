@@ -1,60 +1,110 @@
-import jwt
-from django.conf import settings
-from channels.db import database_sync_to_async
-from channels.middleware import BaseMiddleware
-from channels.sessions import CookieMiddleware, SessionMiddleware
 from urllib.parse import parse_qs
 
-@database_sync_to_async
-def get_user_from_token(token):
+from asgiref.sync import sync_to_async
+from channels.middleware import BaseMiddleware
+
+# 令牌续期失败或逾期未续期时关闭连接使用的关闭码，客户端应刷新令牌后重连
+REAUTH_CLOSE_CODE = 4001
+
+
+class ScopeUser:
     """
-    从JWT令牌中获取用户对象
+    WebSocket连接上的轻量用户对象
+    由已验证的JWT声明和缓存的用户资料构造，握手时不访问数据库；
+    consumer确实需要完整的User模型时，再通过get_user()/aget_user()按需加载。
     """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, profile, claims):
+        self.id = self.pk = user_id
+        self.profile = profile
+        self.claims = claims
+        self._user = None
+
+    @property
+    def username(self):
+        return self.profile.get('username')
+
+    def get_user(self):
+        """
+        加载完整的User模型实例（同步）
+        """
+        if self._user is None:
+            from django.contrib.auth import get_user_model
+            self._user = get_user_model().objects.get(id=self.id)
+        return self._user
+
+    async def aget_user(self):
+        if self._user is None:
+            await sync_to_async(self.get_user)()
+        return self._user
+
+    def __eq__(self, other):
+        return getattr(other, 'pk', None) == self.pk and getattr(other, 'is_authenticated', False)
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username or str(self.id)
+
+
+async def authenticate_token(token):
+    """
+    验证JWT访问令牌，返回(ScopeUser, 声明)；令牌无效、用户不存在或被禁用时返回(None, None)
+    签名和过期时间在本地校验，用户资料读取缓存，缓存命中时整个过程不访问数据库。
+    """
+    # 延迟导入，避免在Django设置加载前访问模型
+    from rest_framework_simplejwt.exceptions import TokenError
+    from rest_framework_simplejwt.settings import api_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+    from apps.accounts.profiles import aget_profile
+
     try:
-        # 延迟导入，避免在Django设置加载前访问模型
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-        user_id = payload.get('user_id')
-        if user_id:
-            return User.objects.get(id=user_id)
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError, User.DoesNotExist):
-        return None
-    return None
+        claims = AccessToken(token).payload
+    except TokenError:
+        return None, None
+
+    user_id = claims.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return None, None
+
+    profile = await aget_profile(user_id)
+    if profile is None or not profile.get('is_active', True):
+        return None, None
+    return ScopeUser(profile['id'], profile, claims), claims
+
 
 class JWTAuthMiddleware(BaseMiddleware):
     """
     自定义WebSocket JWT认证中间件
-    从查询参数中提取JWT令牌并验证
+    从查询参数中提取JWT令牌并验证，认证失败时scope['user']为AnonymousUser
     """
     def __init__(self, inner):
         super().__init__(inner)
 
     async def __call__(self, scope, receive, send):
         # 延迟导入，避免在Django设置加载前访问模型
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        
+        from django.contrib.auth.models import AnonymousUser
+
+        scope = dict(scope)
+
         # 从查询参数中获取token
         query_string = scope.get('query_string', b'').decode()
         query_params = parse_qs(query_string)
         token_list = query_params.get('token', [])
-        
+
+        user, claims = None, None
         if token_list:
-            token = token_list[0]
-            user = await get_user_from_token(token)
-            if user:
-                scope['user'] = user
-            else:
-                # 如果令牌无效，创建一个匿名用户
-                scope['user'] = User()
-        else:
-            # 如果没有令牌，创建一个匿名用户
-            scope['user'] = User()
+            user, claims = await authenticate_token(token_list[0])
+
+        scope['user'] = user or AnonymousUser()
+        # 令牌过期时间（Unix时间戳），供consumer判断何时需要重新认证
+        scope['token_exp'] = claims.get('exp') if claims else None
 
         return await super().__call__(scope, receive, send)
 
-# 创建中间件栈，将JWT中间件与其他必要的中间件组合
+# JWT认证只依赖查询参数中的令牌，不需要Cookie和Session中间件
 def JWTAuthMiddlewareStack(inner):
-    return CookieMiddleware(SessionMiddleware(JWTAuthMiddleware(inner)))
\ No newline at end of file
+    return JWTAuthMiddleware(inner)
@@ -0,0 +1,15 @@
+from django.db import models
+
+
+class ChannelPayload(models.Model):
+    """
+    Postgres通道层的溢出负载
+    NOTIFY的负载上限约8KB，超过上限的消息先写入本表，通知中只携带记录ID。
+    超过通道层expiry的记录由发送过溢出负载的进程定期清理（按created_at索引删除）。
+    """
+    payload = models.BinaryField(verbose_name='消息内容')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '通道层溢出负载'
+        verbose_name_plural = '通道层溢出负载'
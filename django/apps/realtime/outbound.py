@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import deque
+
+from .conf import realtime_setting
+
+logger = logging.getLogger(__name__)
+
+# 慢连接被断开时使用的关闭码，客户端收到后应重连并通过REST接口重新同步
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+RESYNC_KEY = ('resync',)
+
+# 当前进程内所有连接的发送队列，用于汇总指标
+_queues = weakref.WeakSet()
+
+
+def coalesce_key(event):
+    """
+    返回可合并事件的合并键；不可合并的事件（聊天消息等）返回None
+    """
+    event_type = event.get('type')
+    if event_type == 'typing':
+        return ('typing', event.get('room_id'))
+    if event_type == 'presence':
+        return ('presence',)
+    if event_type == 'resync':
+        return RESYNC_KEY
+    return None
+
+
+def merge_events(old, new):
+    """
+    合并队列中尚未发送的同类事件：输入状态取最新快照，在线状态按用户合并（后到的覆盖先到的）
+    """
+    if new.get('type') != 'presence':
+        return new
+    changes = {change['user_id']: change for change in old['changes']}
+    for change in new['changes']:
+        changes.pop(change['user_id'], None)
+        changes[change['user_id']] = change
+    return {**new, 'changes': list(changes.values())}
+
+
+class _Entry:
+    __slots__ = ('event', 'enqueued_at', 'key')
+
+    def __init__(self, event, key):
+        self.event = event
+        self.enqueued_at = time.monotonic()
+        self.key = key
+
+
+class OutboundQueue:
+    """
+    单个连接的有界发送队列
+    事件处理方法只负责入队并立即返回，由后台任务按序发送，慢连接不会阻塞通道层收件箱。
+    队列满时按策略处理（settings.REALTIME['OUTBOUND_OVERFLOW']）：
+    - 在线状态、输入状态等可合并事件始终与队列中未发送的同类事件合并；
+    - drop：丢弃新的不可合并事件；
+    - resync：清空队列中的聊天事件，改为发送一条resync提示，客户端收到后重新拉取；
+    - disconnect：以4008关闭连接，客户端重连后重新同步。
+    队首事件等待超过OUTBOUND_MAX_LAG秒时，无论策略如何都断开连接。
+    指定batch_window时启用微批：收到事件后等待一个窗口，把窗口内排队的事件合并为一个
+    {"type": "batch", "events": [...]}帧发送（窗口内的输入状态和在线状态已按上述规则去重）。
+    put_many入队的一组事件（重连补发、未读同步）只占一个条目且不受容量限制；
+    客户端不支持批量帧时（batch_frames=False且未开启微批）逐条发送。
+    """
+
+    def __init__(self, send, close, maxsize=None, overflow=None, max_lag=None, name='', batch_window=0,
+                 batch_frames=True):
+        """
+        Args:
+            send: 异步回调，实际发送一个事件
+            close: 异步回调，接收关闭码并关闭连接
+            batch_window: 微批窗口（秒），为0时逐条发送
+            batch_frames: 客户端能否接收batch帧，否则一个条目中的多个事件逐条发送
+        """
+        self._send = send
+        self._close = close
+        self.maxsize = maxsize or realtime_setting('OUTBOUND_QUEUE_SIZE')
+        self.overflow = overflow or realtime_setting('OUTBOUND_OVERFLOW')
+        self.max_lag = max_lag if max_lag is not None else realtime_setting('OUTBOUND_MAX_LAG')
+        self.name = name
+        self.batch_window = batch_window
+        self.batch_frames = batch_frames or bool(batch_window)
+        self.closed = False
+        self._queue = deque()
+        # {合并键: 队列中尚未发送的条目}
+        self._pending = {}
+        # 已排入resync提示、尚未发出时为True，期间新的聊天事件由resync覆盖
+        self._resyncing = False
+        self._sending = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self.stats = {
+            'sent': 0,
+            'dropped': 0,
+            'coalesced': 0,
+            'overflows': 0,
+            'max_depth': 0,
+            'lag': 0.0,
+            'max_lag': 0.0,
+            'frames': 0,
+        }
+        _queues.add(self)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, event):
+        """
+        事件入队（不阻塞），返回事件是否会被发送（含合并）
+        """
+        if self.closed:
+            return False
+
+        now = time.monotonic()
+        if self._queue and now - self._queue[0].enqueued_at > self.max_lag:
+            self._disconnect('lag')
+            return False
+
+        key = coalesce_key(event)
+        if key is not None and key in self._pending:
+            entry = self._pending[key]
+            entry.event = merge_events(entry.event, event)
+            self.stats['coalesced'] += 1
+            return True
+        if key is None and self._resyncing:
+            self.stats['dropped'] += 1
+            return False
+
+        if len(self._queue) >= self.maxsize and not self._handle_overflow(key):
+            return False
+
+        self._append(event, key)
+        return True
+
+    def put_many(self, events):
+        """
+        一组事件作为一个条目入队，不受队列容量和resync状态限制，返回是否入队
+        用于连接建立时的补发和未读同步：积压再多也整体发出，不会触发溢出策略
+        """
+        if self.closed or not events:
+            return False
+        self._append({'type': 'batch', 'events': list(events)}, None)
+        return True
+
+    def _append(self, event, key):
+        entry = _Entry(event, key)
+        self._queue.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self._queue))
+        self._ready.set()
+
+    def _handle_overflow(self, key):
+        """
+        队列已满时按策略腾出空间，返回新事件是否还能入队
+        """
+        self.stats['overflows'] += 1
+        if self.overflow == 'disconnect':
+            self._disconnect('overflow')
+            return False
+        if self.overflow == 'drop':
+            self.stats['dropped'] += 1
+            return False
+
+        # resync：只保留可合并事件，丢弃的聊天事件由一条resync提示代替
+        kept = deque(entry for entry in self._queue if entry.key is not None)
+        self.stats['dropped'] += len(self._queue) - len(kept)
+        self._queue = kept
+        logger.warning('Outbound queue overflow on %s, resync requested: %s', self.name, self.stats)
+        if RESYNC_KEY not in self._pending:
+            self._append({'type': 'resync', 'reason': 'overflow'}, RESYNC_KEY)
+        self._resyncing = True
+
+        if key is None:
+            self.stats['dropped'] += 1
+            return False
+        # 可合并事件数量有上限（每个房间一条输入快照、一条在线状态），仍满时丢弃
+        if len(self._queue) >= self.maxsize:
+            self.stats['dropped'] += 1
+            return False
+        return True
+
+    def _disconnect(self, reason):
+        logger.warning('Disconnecting slow consumer %s (%s): %s', self.name, reason, self.stats)
+        self.stop()
+        asyncio.get_running_loop().create_task(self._close(SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+            if self.batch_window:
+                # 窗口内事件仍留在队列中，后到的输入状态/在线状态可以继续合并
+                await asyncio.sleep(self.batch_window)
+            entries = self._take(realtime_setting('BATCH_MAX_EVENTS') if self.batch_window else 1)
+
+            lag = time.monotonic() - entries[0].enqueued_at
+            self.stats['lag'] = lag
+            self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+            events = []
+            for entry in entries:
+                if entry.event.get('type') == 'batch':
+                    # 展开已经成批的事件（如二进制协议下的未读消息），避免嵌套
+                    events.extend(entry.event['events'])
+                else:
+                    events.append(entry.event)
+
+            self._sending = True
+            try:
+                if len(events) == 1:
+                    await self._send(events[0])
+                    self.stats['frames'] += 1
+                elif self.batch_frames:
+                    await self._send({'type': 'batch', 'events': events})
+                    self.stats['frames'] += 1
+                else:
+                    for event in events:
+                        await self._send(event)
+                    self.stats['frames'] += len(events)
+                self.stats['sent'] += len(entries)
+            except Exception:
+                logger.exception('Outbound send failed on %s', self.name)
+            finally:
+                self._sending = False
+
+    def _take(self, limit):
+        entries = []
+        while self._queue and len(entries) < limit:
+            entry = self._queue.popleft()
+            if entry.key is not None:
+                self._pending.pop(entry.key, None)
+            if entry.key == RESYNC_KEY:
+                self._resyncing = False
+            entries.append(entry)
+        return entries
+
+    async def drain(self):
+        """
+        等待队列中的事件全部发出（主要用于测试）
+        """
+        while (self._queue or self._sending) and not self.closed:
+            await asyncio.sleep(0)
+
+    def stop(self):
+        """
+        停止发送并丢弃队列中剩余的事件（连接断开时调用）
+        """
+        self.closed = True
+        self._queue.clear()
+        self._pending.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        _queues.discard(self)
+
+    def metrics(self):
+        """
+        连接级指标：当前队列深度、队首等待时间及累计统计
+        """
+        head_lag = time.monotonic() - self._queue[0].enqueued_at if self._queue else 0.0
+        return {
+            'name': self.name,
+            'depth': len(self._queue),
+            'head_lag': head_lag,
+            **self.stats,
+        }
+
+
+def outbound_metrics():
+    """
+    当前进程内所有连接的发送队列指标，按队首等待时间倒序排列
+    """
+    return sorted(
+        (queue.metrics() for queue in list(_queues)),
+        key=lambda metrics: metrics['head_lag'],
+        reverse=True
+    )
@@ -0,0 +1,243 @@
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.apps import apps
+from django.core.cache import cache
+
+from apps.accounts.profiles import invalidate_profiles
+from .batching import AsyncCoalescer, PeriodicFlusher
+from .conf import realtime_setting
+
+ONLINE_KEY = 'presence:online:{}'
+# 连接计数按周期分键：计数键过期后开启新周期，仍在线的连接在下次心跳时重新登记
+EPOCH_KEY = 'presence:epoch:{}'
+CONNECTIONS_KEY = 'presence:conns:{}:{}'
+AUDIENCE_KEY = 'presence:audience:{}'
+SWEEP_LOCK_KEY = 'presence:sweep'
+# 过期扫描每批检查的用户数
+SWEEP_BATCH_SIZE = 1000
+
+
+class PresenceService:
+    """
+    在线状态服务
+    以缓存（生产环境为Redis）中的TTL键表示用户在线，连接建立和心跳时续期；
+    多端连接通过引用计数处理，最后一个连接断开时才视为离线；
+    计数键过期后每个连接在下次心跳时重新登记到新周期，不会少算仍在线的连接。
+    状态变更在进程内合并后按时间窗口批量广播给在线好友，数据库只在状态翻转时批量写入。
+    """
+
+    def __init__(self):
+        self._coalescer = None
+        self._sweeper = None
+
+    @property
+    def _changes(self):
+        # 延迟创建，避免在Django设置加载前读取配置
+        if self._coalescer is None:
+            self._coalescer = AsyncCoalescer(
+                realtime_setting('PRESENCE_FLUSH_INTERVAL'),
+                self._flush_changes,
+            )
+        return self._coalescer
+
+    # ---- 连接生命周期（在消费者中调用） ----
+
+    async def _register(self, user_id, ttl):
+        """
+        在当前计数周期中登记一个连接，返回周期标识；周期不存在时开启新周期
+        """
+        epoch_key = EPOCH_KEY.format(user_id)
+        while True:
+            epoch = uuid.uuid4().hex
+            if not await cache.aadd(epoch_key, epoch, ttl):
+                epoch = await cache.aget(epoch_key)
+                if epoch is None:
+                    # 读取前恰好过期，重试
+                    continue
+            conns_key = CONNECTIONS_KEY.format(user_id, epoch)
+            await cache.aadd(conns_key, 0, ttl)
+            await cache.aincr(conns_key)
+            return epoch
+
+    async def _mark_online(self, user_id, ttl):
+        if await cache.aadd(ONLINE_KEY.format(user_id), 1, ttl):
+            self._changes.add(user_id, 'online')
+        else:
+            await cache.atouch(ONLINE_KEY.format(user_id), ttl)
+
+    async def connect(self, user_id):
+        """
+        记录一个新连接，用户由离线变为在线时登记状态变更
+        返回连接所在的计数周期，心跳和断开时传回
+        """
+        ttl = realtime_setting('PRESENCE_TTL')
+        epoch = await self._register(user_id, ttl)
+        await self._mark_online(user_id, ttl)
+        self._start_sweeper()
+        return epoch
+
+    async def heartbeat(self, user_id, epoch=None):
+        """
+        心跳续期，返回连接当前所在的计数周期
+        计数键已过期（例如长时间未心跳）时重新登记该连接，在线键过期时重新登记为在线
+        """
+        ttl = realtime_setting('PRESENCE_TTL')
+        epoch_key = EPOCH_KEY.format(user_id)
+        current = await cache.aget(epoch_key)
+        if current is not None and epoch in (None, current):
+            epoch = current
+            await cache.atouch(epoch_key, ttl)
+            await cache.atouch(CONNECTIONS_KEY.format(user_id, epoch), ttl)
+        else:
+            epoch = await self._register(user_id, ttl)
+        await self._mark_online(user_id, ttl)
+        return epoch
+
+    async def disconnect(self, user_id, epoch=None):
+        """
+        释放一个连接，最后一个连接断开时立即标记为离线
+        连接所在的计数周期已失效时无法判断是否为最后一个连接，不做处理：
+        其他连接的心跳会登记到新周期，全部断开后由过期扫描标记离线
+        """
+        current = await cache.aget(EPOCH_KEY.format(user_id))
+        if current is None or epoch not in (None, current):
+            return
+        conns_key = CONNECTIONS_KEY.format(user_id, current)
+        try:
+            remaining = await cache.adecr(conns_key)
+        except ValueError:
+            return
+        if remaining <= 0:
+            await cache.adelete_many([EPOCH_KEY.format(user_id), conns_key, ONLINE_KEY.format(user_id)])
+            self._changes.add(user_id, 'offline')
+
+    # ---- 过期清理 ----
+
+    def sweep_expired(self):
+        """
+        清理心跳中断（进程崩溃、网络中断未触发disconnect）的用户：
+        数据库中仍为online但在线键已过期的用户标记为离线，并向其好友广播
+        多进程部署时通过缓存锁保证每个周期只有一个进程执行，返回清理的用户数
+        """
+        interval = realtime_setting('PRESENCE_SWEEP_INTERVAL')
+        if interval and not cache.add(SWEEP_LOCK_KEY, 1, max(1, int(interval) - 1)):
+            return 0
+        User = apps.get_model('accounts', 'User')
+        online_ids = list(User.objects.filter(user_status='online').values_list('id', flat=True))
+        expired = set()
+        for start in range(0, len(online_ids), SWEEP_BATCH_SIZE):
+            batch = online_ids[start:start + SWEEP_BATCH_SIZE]
+            expired.update(set(batch) - self.get_online_ids(batch))
+        if expired:
+            async_to_sync(self._flush_changes)({user_id: 'offline' for user_id in expired})
+        return len(expired)
+
+    def _start_sweeper(self):
+        interval = realtime_setting('PRESENCE_SWEEP_INTERVAL')
+        if not interval:
+            return
+        if self._sweeper is None:
+            self._sweeper = PeriodicFlusher(
+                interval, self.sweep_expired, name='presence-sweeper', flush_on_exit=False
+            )
+        self._sweeper.start()
+
+    # ---- 查询 ----
+
+    def get_online_ids(self, user_ids):
+        """
+        批量查询在线用户，返回其中在线用户ID的集合
+        """
+        keys = {ONLINE_KEY.format(user_id): user_id for user_id in user_ids}
+        found = cache.get_many(keys.keys())
+        return {keys[key] for key in found}
+
+    def get_statuses(self, user_ids):
+        """
+        批量查询在线状态，返回 {user_id: 'online' | 'offline'}
+        """
+        online = self.get_online_ids(user_ids)
+        return {
+            user_id: 'online' if user_id in online else 'offline'
+            for user_id in user_ids
+        }
+
+    # ---- 广播对象 ----
+
+    def get_audience_ids(self, user_id):
+        """
+        获取关注该用户在线状态的用户（即把该用户加为好友的人），结果带缓存
+        """
+        key = AUDIENCE_KEY.format(user_id)
+        audience = cache.get(key)
+        if audience is None:
+            Friend = apps.get_model('friends', 'Friend')
+            audience = list(
+                Friend.objects.filter(friend_id=user_id).values_list('owner_id', flat=True)
+            )
+            cache.set(key, audience, None)
+        return audience
+
+    def invalidate_audience(self, *user_ids):
+        """
+        好友关系变化时清除广播对象缓存
+        """
+        cache.delete_many([AUDIENCE_KEY.format(user_id) for user_id in user_ids])
+
+    # ---- 合并广播 ----
+
+    async def _flush_changes(self, changes):
+        """
+        批量处理一个时间窗口内的状态变更：
+        翻转数据库中的user_status，并按接收者聚合后每人只发送一条广播
+        """
+        await database_sync_to_async(self._persist_changes)(changes)
+        recipients = await database_sync_to_async(self._group_by_recipient)(changes)
+
+        channel_layer = get_channel_layer()
+        for recipient_id, batch in recipients.items():
+            await channel_layer.group_send(
+                f'friends_{recipient_id}',
+                {
+                    'type': 'presence.batch',
+                    'changes': batch,
+                }
+            )
+
+    def _persist_changes(self, changes):
+        User = apps.get_model('accounts', 'User')
+        for status in ('online', 'offline'):
+            user_ids = [user_id for user_id, value in changes.items() if value == status]
+            if user_ids:
+                User.objects.filter(id__in=user_ids).exclude(
+                    user_status=status
+                ).update(user_status=status)
+        # 批量update不会触发post_save，需手动清除资料缓存中的旧状态
+        invalidate_profiles(*changes)
+        # 好友列表快照中包含在线状态，同时使关注者的快照失效
+        from apps.friends.snapshots import bump_versions
+        bump_versions(*{
+            owner_id for user_id in changes for owner_id in self.get_audience_ids(user_id)
+        })
+
+    def _group_by_recipient(self, changes):
+        audiences = {user_id: self.get_audience_ids(user_id) for user_id in changes}
+        online = self.get_online_ids({
+            recipient_id for audience in audiences.values() for recipient_id in audience
+        })
+
+        recipients = {}
+        for user_id, status in changes.items():
+            for recipient_id in audiences[user_id]:
+                if recipient_id in online:
+                    recipients.setdefault(recipient_id, []).append({
+                        'user_id': user_id,
+                        'status': status,
+                    })
+        return recipients
+
+
+presence_service = PresenceService()
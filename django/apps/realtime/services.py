@@ -3,6 +3,7 @@ from typing import Any, Dict
 from channels.layers import get_channel_layer
 from django.apps import apps
 from django.core.exceptions import ObjectDoesNotExist
+from .broadcast import aget_room_layer
 
 # 获取channel layer用于发送实时消息
 channel_layer = get_channel_layer()
@@ -47,24 +48,27 @@ class RealtimeService:
             pass
 
     @staticmethod
-    async def send_friend_accepted_notification(friend_id: int, user_id: int):
+    async def send_friend_accepted_notification(friend_id: int, user_id: int, friend_username: str = None):
         """
         发送好友请求被接受的通知
         
         Args:
             friend_id: 好友ID
             user_id: 用户ID
+            friend_username: 好友用户名，已知时传入可省去一次查询
         """
         try:
-            # 使用Django的apps.get_model动态获取模型，避免直接导入
-            User = apps.get_model('accounts', 'User')
-            friend = await User.objects.aget(id=friend_id)
+            if friend_username is None:
+                # 使用Django的apps.get_model动态获取模型，避免直接导入
+                User = apps.get_model('accounts', 'User')
+                friend = await User.objects.aget(id=friend_id)
+                friend_username = friend.username
             
             # 构造通知事件
             event = {
                 'type': 'friend.accepted',
                 'friend_id': friend_id,
-                'friend_username': friend.username,
+                'friend_username': friend_username,
             }
             
             # 发送到好友通知组
@@ -131,8 +135,9 @@ class RealtimeService:
             if extra_data:
                 event.update(extra_data)
             
-            # 发送到聊天室组
-            await channel_layer.group_send(
+            # 发送到聊天室组（大群走发布订阅广播）
+            room_layer = await aget_room_layer(room_id)
+            await room_layer.group_send(
                 f'chat_{room_id}',
                 event
             )
@@ -156,8 +161,32 @@ class RealtimeService:
             'message': message,
         }
         
-        # 发送到聊天室组
-        await channel_layer.group_send(
+        # 发送到聊天室组（大群走发布订阅广播）
+        room_layer = await aget_room_layer(room_id)
+        await room_layer.group_send(
+            f'chat_{room_id}',
+            event
+        )
+
+    @staticmethod
+    async def send_group_members_changed(room_id: int, action: str, user_ids: list):
+        """
+        推送群成员变化（批量操作只推送一条事件）
+
+        Args:
+            room_id: 群聊ID
+            action: add / remove / promote
+            user_ids: 变化的用户ID列表
+        """
+        event = {
+            'type': 'group.members',
+            'room_id': room_id,
+            'action': action,
+            'user_ids': user_ids,
+        }
+
+        room_layer = await aget_room_layer(room_id)
+        await room_layer.group_send(
             f'chat_{room_id}',
             event
         )
\ No newline at end of file
@@ -1,3 +1,646 @@
-from django.test import TestCase
+import asyncio
+import unittest
+import zlib
+from collections import Counter
+from datetime import timedelta
+
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.accounts.models import User
+from apps.chat.models import GroupChatRoom
+from apps.friends.models import Friend
+from apps.messages.models import Message
+from apps.realtime.broadcast import get_room_layer, get_room_member_count
+from apps.realtime.codecs import (
+    FRAME_DEFLATE, FRAME_RAW, JsonCodec, MSGPACK_SUBPROTOCOL, MsgPackCodec, negotiate_codec,
+)
+from apps.realtime.layers import get_ephemeral_layer
+from apps.realtime.layers.postgres import PostgresLoopLayer
+from apps.realtime.layers.sharded import HashRing, ShardedRedisChannelLayer
+from apps.realtime.middleware import REAUTH_CLOSE_CODE, JWTAuthMiddlewareStack, authenticate_token
+from apps.realtime.outbound import SLOW_CONSUMER_CLOSE_CODE, OutboundQueue
+from apps.realtime.presence import CONNECTIONS_KEY, EPOCH_KEY, ONLINE_KEY, presence_service
+from apps.realtime.routing import websocket_urlpatterns
+from apps.realtime.consumers import ChatConsumer
+from apps.realtime.typing_indicators import TypingSnapshotMerger, typing_service
 
 # Create your tests here.
+
+
+class PresenceServiceTests(TestCase):
+    """测试在线状态服务的引用计数与批量广播"""
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='presence_user1', password='password123')
+        self.user2 = User.objects.create_user(username='presence_user2', password='password123')
+
+    def tearDown(self):
+        # 清空合并器中未处理的变更，避免跨测试残留
+        presence_service._changes._pending.clear()
+
+    async def test_multi_device_refcount(self):
+        """同一用户多端连接时，最后一个连接断开才视为离线"""
+        await presence_service.connect(self.user1.id)
+        await presence_service.connect(self.user1.id)
+        await presence_service.disconnect(self.user1.id)
+        self.assertEqual(presence_service.get_online_ids([self.user1.id]), {self.user1.id})
+
+        await presence_service.disconnect(self.user1.id)
+        self.assertEqual(presence_service.get_online_ids([self.user1.id]), set())
+
+    async def test_heartbeat_restores_expired_key(self):
+        """在线键过期后，心跳会重新登记为在线"""
+        await presence_service.connect(self.user1.id)
+        await cache.adelete(ONLINE_KEY.format(self.user1.id))
+
+        await presence_service.heartbeat(self.user1.id)
+        self.assertEqual(
+            presence_service.get_statuses([self.user1.id, self.user2.id]),
+            {self.user1.id: 'online', self.user2.id: 'offline'}
+        )
+
+    async def test_expired_refcount_is_reseeded_by_heartbeats(self):
+        """计数键在两次心跳之间过期后，两个连接都重新登记，断开一个仍保持在线"""
+        first = await presence_service.connect(self.user1.id)
+        second = await presence_service.connect(self.user1.id)
+        await cache.adelete_many([
+            EPOCH_KEY.format(self.user1.id),
+            CONNECTIONS_KEY.format(self.user1.id, first),
+            ONLINE_KEY.format(self.user1.id),
+        ])
+
+        first = await presence_service.heartbeat(self.user1.id, first)
+        second = await presence_service.heartbeat(self.user1.id, second)
+        self.assertEqual(first, second)
+        await presence_service.disconnect(self.user1.id, first)
+        self.assertEqual(presence_service.get_online_ids([self.user1.id]), {self.user1.id})
+
+        await presence_service.disconnect(self.user1.id, second)
+        self.assertEqual(presence_service.get_online_ids([self.user1.id]), set())
+
+    async def test_disconnect_from_expired_epoch_keeps_other_connections(self):
+        """计数键过期后新连接开启新周期，旧周期连接断开不会把用户标记为离线"""
+        stale = await presence_service.connect(self.user1.id)
+        await cache.adelete_many([EPOCH_KEY.format(self.user1.id), ONLINE_KEY.format(self.user1.id)])
+        await presence_service.connect(self.user1.id)
+
+        await presence_service.disconnect(self.user1.id, stale)
+        self.assertEqual(presence_service.get_online_ids([self.user1.id]), {self.user1.id})
+
+    async def test_changes_broadcast_to_online_friends(self):
+        """状态变更合并后只广播给在线的好友，并翻转数据库中的状态"""
+        await Friend.objects.acreate(owner=self.user2, friend=self.user1)
+        channel_layer = get_channel_layer()
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(f'friends_{self.user2.id}', channel_name)
+
+        await presence_service.connect(self.user2.id)
+        await presence_service.connect(self.user1.id)
+        await presence_service._changes.flush_now()
+
+        event = await channel_layer.receive(channel_name)
+        self.assertEqual(event['type'], 'presence.batch')
+        self.assertIn({'user_id': self.user1.id, 'status': 'online'}, event['changes'])
+
+        user1 = await User.objects.aget(id=self.user1.id)
+        self.assertEqual(user1.user_status, 'online')
+
+    async def test_sweep_marks_expired_users_offline(self):
+        """心跳中断导致在线键过期的用户由扫描标记为离线并广播"""
+        await Friend.objects.acreate(owner=self.user2, friend=self.user1)
+        await User.objects.filter(id__in=[self.user1.id, self.user2.id]).aupdate(user_status='online')
+        channel_layer = get_channel_layer()
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(f'friends_{self.user2.id}', channel_name)
+        # user1的进程崩溃：在线键过期且没有disconnect；user2仍在线
+        await cache.aset(ONLINE_KEY.format(self.user2.id), 1, 60)
+
+        swept = await database_sync_to_async(presence_service.sweep_expired)()
+        self.assertEqual(swept, 1)
+        event = await channel_layer.receive(channel_name)
+        self.assertEqual(event['changes'], [{'user_id': self.user1.id, 'status': 'offline'}])
+        self.assertEqual((await User.objects.aget(id=self.user1.id)).user_status, 'offline')
+        self.assertEqual((await User.objects.aget(id=self.user2.id)).user_status, 'online')
+
+        # 同一周期内其他进程不再重复扫描
+        self.assertEqual(await database_sync_to_async(presence_service.sweep_expired)(), 0)
+
+
+class TypingIndicatorTests(TestCase):
+    """测试输入状态的限流与按房间合并"""
+
+    room_id = 1234567890
+
+    def tearDown(self):
+        typing_service._rooms._pending.clear()
+        typing_service._typing.clear()
+        typing_service._last_started.clear()
+        typing_service._stopped.clear()
+
+    async def test_burst_is_merged_into_one_snapshot(self):
+        """同一窗口内多个用户的输入事件合并为一条快照"""
+        channel_layer = get_channel_layer()
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(f'chat_{self.room_id}', channel_name)
+
+        for user_id in range(1, 6):
+            typing_service.start(self.room_id, user_id)
+            typing_service.start(self.room_id, user_id)
+        await typing_service._rooms.flush_now()
+
+        event = await channel_layer.receive(channel_name)
+        self.assertEqual(event['type'], 'typing.snapshot')
+        self.assertEqual(event['typing'], [1, 2, 3, 4, 5])
+        self.assertEqual(typing_service._rooms._pending, {})
+
+    async def test_repeated_start_is_rate_limited(self):
+        """持续输入时在限流间隔内不会重复触发广播"""
+        typing_service.start(self.room_id, 1)
+        await typing_service._rooms.flush_now()
+
+        typing_service.start(self.room_id, 1)
+        self.assertEqual(typing_service._rooms._pending, {})
+
+        typing_service.stop(self.room_id, 1)
+        self.assertIn(self.room_id, typing_service._rooms._pending)
+        self.assertEqual(typing_service.snapshot(self.room_id), [])
+
+    def test_snapshots_from_several_processes_are_merged(self):
+        """每个进程只发送本进程的输入状态，接收方按来源合并"""
+        merger = TypingSnapshotMerger()
+        self.assertEqual(merger.update({'source': 'a', 'typing': [1, 2], 'stopped': [], 'ttl': 6}), ([1, 2], []))
+        self.assertEqual(merger.update({'source': 'b', 'typing': [3], 'stopped': [], 'ttl': 6}), ([1, 2, 3], []))
+        # 用户2在进程a停止输入
+        self.assertEqual(merger.update({'source': 'a', 'typing': [1], 'stopped': [2], 'ttl': 6}), ([1, 3], [2]))
+        # 过期的来源不再计入
+        self.assertEqual(merger.update({'source': 'a', 'typing': [], 'stopped': [1], 'ttl': 0}), ([3], [1]))
+
+    async def test_ephemeral_listener_survives_dispatch_errors(self):
+        """单个瞬时事件处理失败时监听任务继续运行"""
+        consumer = ChatConsumer()
+        consumer.ephemeral_layer = get_channel_layer()
+        consumer.ephemeral_channel = await consumer.ephemeral_layer.new_channel()
+        handled = []
+
+        async def dispatch(message):
+            if message['type'] == 'broken':
+                raise ValueError(message['type'])
+            handled.append(message['type'])
+
+        consumer.dispatch = dispatch
+        task = asyncio.create_task(consumer._listen_ephemeral())
+        await consumer.ephemeral_layer.send(consumer.ephemeral_channel, {'type': 'broken'})
+        await consumer.ephemeral_layer.send(consumer.ephemeral_channel, {'type': 'typing.snapshot'})
+        with self.assertLogs('apps.realtime.consumers', 'ERROR'):
+            for _ in range(100):
+                if handled:
+                    break
+                await asyncio.sleep(0.01)
+        task.cancel()
+        self.assertEqual(handled, ['typing.snapshot'])
+
+
+class FrameCodecTests(TestCase):
+    """测试子协议协商与二进制帧编解码"""
+
+    def test_json_is_default(self):
+        codec = negotiate_codec([])
+        self.assertIsInstance(codec, JsonCodec)
+        self.assertIsNone(codec.subprotocol)
+
+    def test_msgpack_negotiation(self):
+        codec = negotiate_codec(['chattrix.json', MSGPACK_SUBPROTOCOL])
+        self.assertIsInstance(codec, MsgPackCodec)
+        self.assertEqual(codec.subprotocol, MSGPACK_SUBPROTOCOL)
+
+    def test_large_batches_are_compressed(self):
+        codec = MsgPackCodec()
+        small = {'type': 'pong'}
+        large = {
+            'type': 'batch',
+            'events': [
+                {'type': 'chat_message', 'sender': {'id': 1, 'username': 'u'}, 'messages_type': 'text',
+                 'room_type': 'group', 'content': f'hello {index}'}
+                for index in range(100)
+            ],
+        }
+
+        small_frame = codec.encode(small)['bytes_data']
+        large_frame = codec.encode(large)['bytes_data']
+        self.assertEqual(small_frame[0], FRAME_RAW)
+        self.assertEqual(large_frame[0], FRAME_DEFLATE)
+        self.assertLess(len(large_frame), len(JsonCodec().encode(large)['text_data']) / 4)
+        self.assertEqual(codec.decode(bytes_data=small_frame), small)
+        self.assertEqual(codec.decode(bytes_data=large_frame), large)
+
+    def test_corrupt_frame_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            MsgPackCodec().decode(bytes_data=bytes([FRAME_DEFLATE]) + b'not deflate')
+
+    @override_settings(REALTIME={'MAX_FRAME_SIZE': 1024})
+    def test_oversized_frame_is_rejected(self):
+        codec = MsgPackCodec()
+        # 高压缩比的负载：压缩后很小，解压后超过上限
+        bomb = zlib.compress(msgpack.packb({'type': 'ping', 'pad': 'x' * 10 * 1024 * 1024}))
+        self.assertLess(len(bomb), 20 * 1024)
+        with self.assertRaises(ValueError):
+            codec.decode(bytes_data=bytes([FRAME_DEFLATE]) + bomb)
+        with self.assertRaises(ValueError):
+            codec.decode(bytes_data=bytes([FRAME_RAW]) + msgpack.packb({'pad': 'x' * 2048}))
+        with self.assertRaises(ValueError):
+            codec.decode(bytes_data=bytes([FRAME_DEFLATE]) + zlib.compress(msgpack.packb({'type': 'ping'}))[:-4])
+        self.assertEqual(
+            codec.decode(bytes_data=bytes([FRAME_DEFLATE]) + zlib.compress(msgpack.packb({'type': 'ping'}))),
+            {'type': 'ping'}
+        )
+
+
+class HandshakeAuthTests(TestCase):
+    """测试WebSocket握手认证：缓存命中时不访问数据库"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='handshake_user', password='password123')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_cached_profile_needs_no_queries(self):
+        async_to_sync(authenticate_token)(self.token)
+
+        with self.assertNumQueries(0):
+            user, claims = async_to_sync(authenticate_token)(self.token)
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual(user.id, self.user.id)
+        self.assertEqual(user.username, 'handshake_user')
+        self.assertEqual(claims['exp'], AccessToken(self.token)['exp'])
+        self.assertEqual(user.get_user(), self.user)
+
+    def test_invalid_or_inactive_user_is_rejected(self):
+        self.assertEqual(async_to_sync(authenticate_token)('not-a-token'), (None, None))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(async_to_sync(authenticate_token)(self.token), (None, None))
+
+
+class OutboundQueueTests(TestCase):
+    """测试连接发送队列的合并、溢出策略与慢连接断开"""
+
+    def setUp(self):
+        self.sent = []
+        self.closed = []
+        self.gate = asyncio.Event()
+
+    async def slow_send(self, event):
+        await self.gate.wait()
+        self.sent.append(event)
+
+    async def close(self, code):
+        self.closed.append(code)
+
+    async def test_presence_and_typing_are_coalesced(self):
+        queue = OutboundQueue(self.slow_send, self.close, maxsize=10)
+        queue.put({'type': 'chat_message', 'content': 'hi'})
+        await asyncio.sleep(0)
+        for index in range(5):
+            queue.put({'type': 'typing', 'room_id': 1, 'typing': [index], 'stopped': []})
+            queue.put({'type': 'presence', 'changes': [{'user_id': index % 2, 'status': 'online'}]})
+        self.assertEqual(len(queue), 2)
+
+        self.gate.set()
+        await queue.drain()
+        self.assertEqual(self.sent[1]['typing'], [4])
+        self.assertEqual(sorted(change['user_id'] for change in self.sent[2]['changes']), [0, 1])
+        self.assertEqual(queue.stats['coalesced'], 8)
+        queue.stop()
+
+    async def test_overflow_replaces_chat_backlog_with_resync(self):
+        queue = OutboundQueue(self.slow_send, self.close, maxsize=3, overflow='resync')
+        for index in range(10):
+            queue.put({'type': 'chat_message', 'content': index})
+
+        self.gate.set()
+        await queue.drain()
+        self.assertEqual([event['type'] for event in self.sent], ['resync'])
+        self.assertEqual(queue.stats['overflows'], 1)
+        self.assertEqual(queue.stats['dropped'], 10)
+
+        # resync发出后恢复正常发送
+        queue.put({'type': 'chat_message', 'content': 'after'})
+        await queue.drain()
+        self.assertEqual(self.sent[-1]['content'], 'after')
+        queue.stop()
+
+    async def test_put_many_is_exempt_from_overflow(self):
+        queue = OutboundQueue(self.slow_send, self.close, maxsize=3, overflow='resync', batch_frames=False)
+        queue.put_many([{'type': 'chat_message', 'content': index} for index in range(300)])
+        queue.put({'type': 'chat_message', 'content': 'live'})
+
+        self.gate.set()
+        await queue.drain()
+        # 不支持批量帧的客户端逐条收到全部积压消息，不触发resync
+        self.assertEqual([event['content'] for event in self.sent], [*range(300), 'live'])
+        self.assertEqual(queue.stats['overflows'], 0)
+        self.assertEqual(queue.stats['dropped'], 0)
+        queue.stop()
+
+    async def test_lagging_consumer_is_disconnected(self):
+        queue = OutboundQueue(self.slow_send, self.close, maxsize=10, max_lag=0)
+        queue.put({'type': 'chat_message', 'content': 1})
+        queue.put({'type': 'chat_message', 'content': 2})
+        await asyncio.sleep(0.01)
+        self.assertFalse(queue.put({'type': 'chat_message', 'content': 3}))
+        await asyncio.sleep(0)
+        self.assertTrue(queue.closed)
+        self.assertEqual(self.closed, [SLOW_CONSUMER_CLOSE_CODE])
+
+    async def test_micro_batching_merges_window_into_one_frame(self):
+        self.gate.set()
+        queue = OutboundQueue(self.slow_send, self.close, maxsize=10, batch_window=0.01)
+        queue.put({'type': 'chat_message', 'content': 1})
+        queue.put({'type': 'typing', 'room_id': 1, 'typing': [1], 'stopped': []})
+        queue.put({'type': 'batch', 'events': [{'type': 'chat_message', 'content': 2}]})
+        queue.put({'type': 'typing', 'room_id': 1, 'typing': [1, 2], 'stopped': []})
+        await queue.drain()
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]['type'], 'batch')
+        self.assertEqual(
+            [event.get('content', event.get('typing')) for event in self.sent[0]['events']],
+            [1, [1, 2], 2]
+        )
+        self.assertEqual(queue.stats['frames'], 1)
+
+        # 窗口内只有一个事件时直接发送，不包装成批量帧
+        queue.put({'type': 'chat_message', 'content': 3})
+        await queue.drain()
+        self.assertEqual(self.sent[-1], {'type': 'chat_message', 'content': 3})
+        queue.stop()
+
+
+class ShardedLayerTests(TestCase):
+    """测试一致性哈希环分片"""
+
+    groups = [f'chat_{index}' for index in range(2000)]
+
+    def test_adding_a_host_moves_few_groups(self):
+        before = HashRing(['redis-1', 'redis-2', 'redis-3'])
+        after = HashRing(['redis-1', 'redis-2', 'redis-3', 'redis-4'])
+        moved = [group for group in self.groups if before.get_index(group) != after.get_index(group)]
+        # 理想情况迁移1/4，且只会迁移到新增的实例
+        self.assertLess(len(moved), len(self.groups) * 0.35)
+        self.assertTrue(all(after.get_index(group) == 3 for group in moved))
+
+    def test_host_order_does_not_matter(self):
+        hosts = [('redis-1', 6379), ('redis-2', 6379), ('redis-3', 6379)]
+        layer = ShardedRedisChannelLayer(hosts=hosts)
+        reordered = ShardedRedisChannelLayer(hosts=hosts[::-1])
+        for group in self.groups[:200]:
+            self.assertEqual(
+                hosts[layer.consistent_hash(group)],
+                hosts[::-1][reordered.consistent_hash(group)]
+            )
+
+    def test_groups_are_spread_evenly(self):
+        ring = HashRing(['redis-1', 'redis-2', 'redis-3'])
+        counts = Counter(ring.get_index(group) for group in self.groups)
+        self.assertEqual(set(counts), {0, 1, 2})
+        self.assertGreater(min(counts.values()), len(self.groups) / 3 * 0.7)
+
+
+@override_settings(
+    CHANNEL_LAYERS={
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+        'ephemeral': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+    },
+    REALTIME={'BROADCAST_ROOM_THRESHOLD': 3},
+)
+class BroadcastRoomTests(TestCase):
+    """测试大群自动切换到发布订阅广播"""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'broadcast_user{index}', password='password123')
+            for index in range(3)
+        ]
+        self.room = GroupChatRoom.objects.create(name='broadcast')
+        self.room.members.add(*self.users[:2])
+
+    def test_threshold_and_invalidation(self):
+        self.assertIs(get_room_layer(self.room.id), get_channel_layer())
+
+        self.room.members.add(self.users[2])
+        self.assertEqual(get_room_member_count(self.room.id), 3)
+        self.assertIs(get_room_layer(self.room.id), get_ephemeral_layer())
+
+        self.users[0].group_rooms.remove(self.room)
+        self.assertIs(get_room_layer(self.room.id), get_channel_layer())
+
+    def send_message(self):
+        # 消息在事务提交后广播
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.users[0], room_type='group', room_id=self.room.id, content='hello')
+
+    async def test_large_room_messages_use_broadcast_layer(self):
+        await self.room.members.aadd(self.users[2])
+        ephemeral = get_ephemeral_layer()
+        channel_name = await ephemeral.new_channel()
+        await ephemeral.group_add(f'chat_{self.room.id}', channel_name)
+
+        await database_sync_to_async(self.send_message)()
+        event = await asyncio.wait_for(ephemeral.receive(channel_name), 1)
+        self.assertEqual(event['type'], 'chat_message')
+        self.assertEqual(event['content'], 'hello')
+
+
+class PostgresLayerTests(TestCase):
+    """测试Postgres通道层的本地分发（不连接数据库）"""
+
+    async def test_local_fan_out_and_channel_names(self):
+        layer = PostgresLoopLayer(dsn='dbname=chattrix')
+        layer._listen = self._noop
+        first = await layer.new_channel()
+        second = await layer.new_channel()
+        await layer.group_add('chat_1', first)
+        await layer.group_add('chat_1', second)
+
+        layer._deliver('chat_1', {'type': 'chat_message', 'content': 'hi'})
+        layer._deliver(second, {'type': 'direct'})
+        self.assertEqual((await layer.receive(first))['content'], 'hi')
+        self.assertEqual((await layer.receive(second))['type'], 'chat_message')
+        self.assertEqual((await layer.receive(second))['type'], 'direct')
+
+        # PostgreSQL标识符长度上限为63字节
+        self.assertLessEqual(len(layer._pg_channel('x' * 100)), 63)
+
+    async def _noop(self, name):
+        pass
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', '需要PostgreSQL数据库')
+class PostgresLayerIntegrationTests(TestCase):
+    """测试Postgres通道层的LISTEN/NOTIFY收发、溢出表和断线重连（仅在PostgreSQL上运行）"""
+
+    async def run_with_layer(self, test):
+        # 通道层绑定事件循环，每个测试单独创建并在结束时关闭连接
+        layer = PostgresLoopLayer(expiry=1)
+        try:
+            await test(layer)
+        finally:
+            await layer.flush()
+
+    @staticmethod
+    async def receive(layer, channel, timeout=5):
+        return await asyncio.wait_for(layer.receive(channel), timeout)
+
+    async def test_send_and_group_send_round_trip(self):
+        async def test(layer):
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'direct', 'value': 1})
+            self.assertEqual(await self.receive(layer, channel), {'type': 'direct', 'value': 1})
+
+            # 已在监听时加入组：LISTEN需要重启读取任务，之后的通知不丢失
+            other = await layer.new_channel()
+            await layer.group_add('chat_1', channel)
+            await layer.group_add('chat_1', other)
+            await layer.group_send('chat_1', {'type': 'chat_message', 'content': 'hi'})
+            self.assertEqual((await self.receive(layer, channel))['content'], 'hi')
+            self.assertEqual((await self.receive(layer, other))['content'], 'hi')
+
+        await self.run_with_layer(test)
+
+    async def test_large_message_spills_to_table(self):
+        async def count_spilled(layer):
+            conn = await layer._get_conn()
+            cursor = await conn.execute(f'SELECT count(*) FROM {layer._spill_table()}')
+            return (await cursor.fetchone())[0]
+
+        async def test(layer):
+            channel = await layer.new_channel()
+            body = 'x' * 20000
+            await layer.group_add('chat_2', channel)
+            await layer.group_send('chat_2', {'type': 'chat_message', 'content': body})
+            self.assertEqual((await self.receive(layer, channel))['content'], body)
+            self.assertEqual(await count_spilled(layer), 1)
+            # 过期的溢出负载由后台任务定期清理
+            await asyncio.sleep(2.5)
+            self.assertEqual(await count_spilled(layer), 0)
+
+        await self.run_with_layer(test)
+
+    async def test_listener_reconnects_after_connection_loss(self):
+        async def test(layer):
+            channel = await layer.new_channel()
+            await layer.group_add('chat_3', channel)
+            conn = await layer._get_conn()
+            with self.assertLogs('apps.realtime.layers.postgres', 'ERROR'):
+                await conn.execute('SELECT pg_terminate_backend(%s)', (layer._listen_conn.info.backend_pid,))
+
+                # 重连后重新LISTEN全部通道；重连期间发送的消息会丢失，重试直到收到
+                for _ in range(20):
+                    await layer.group_send('chat_3', {'type': 'chat_message', 'content': 'again'})
+                    try:
+                        message = await self.receive(layer, channel, timeout=0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    break
+                else:
+                    self.fail('listener did not reconnect')
+            self.assertEqual(message['content'], 'again')
+
+        await self.run_with_layer(test)
+
+
+class ReauthTests(TestCase):
+    """测试WebSocket连接内的令牌续期"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reauth_user', password='password123')
+        self.other = User.objects.create_user(username='reauth_other', password='password123')
+        self.app = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    def tearDown(self):
+        presence_service._changes._pending.clear()
+
+    def token(self, user, seconds):
+        token = AccessToken.for_user(user)
+        token.set_exp(lifetime=timedelta(seconds=seconds))
+        return token
+
+    async def test_reauth_extends_session_and_rejects_other_user(self):
+        communicator = WebsocketCommunicator(
+            self.app, f'/ws/friends/?token={self.token(self.user, 300)}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        fresh = self.token(self.user, 3600)
+        await communicator.send_json_to({'type': 'reauth', 'token': str(fresh)})
+        response = await communicator.receive_json_from()
+        self.assertEqual(response, {'type': 'reauth_ok', 'expires_at': fresh['exp']})
+
+        await communicator.send_json_to({'type': 'reauth', 'token': str(self.token(self.other, 3600))})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'reauth_failed')
+        self.assertEqual(
+            await communicator.receive_output(),
+            {'type': 'websocket.close', 'code': REAUTH_CLOSE_CODE}
+        )
+        await communicator.disconnect()
+
+    @override_settings(REALTIME={'REAUTH_WARNING': 60, 'REAUTH_GRACE': 0})
+    async def test_overdue_token_closes_socket(self):
+        communicator = WebsocketCommunicator(
+            self.app, f'/ws/friends/?token={self.token(self.user, 1)}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        self.assertEqual((await communicator.receive_json_from())['type'], 'reauth_required')
+        self.assertEqual(
+            await communicator.receive_output(timeout=3),
+            {'type': 'websocket.close', 'code': REAUTH_CLOSE_CODE}
+        )
+        await communicator.disconnect()
+
+
+@override_settings(REALTIME={'ROOM_ACTIVITY_FLUSH_INTERVAL': 0})
+class UnreadSyncTests(TestCase):
+    """测试连接建立时大量未读消息的同步"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sync_reader', password='password123')
+        self.sender = User.objects.create_user(username='sync_sender', password='password123')
+        self.room = GroupChatRoom.objects.create(name='sync room')
+        self.room.add_members([self.user.id, self.sender.id])
+        for index in range(300):
+            Message.objects.create(
+                sender=self.sender, room_type='group', room_id=self.room.id, content=f'message {index}'
+            )
+        self.app = JWTAuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+
+    def tearDown(self):
+        presence_service._changes._pending.clear()
+
+    async def test_large_backlog_is_delivered_in_full(self):
+        communicator = WebsocketCommunicator(
+            self.app, f'/ws/chat/{self.room.id}/?token={AccessToken.for_user(self.user)}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        received = [await communicator.receive_json_from() for _ in range(300)]
+        self.assertEqual([event['type'] for event in received], ['chat_message'] * 300)
+        self.assertEqual(received[-1]['content'], 'message 299')
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
\ No newline at end of file
@@ -0,0 +1,126 @@
+import time
+import uuid
+
+from .batching import AsyncCoalescer
+from .conf import realtime_setting
+from .layers import get_ephemeral_layer
+
+# 当前进程的标识：每个进程只掌握本进程连接上的输入状态，快照携带来源，由接收方按来源合并
+PROCESS_ID = uuid.uuid4().hex
+
+
+class TypingIndicatorService:
+    """
+    输入状态服务
+    输入状态只保存在进程内存中，从不写数据库：
+    - 每个用户在每个房间内的“开始输入”按固定间隔限流，期间只续期不广播；
+    - 同一房间在一个时间窗口内的所有变化合并为一条“谁在输入”快照，
+      通过非持久化通道层发送到房间组。
+    多个worker时每个进程的快照只包含本进程的连接，接收方用TypingSnapshotMerger按来源合并。
+    """
+
+    def __init__(self):
+        # {room_id: {user_id: 过期时间}}
+        self._typing = {}
+        # {(room_id, user_id): 上次广播“开始输入”的时间}
+        self._last_started = {}
+        # {room_id: 本窗口内停止输入的用户ID集合}
+        self._stopped = {}
+        self._coalescer = None
+
+    @property
+    def _rooms(self):
+        # 延迟创建，避免在Django设置加载前读取配置
+        if self._coalescer is None:
+            self._coalescer = AsyncCoalescer(
+                realtime_setting('TYPING_FLUSH_INTERVAL'),
+                self._flush_rooms,
+            )
+        return self._coalescer
+
+    def start(self, room_id, user_id):
+        """
+        用户开始（或持续）输入
+        """
+        now = time.monotonic()
+        typing = self._typing.setdefault(room_id, {})
+        already_typing = typing.get(user_id, 0) > now
+        typing[user_id] = now + realtime_setting('TYPING_TTL')
+        self._stopped.get(room_id, set()).discard(user_id)
+
+        # 限流：仍处于输入状态且距上次广播未超过限流间隔时，只续期不广播
+        last = self._last_started.get((room_id, user_id), 0)
+        if already_typing and now - last < realtime_setting('TYPING_RATE_LIMIT'):
+            return
+        self._last_started[(room_id, user_id)] = now
+        self._rooms.add(room_id, True)
+
+    def stop(self, room_id, user_id):
+        """
+        用户停止输入（包括发送消息或断开连接）
+        """
+        typing = self._typing.get(room_id)
+        if not typing or typing.pop(user_id, None) is None:
+            return
+        if not typing:
+            self._typing.pop(room_id, None)
+        self._last_started.pop((room_id, user_id), None)
+        self._stopped.setdefault(room_id, set()).add(user_id)
+        self._rooms.add(room_id, True)
+
+    def snapshot(self, room_id):
+        """
+        获取房间当前正在输入的用户，顺带清理过期记录
+        """
+        now = time.monotonic()
+        typing = self._typing.get(room_id, {})
+        for user_id in [user_id for user_id, expires in typing.items() if expires <= now]:
+            del typing[user_id]
+            self._last_started.pop((room_id, user_id), None)
+        if not typing:
+            self._typing.pop(room_id, None)
+        return sorted(typing)
+
+    async def _flush_rooms(self, rooms):
+        channel_layer = get_ephemeral_layer()
+        for room_id in rooms:
+            await channel_layer.group_send(
+                f'chat_{room_id}',
+                {
+                    'type': 'typing.snapshot',
+                    'room_id': room_id,
+                    'source': PROCESS_ID,
+                    'typing': self.snapshot(room_id),
+                    'stopped': sorted(self._stopped.pop(room_id, ())),
+                    'ttl': realtime_setting('TYPING_TTL'),
+                }
+            )
+
+
+class TypingSnapshotMerger:
+    """
+    连接侧合并各进程的输入状态快照
+    按来源进程保存最近一次快照，超过TTL未更新的来源视为已过期，
+    合并结果是房间内完整的输入列表；仍在其他进程输入的用户不算停止。
+    """
+
+    def __init__(self):
+        # {来源进程: (过期时间, 正在输入的用户ID集合)}
+        self._sources = {}
+
+    def update(self, event):
+        """
+        记录一条快照，返回合并后的(正在输入的用户ID, 停止输入的用户ID)
+        """
+        now = time.monotonic()
+        self._sources[event.get('source')] = (now + event['ttl'], frozenset(event['typing']))
+        typing = set()
+        for source, (expires, users) in list(self._sources.items()):
+            if expires <= now:
+                del self._sources[source]
+            else:
+                typing |= users
+        return sorted(typing), sorted(set(event['stopped']) - typing)
+
+
+typing_service = TypingIndicatorService()
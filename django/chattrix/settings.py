@@ -179,16 +179,42 @@ INSTALLED_APPS += ['rest_framework', 'rest_framework_simplejwt', 'rest_framework
 ASGI_APPLICATION = "chattrix.asgi.application"
 
 # Channels配置 - 基于环境变量的配置
+REDIS_HOST = os.environ.get('REDIS_HOST', 'redis')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+# 通道层专用的多个Redis实例，逗号分隔的host:port列表，如 "redis-1:6379,redis-2:6379"
+# 配置后组和通道按一致性哈希分布到各实例（见apps/realtime/layers/sharded.py中的扩缩容说明），
+# 未配置时通道层与缓存共用REDIS_HOST
+REDIS_HOSTS = [
+    (host.partition(':')[0], int(host.partition(':')[2] or 6379))
+    for host in (item.strip() for item in os.environ.get('REDIS_HOSTS', '').split(','))
+    if host
+] or [(REDIS_HOST, REDIS_PORT)]
+
 if DJANGO_ENV == 'production':
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "apps.realtime.layers.sharded.ShardedRedisChannelLayer",
+            "CONFIG": {
+                "hosts": REDIS_HOSTS,
+            },
+        },
+        # 非持久化通道层：基于Redis发布订阅，用于输入状态等丢失无害的瞬时事件
+        "ephemeral": {
+            "BACKEND": "apps.realtime.layers.sharded.ShardedRedisPubSubChannelLayer",
             "CONFIG": {
-                "hosts": [(os.environ.get('REDIS_HOST', 'redis'), int(os.environ.get('REDIS_PORT', 6379)))],
+                "hosts": REDIS_HOSTS,
             },
         },
     }
 
+    # 缓存使用Redis的1号库（在线状态等跨进程共享的实时数据存放于此）
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/1",
+        }
+    }
+
 
     CSRF_TRUSTED_ORIGINS = ['http://www.chattrix.com', 'https://www.chattrix.com']
 else:
@@ -199,5 +225,44 @@ else:
         }
     }
 
+    # 开发环境使用进程内缓存
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
     CSRF_TRUSTED_ORIGINS = ['http://192.168.31.224:5173', 'http://localhost:4173', 'http://127.0.0.1:4173']
 
+# 可选：基于PostgreSQL LISTEN/NOTIFY的通道层（需安装psycopg 3）
+# CHANNEL_POSTGRES_DSN为空时使用DATABASES['default']的连接信息
+CHANNEL_POSTGRES_DSN = os.environ.get('CHANNEL_POSTGRES_DSN')
+POSTGRES_CHANNEL_LAYER = {
+    "BACKEND": "apps.realtime.layers.postgres.PostgresChannelLayer",
+    "CONFIG": {
+        "dsn": CHANNEL_POSTGRES_DSN,
+    },
+}
+if os.environ.get('CHANNEL_LAYER_BACKEND') == 'postgres':
+    # 不部署Redis的小型环境：通道层改用PostgreSQL（瞬时事件同样走默认通道层），
+    # 缓存仍需配置为跨进程共享的后端
+    CHANNEL_LAYERS = {"default": POSTGRES_CHANNEL_LAYER}
+elif CHANNEL_POSTGRES_DSN:
+    # 额外提供postgres别名，用于本地多进程压测及 manage.py benchmark_channel_layers 对比
+    CHANNEL_LAYERS["postgres"] = POSTGRES_CHANNEL_LAYER
+
+# 实时子系统配置（未列出的项使用apps/realtime/conf.py中的默认值）
+REALTIME = {
+    # 在线状态TTL（秒），前端心跳间隔需小于该值
+    'PRESENCE_TTL': 60,
+    # 在线状态变更合并广播窗口（秒）
+    'PRESENCE_FLUSH_INTERVAL': 0.3,
+    # 输入状态快照合并窗口（秒）、限流间隔（秒）与自动过期时间（秒）
+    'TYPING_FLUSH_INTERVAL': 0.5,
+    'TYPING_RATE_LIMIT': 2,
+    'TYPING_TTL': 6,
+    # 已读标记批量写库间隔（秒）
+    'READ_MARKER_FLUSH_INTERVAL': 5,
+    # 消息广播使用精简事件，各ASGI进程从本地资料缓存补全
+    'THIN_EVENTS': True,
+}